@@ -0,0 +1,351 @@
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+import re
+from collections import namedtuple
+
+import numpy as np
+
+from result_writers import load_results
+
+# Quantiles reported for every batch
+SUMMARY_QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+# Score an image needs to count as passing
+DEFAULT_PASS_THRESHOLD = 0.3
+
+# Bootstrap settings of the confidence intervals
+DEFAULT_RESAMPLES = 1000
+DEFAULT_CONFIDENCE = 0.95
+
+# Above this many values, the mean is bootstrapped from a histogram of this many bins instead of
+# from the values themselves, so the cost does not grow with the number of images
+BOOTSTRAP_BINS = 4096
+
+# Number of resampled values drawn at once by the exact bootstrap
+BOOTSTRAP_BLOCK_ELEMENTS = 1 << 22
+
+# Score changes smaller than this count as unchanged
+DEFAULT_DELTA_EPSILON = 1e-4
+
+# Number of largest improvements and regressions listed per comparison
+DEFAULT_TOP_CHANGES = 5
+
+# Scores of one batch as arrays. `keys` holds the first 64 bits of the SHA256 of each image file
+# as uint64, which sorts and joins much faster than hex strings; a collision is unlikely below
+# billions of images. Batches without a content hash for every image (scored without an
+# embedding cache) are keyed by a hash of the image names instead, and `hashed` is False.
+BatchScores = namedtuple("BatchScores", ["batch_name", "image_names", "scores", "keys", "hashed"])
+
+
+# Function to sort paths like Batch_2 before Batch_10
+def natural_sort_key(path):
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", path)]
+
+
+# Function to expand batch folder arguments, including glob patterns
+def expand_batch_folders(patterns):
+    """
+    Returns the batch folders matched by `patterns` in natural order, keeping the order of the
+    patterns themselves and dropping repeats.
+    """
+    batch_folders = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern), key=natural_sort_key) if any(char in pattern for char in "*?[") else [pattern]
+        batch_folders.extend(match for match in matches if match not in batch_folders)
+    return batch_folders
+
+
+# Function to build join keys from image names
+def name_keys(image_names):
+    return np.array([int(hashlib.sha256(f"name:{image_name}".encode("utf-8")).hexdigest()[:16], 16) for image_name in image_names], dtype=np.uint64)
+
+
+# Function to build join keys from content hashes
+def make_keys(image_names, content_hashes):
+    """
+    Returns (keys, hashed): a uint64 array of the leading 64 bits of each SHA256 hex digest and
+    True, or the name keys and False if any image has no recorded content hash.
+    """
+    if len(content_hashes) and all(content_hashes):
+        return np.array([int(content_hash[:16], 16) for content_hash in content_hashes], dtype=np.uint64), True
+    return name_keys(image_names), False
+
+
+# Function to check whether a columnar copy holds the latest results
+def is_current(columnar_path, results_dir):
+    """
+    A columnar copy is written when a run finishes, so it is stale if a resumed run
+    streamed more rows into `results.jsonl` afterwards.
+    """
+    jsonl_path = os.path.join(results_dir, "results.jsonl")
+    return os.path.exists(columnar_path) and (not os.path.exists(jsonl_path) or os.path.getmtime(columnar_path) >= os.path.getmtime(jsonl_path))
+
+
+# Function to load the scores of a batch folder as arrays
+def load_batch_scores(batch_folder):
+    """
+    Loads the per-image scores of `<batch_folder>/results`, reading the columnar copy
+    (`results.parquet` with pyarrow, or the `.npy` arrays) when it is current and otherwise
+    the streamed results (see result_writers.load_results).
+
+    :return: BatchScores.
+    """
+    results_dir = os.path.join(batch_folder, "results")
+    batch_name = os.path.basename(os.path.normpath(batch_folder))
+    parquet_path = os.path.join(results_dir, "results.parquet")
+    scores_path = os.path.join(results_dir, "scores.npy")
+    names_path = os.path.join(results_dir, "image_names.npy")
+    hashes_path = os.path.join(results_dir, "content_hashes.npy")
+
+    if is_current(parquet_path, results_dir):
+        try:
+            import pyarrow.parquet as pq
+
+            table = pq.read_table(parquet_path)
+            image_names = table.column("image_name").to_pylist()
+            scores = table.column("clip_score").to_numpy().astype(np.float64)
+            content_hashes = table.column("content_hash").to_pylist() if "content_hash" in table.column_names else [""] * len(image_names)
+            return BatchScores(batch_name, np.array(image_names, dtype=object), scores, *make_keys(image_names, content_hashes))
+        except ImportError:
+            pass  # Fall back to the other formats
+    if is_current(scores_path, results_dir) and os.path.exists(names_path):
+        image_names = np.load(names_path)
+        content_hashes = np.load(hashes_path).tolist() if os.path.exists(hashes_path) else [""] * len(image_names)
+        return BatchScores(batch_name, image_names.astype(object), np.load(scores_path).astype(np.float64), *make_keys(image_names.tolist(), content_hashes))
+
+    rows = load_results(results_dir)
+    image_names = [row["image_name"] for row in rows]
+    scores = np.fromiter((row["clip_score"] for row in rows), dtype=np.float64, count=len(rows))
+    content_hashes = [row.get("content_hash") or "" for row in rows]
+    return BatchScores(batch_name, np.array(image_names, dtype=object), scores, *make_keys(image_names, content_hashes))
+
+
+# Function to estimate a confidence interval of the mean by bootstrapping
+def bootstrap_mean_ci(values, resamples=DEFAULT_RESAMPLES, confidence=DEFAULT_CONFIDENCE, rng=None):
+    """
+    Returns the (low, high) percentile bootstrap interval of the mean of `values`.
+
+    Small samples are resampled directly. Larger ones are binned into BOOTSTRAP_BINS bins
+    and each resample draws multinomial bin counts, weighted by the exact mean of each bin,
+    which costs resamples x bins whatever the number of values.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    values = np.asarray(values, dtype=np.float64)
+    count = len(values)
+    if count == 0:
+        return float("nan"), float("nan")
+    low, high = values.min(), values.max()
+    if low == high:
+        return float(low), float(high)
+
+    if count <= BOOTSTRAP_BINS:
+        means = np.empty(resamples)
+        block_rows = max(1, BOOTSTRAP_BLOCK_ELEMENTS // count)
+        for start in range(0, resamples, block_rows):
+            rows = min(block_rows, resamples - start)
+            means[start:start + rows] = values[rng.integers(0, count, (rows, count))].mean(axis=1)
+    else:
+        bins = np.minimum(((values - low) / (high - low) * BOOTSTRAP_BINS).astype(np.int64), BOOTSTRAP_BINS - 1)
+        bin_counts = np.bincount(bins, minlength=BOOTSTRAP_BINS)
+        bin_means = np.bincount(bins, weights=values, minlength=BOOTSTRAP_BINS) / np.maximum(bin_counts, 1)
+        means = rng.multinomial(count, bin_counts / count, size=resamples) @ bin_means / count
+
+    tail = (1 - confidence) / 2
+    low, high = np.quantile(means, [tail, 1 - tail])
+    return float(low), float(high)
+
+
+# Function to estimate a confidence interval of a pass rate by bootstrapping
+def bootstrap_rate_ci(passed, count, resamples=DEFAULT_RESAMPLES, confidence=DEFAULT_CONFIDENCE, rng=None):
+    """
+    Returns the (low, high) percentile bootstrap interval of `passed / count`. Resampling
+    pass/fail outcomes is a binomial draw, so no values are resampled.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    if count == 0:
+        return float("nan"), float("nan")
+    rates = rng.binomial(count, passed / count, size=resamples) / count
+    tail = (1 - confidence) / 2
+    low, high = np.quantile(rates, [tail, 1 - tail])
+    return float(low), float(high)
+
+
+# Function to summarize the scores of a batch
+def summarize_scores(scores, threshold=DEFAULT_PASS_THRESHOLD, resamples=DEFAULT_RESAMPLES, confidence=DEFAULT_CONFIDENCE, rng=None):
+    """
+    Returns the count, mean, standard deviation, extremes and SUMMARY_QUANTILES of `scores`,
+    the fraction at or above `threshold`, and bootstrap intervals of the mean and pass rate.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    count = len(scores)
+    if count == 0:
+        return {"count": 0}
+    passed = int(np.count_nonzero(scores >= threshold))
+    return {
+        "count": count,
+        "mean": float(scores.mean()),
+        "std": float(scores.std()),
+        "min": float(scores.min()),
+        "max": float(scores.max()),
+        "quantiles": {f"p{round(quantile * 100)}": float(value) for quantile, value in zip(SUMMARY_QUANTILES, np.quantile(scores, SUMMARY_QUANTILES))},
+        "threshold": threshold,
+        "pass_rate": passed / count,
+        "mean_ci": bootstrap_mean_ci(scores, resamples, confidence, rng),
+        "pass_rate_ci": bootstrap_rate_ci(passed, count, resamples, confidence, rng)
+    }
+
+
+# Function to compare two batches image by image
+def compare_batches(baseline, other, resamples=DEFAULT_RESAMPLES, confidence=DEFAULT_CONFIDENCE, epsilon=DEFAULT_DELTA_EPSILON, top=DEFAULT_TOP_CHANGES, rng=None):
+    """
+    Matches the images of two BatchScores by content hash, or by name unless both batches
+    recorded content hashes, and summarizes the score changes from `baseline` to `other`.
+    Images stored under several names count once.
+
+    :return: (summary dictionary, per-image deltas as a tuple of arrays
+             (image names, baseline scores, other scores, deltas)).
+    """
+    if baseline.hashed and other.hashed:
+        baseline_keys, other_keys = baseline.keys, other.keys
+    else:
+        baseline_keys = name_keys(baseline.image_names) if baseline.hashed else baseline.keys
+        other_keys = name_keys(other.image_names) if other.hashed else other.keys
+    baseline_keys, baseline_first = np.unique(baseline_keys, return_index=True)
+    other_keys, other_first = np.unique(other_keys, return_index=True)
+    _, baseline_indices, other_indices = np.intersect1d(baseline_keys, other_keys, assume_unique=True, return_indices=True)
+    baseline_indices = baseline_first[baseline_indices]
+    other_indices = other_first[other_indices]
+    baseline_scores = baseline.scores[baseline_indices]
+    other_scores = other.scores[other_indices]
+    deltas = other_scores - baseline_scores
+    image_names = other.image_names[other_indices]
+
+    summary = {
+        "baseline": baseline.batch_name,
+        "batch": other.batch_name,
+        "matched": len(deltas),
+        "only_in_baseline": len(baseline_keys) - len(deltas),
+        "only_in_batch": len(other_keys) - len(deltas)
+    }
+    def describe(indices):
+        return [{"image_name": image_names[index], "baseline_score": float(baseline_scores[index]), "score": float(other_scores[index]), "delta": float(deltas[index])} for index in indices]
+
+    if len(deltas):
+        order = np.argsort(deltas, kind="stable")
+        improvements = order[::-1][:top]
+        regressions = order[:top]
+        summary.update({
+            "mean_delta": float(deltas.mean()),
+            "mean_delta_ci": bootstrap_mean_ci(deltas, resamples, confidence, rng),
+            "improved": int(np.count_nonzero(deltas > epsilon)),
+            "regressed": int(np.count_nonzero(deltas < -epsilon)),
+            "unchanged": int(np.count_nonzero(np.abs(deltas) <= epsilon)),
+            "top_improvements": describe(improvements[deltas[improvements] > epsilon]),
+            "top_regressions": describe(regressions[deltas[regressions] < -epsilon])
+        })
+    return summary, (image_names, baseline_scores, other_scores, deltas)
+
+
+# Function to analyze a list of batch folders against a baseline
+def analyze_batches(batch_folders, baseline=None, threshold=DEFAULT_PASS_THRESHOLD, resamples=DEFAULT_RESAMPLES, confidence=DEFAULT_CONFIDENCE, top=DEFAULT_TOP_CHANGES, seed=0, deltas_csv=None):
+    """
+    Summarizes every batch and compares each one with the baseline batch (the first one by
+    default). Batches are loaded one at a time and only the baseline is kept in memory.
+    With `deltas_csv`, every matched image of every comparison is written to that CSV file.
+
+    :return: Report dictionary with a "batches" and a "comparisons" list.
+    """
+    if not batch_folders:
+        raise ValueError("No batch folders to analyze.")
+    rng = np.random.default_rng(seed)
+    baseline_folder = baseline or batch_folders[0]
+    baseline_scores = load_batch_scores(baseline_folder)
+    report = {"baseline": baseline_scores.batch_name, "confidence": confidence, "batches": [], "comparisons": []}
+
+    deltas_file = open(deltas_csv, "w", newline="", encoding="utf-8") if deltas_csv else None
+    try:
+        if deltas_file:
+            deltas_writer = csv.writer(deltas_file)
+            deltas_writer.writerow(["batch", "image_name", "baseline_score", "clip_score", "delta"])
+        for batch_folder in batch_folders:
+            batch_scores = baseline_scores if os.path.normpath(batch_folder) == os.path.normpath(baseline_folder) else load_batch_scores(batch_folder)
+            report["batches"].append(dict(batch=batch_scores.batch_name, **summarize_scores(batch_scores.scores, threshold, resamples, confidence, rng)))
+            if batch_scores is baseline_scores:
+                continue
+            comparison, (image_names, before, after, deltas) = compare_batches(baseline_scores, batch_scores, resamples, confidence, top=top, rng=rng)
+            report["comparisons"].append(comparison)
+            if deltas_file:
+                deltas_writer.writerows(zip([batch_scores.batch_name] * len(deltas), image_names, before.tolist(), after.tolist(), deltas.tolist()))
+    finally:
+        if deltas_file:
+            deltas_file.close()
+    return report
+
+
+# Function to format an analysis report as text
+def format_report(report):
+    """
+    Returns a compact text report: one line per batch, then one block per comparison.
+    """
+    percent = round(report["confidence"] * 100)
+    lines = [f"{'batch':<16} {'images':>9} {'mean':>8} {f'{percent}% CI':>19} {'p5':>8} {'p50':>8} {'p95':>8} {'pass':>7}"]
+    for summary in report["batches"]:
+        if not summary["count"]:
+            lines.append(f"{summary['batch']:<16} {0:>9}")
+            continue
+        quantiles = summary["quantiles"]
+        lines.append(
+            f"{summary['batch']:<16} {summary['count']:>9} {summary['mean']:>8.4f} "
+            f"{'[' + format(summary['mean_ci'][0], '.4f') + ', ' + format(summary['mean_ci'][1], '.4f') + ']':>19} "
+            f"{quantiles['p5']:>8.4f} {quantiles['p50']:>8.4f} {quantiles['p95']:>8.4f} {summary['pass_rate']:>7.1%}"
+        )
+    for comparison in report["comparisons"]:
+        lines.append("")
+        lines.append(f"{comparison['batch']} vs {comparison['baseline']}: {comparison['matched']} matched images, {comparison['only_in_baseline']} only in {comparison['baseline']}, {comparison['only_in_batch']} only in {comparison['batch']}")
+        if not comparison["matched"]:
+            continue
+        low, high = comparison["mean_delta_ci"]
+        lines.append(f"  mean delta {comparison['mean_delta']:+.4f} ({percent}% CI [{low:+.4f}, {high:+.4f}]), {comparison['improved']} improved, {comparison['regressed']} regressed, {comparison['unchanged']} unchanged")
+        for label, changes in [("improved", comparison["top_improvements"]), ("regressed", comparison["top_regressions"])]:
+            for change in changes:
+                lines.append(f"  {label:<9} {change['delta']:+.4f}  {change['baseline_score']:.4f} -> {change['score']:.4f}  {change['image_name']}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize the scores of batch folders and compare them image by image, without re-scoring.")
+    parser.add_argument("batch_folders", type=str, nargs="+", help="Batch folders or glob patterns (e.g., 'Batches/Batch_*'), analyzed in natural order.")
+    parser.add_argument("--baseline", type=str, default=None, help="Batch folder the others are compared with. Defaults to the first one.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_PASS_THRESHOLD, help="Score at or above which an image passes.")
+    parser.add_argument("--resamples", type=int, default=DEFAULT_RESAMPLES, help="Number of bootstrap resamples of the confidence intervals.")
+    parser.add_argument("--confidence", type=float, default=DEFAULT_CONFIDENCE, help="Confidence level of the intervals.")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP_CHANGES, help="Number of largest improvements and regressions listed per comparison.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the bootstrap, so reports are reproducible.")
+    parser.add_argument("--output", type=str, default=None, help="Also write the full report to this JSON file.")
+    parser.add_argument("--deltas_csv", type=str, default=None, help="Write the score change of every matched image to this CSV file.")
+    args = parser.parse_args(argv)
+
+    batch_folders = expand_batch_folders(args.batch_folders)
+    missing = [batch_folder for batch_folder in batch_folders + [args.baseline or batch_folders[0]] if not os.path.isdir(os.path.join(batch_folder, "results"))]
+    if missing:
+        parser.error(f"No results folder in: {', '.join(missing)}")
+    if not 0 < args.confidence < 1:
+        parser.error("--confidence must be between 0 and 1.")
+
+    report = analyze_batches(batch_folders, args.baseline, args.threshold, args.resamples, args.confidence, args.top, args.seed, args.deltas_csv)
+    print(format_report(report))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+        print(f"Report saved to: {args.output}")
+    if args.deltas_csv:
+        print(f"Per-image deltas saved to: {args.deltas_csv}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
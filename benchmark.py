@@ -0,0 +1,276 @@
+import os
+
+# The benchmark measures the CPU path only; hide GPUs before torch is imported
+os.environ["CUDA_VISIBLE_DEVICES"] = ""
+
+import argparse
+import contextlib
+import copy
+import csv
+import json
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+import calculate_clip_score
+from calculate_clip_score import calculate_clip_scores_and_save, encode_image_batch, encode_prompts
+from cpu_profiles import apply_cpu_profile, parse_cpu_profile, set_cpu_threads
+from dynamic_model_loader import load_model
+from image_pipeline import prefetch_images
+from result_writers import ResultWriter
+from scored_images import save_scored_image
+
+# Stages timed for every configuration, in pipeline order
+STAGES = ["decode", "image_encode", "text_encode", "scoring", "file_writes", "end_to_end"]
+
+# Prompts encoded by the text stage
+BENCHMARK_PROMPTS = [
+    "A scenic view of a mountain lake.",
+    "A photo of a cat sleeping on a sofa.",
+    "A busy city street at night.",
+    "A plate of food on a wooden table.",
+]
+
+
+# Function to generate a folder of synthetic JPEG images
+def generate_images(image_dir, count, width, height, seed=0):
+    """
+    Writes `count` JPEG images of width x height to `image_dir`. Images are smooth gradients
+    with noise, so they decode and compress like photos rather than like pure noise.
+    """
+    os.makedirs(image_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    for index in range(count):
+        phase = rng.uniform(0, 2 * np.pi, size=3)
+        frequency = rng.uniform(2, 12, size=3) / max(width, height)
+        channels = [127 + 100 * np.sin(2 * np.pi * frequency[c] * (x + y * (c + 1)) + phase[c]) for c in range(3)]
+        pixels = np.stack(channels, axis=-1) + rng.normal(0, 12, size=(height, width, 3))
+        Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(os.path.join(image_dir, f"synthetic_{index:05d}.jpg"), quality=90)
+
+
+# Function to run a stage and return its duration
+def time_stage(function, repeats=1):
+    """
+    Runs `function` `repeats` times and returns (fastest seconds, result of the last run).
+    """
+    best = float("inf")
+    result = None
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start_time)
+    return best, result
+
+
+# Function to benchmark the stages of one model/profile/batch size/worker configuration
+def benchmark_configuration(model, preprocess, device, image_dir, work_dir, batch_size, decode_workers, repeats=1):
+    """
+    Times each pipeline stage separately on the images in `image_dir`, then the whole
+    pipeline (`calculate_clip_scores_and_save`) end to end.
+
+    :return: Dictionary with the seconds spent in each stage.
+    """
+    image_paths = [os.path.join(image_dir, name) for name in sorted(os.listdir(image_dir)) if os.path.isfile(os.path.join(image_dir, name))]
+
+    def decode():
+        decoded = prefetch_images(((path, path) for path in image_paths), preprocess, workers=decode_workers, max_pending=2 * batch_size + decode_workers)
+        return [(path, tensor) for path, tensor, _ in decoded if tensor is not None]
+
+    def image_encode():
+        tensors = [tensor for _, tensor in decoded_images]
+        return torch.cat([encode_image_batch(model, tensors[start:start + batch_size], device) for start in range(0, len(tensors), batch_size)])
+
+    def text_encode():
+        calculate_clip_score.TEXT_EMBEDDING_CACHE.clear()
+        return encode_prompts(model, BENCHMARK_PROMPTS, device)
+
+    def scoring():
+        return (image_features @ text_features.T).tolist()
+
+    def file_writes():
+        results_dir = os.path.join(work_dir, "write_results")
+        scored_images_dir = os.path.join(work_dir, "write_scored_images")
+        shutil.rmtree(results_dir, ignore_errors=True)
+        shutil.rmtree(scored_images_dir, ignore_errors=True)
+        os.makedirs(scored_images_dir)
+        with ResultWriter(results_dir) as writer:
+            for index, ((path, _), row) in enumerate(zip(decoded_images, scores), start=1):
+                scored_image_name = save_scored_image(path, scored_images_dir, row[0])
+                writer.write({"image_index": index, "image_name": os.path.basename(path), "clip_score": row[0], "scored_image_path": scored_image_name})
+
+    def end_to_end():
+        output_dir = os.path.join(work_dir, "end_to_end")
+        shutil.rmtree(output_dir, ignore_errors=True)
+        calculate_clip_score.TEXT_EMBEDDING_CACHE.clear()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            return calculate_clip_scores_and_save(image_dir, BENCHMARK_PROMPTS[0], output_dir, model, preprocess, device, batch_size=batch_size, decode_workers=decode_workers)[0]
+
+    timings = {}
+    timings["decode"], decoded_images = time_stage(decode, repeats)
+    timings["image_encode"], image_features = time_stage(image_encode, repeats)
+    timings["text_encode"], text_features = time_stage(text_encode, repeats)
+    timings["scoring"], scores = time_stage(scoring, repeats)
+    timings["file_writes"], _ = time_stage(file_writes, repeats)
+    timings["end_to_end"], _ = time_stage(end_to_end, repeats)
+    return timings
+
+
+# Function to time chart rendering for a batch of scores
+def benchmark_charts(image_count, work_dir, chart_type=1, chart_workers=0, repeats=1):
+    """
+    Renders the summary chart and one single-image chart per image for synthetic scores.
+    """
+    from visualization_options import visualize
+
+    rng = np.random.default_rng(0)
+    scores = [{"image_index": index, "clip_score": float(score)} for index, score in enumerate(rng.uniform(0.15, 0.35, image_count), start=1)]
+    advanced_settings = {"figsize": (12, 6), "xlabel": "Images", "ylabel": "CLIP Scores"}
+
+    def render():
+        charts_dir = os.path.join(work_dir, "charts")
+        images_chart_dir = os.path.join(work_dir, "images_chart")
+        shutil.rmtree(charts_dir, ignore_errors=True)
+        shutil.rmtree(images_chart_dir, ignore_errors=True)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            visualize(scores, chart_type, "#1f77b4", advanced_settings, charts_dir, images_chart_dir, single_chart_type=chart_type, chart_workers=chart_workers)
+
+    seconds, _ = time_stage(render, repeats)
+    return seconds
+
+
+# Function to describe the machine and code a benchmark ran on
+def get_metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "torch_version": torch.__version__,
+        "python_version": platform.python_version()
+    }
+
+
+# Function to run the whole benchmark sweep
+def run_benchmark(models, cpu_profiles, batch_sizes, decode_workers_list, image_dir, work_dir, repeats=1, chart_workers_list=(0,), skip_charts=False):
+    """
+    Benchmarks every combination of model, CPU profile, batch size and decode worker count.
+
+    :return: List of result dictionaries, one per configuration (plus one per chart worker count).
+    """
+    image_names = sorted(name for name in os.listdir(image_dir) if os.path.isfile(os.path.join(image_dir, name)))
+    image_count = len(image_names)
+    try:
+        with Image.open(os.path.join(image_dir, image_names[0])) as image:
+            width, height = image.size
+    except (IndexError, OSError):
+        width, height = None, None
+    results = []
+    for model_name in models:
+        load_timings = {}
+        load_start_time = time.perf_counter()
+        base_model, preprocess, device = load_model(model_name, timings=load_timings)
+        load_seconds = time.perf_counter() - load_start_time
+        for cpu_profile in cpu_profiles:
+            # Profiles may change the model in place, so each one gets its own copy
+            model = apply_cpu_profile(copy.deepcopy(base_model), cpu_profile, device) if parse_cpu_profile(cpu_profile) else base_model
+            for batch_size in batch_sizes:
+                for decode_workers in decode_workers_list:
+                    print(f"Benchmarking {model_name} ({cpu_profile}), batch size {batch_size}, {decode_workers} decode workers...")
+                    timings = benchmark_configuration(model, preprocess, device, image_dir, work_dir, batch_size, decode_workers, repeats)
+                    result = {
+                        "stage_group": "scoring",
+                        "model": model_name,
+                        "cpu_profile": cpu_profile,
+                        "batch_size": batch_size,
+                        "decode_workers": decode_workers,
+                        "images": image_count,
+                        "width": width,
+                        "height": height,
+                        "load": round(load_seconds, 4)
+                    }
+                    result.update({stage: round(timings[stage], 4) for stage in STAGES})
+                    result["images_per_second"] = round(image_count / timings["end_to_end"], 2)
+                    results.append(result)
+                    print("  " + ", ".join(f"{stage} {timings[stage]:.3f}s" for stage in STAGES) + f", {result['images_per_second']} images/s")
+
+    if not skip_charts:
+        for chart_workers in chart_workers_list:
+            print(f"Benchmarking chart rendering for {image_count} images, {chart_workers} chart workers...")
+            seconds = benchmark_charts(image_count, work_dir, chart_workers=chart_workers, repeats=repeats)
+            results.append({"stage_group": "charts", "images": image_count, "chart_workers": chart_workers, "chart_rendering": round(seconds, 4), "images_per_second": round(image_count / seconds, 2)})
+            print(f"  chart_rendering {seconds:.3f}s")
+    return results
+
+
+# Function to save benchmark results as JSON and CSV
+def save_results(results, metadata, output_path):
+    """
+    Writes `<output_path>.json` with metadata and results, and `<output_path>.csv` with one
+    row per result (metadata repeated in every row, so CSV files from several commits can be concatenated).
+    """
+    base_path = os.path.splitext(output_path)[0]
+    json_path = f"{base_path}.json"
+    csv_path = f"{base_path}.csv"
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump({"metadata": metadata, "results": results}, f, indent=4)
+
+    fieldnames = list(metadata)
+    for result in results:
+        fieldnames += [key for key in result if key not in fieldnames]
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        for result in results:
+            writer.writerow({**metadata, **result})
+    return json_path, csv_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the CLIP scoring pipeline on the CPU with synthetic images.")
+    parser.add_argument("--models", type=str, nargs="+", default=["ViT-B/32"], help="Models to benchmark.")
+    parser.add_argument("--cpu_profiles", type=str, nargs="+", default=["fp32"], help="CPU profiles to benchmark (see cpu_profiles.py).")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 8, 32], help="Batch sizes to sweep.")
+    parser.add_argument("--decode_workers", type=int, nargs="+", default=[0, 4], help="Decode worker counts to sweep.")
+    parser.add_argument("--chart_workers", type=int, nargs="+", default=[0], help="Chart worker counts to sweep.")
+    parser.add_argument("--images", type=int, default=64, help="Number of synthetic images.")
+    parser.add_argument("--resolution", type=str, default="640x480", help="Synthetic image size as widthxheight.")
+    parser.add_argument("--image_dir", type=str, default=None, help="Benchmark these images instead of synthetic ones.")
+    parser.add_argument("--repeats", type=int, default=1, help="Runs per stage; the fastest is reported.")
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op threads used by torch.")
+    parser.add_argument("--skip_charts", action="store_true", help="Do not benchmark chart rendering.")
+    parser.add_argument("--output", type=str, default="benchmark_results.json", help="Results file; a .csv with the same name is written too.")
+    args = parser.parse_args(argv)
+
+    for cpu_profile in args.cpu_profiles:
+        parse_cpu_profile(cpu_profile)
+    width, height = (int(value) for value in args.resolution.lower().split("x"))
+    set_cpu_threads(args.threads)
+
+    with tempfile.TemporaryDirectory(prefix="clip_benchmark_") as work_dir:
+        image_dir = args.image_dir
+        if image_dir is None:
+            image_dir = os.path.join(work_dir, "images")
+            print(f"Generating {args.images} synthetic {width}x{height} images...")
+            generate_images(image_dir, args.images, width, height)
+        results = run_benchmark(args.models, args.cpu_profiles, args.batch_sizes, args.decode_workers, image_dir, work_dir, repeats=args.repeats, chart_workers_list=args.chart_workers, skip_charts=args.skip_charts)
+
+    json_path, csv_path = save_results(results, get_metadata(), args.output)
+    print(f"Benchmark results saved to: {json_path} and {csv_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
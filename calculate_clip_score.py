@@ -1,43 +1,296 @@
 import argparse
 import csv
+import io
 import json
 import os
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+# Start of the timed imports reported in the startup breakdown
+IMPORT_START_TIME = time.perf_counter()
+
 import clip
+import numpy as np
 import torch
-from PIL import Image
 
-from chart_selection import select_chart_type, select_color
+from chart_selection import DEFAULT_COLOR, parse_figsize, parse_grid, select_chart_type, select_color, validate_chart_type, validate_color
+from cpu_profiles import CPU_PROFILE_OPTIONS, apply_cpu_profile, get_profiled_model_name, parse_cpu_profile, set_cpu_threads
+from dedup import DEDUP_METHODS, find_duplicates, save_clusters, summarize_clusters
 from dynamic_model_loader import load_model, select_model_based_on_vram
-from prompt_selection import get_prompt_from_folder
-from visualization_options import visualize
+from embedding_cache import CACHE_DIR, DEFAULT_MAX_ENTRIES, EmbeddingCache, hash_bytes, hash_file
+from image_pipeline import DEFAULT_MAX_DECODE_PIXELS, prefetch_images
+from input_sources import IMAGE_FILTERS, SHARD_METHODS, Shard, is_manifest, iter_source, source_exists
+from metrics import LOG_LEVELS, PROFILERS, Metrics, configure_logging, logger, profile_run, timed_iter
+from model_pool import ModelPool
+from prompt_selection import get_all_prompts_from_folder, get_prompt_from_folder
+from result_writers import COLUMNAR_FORMATS, DEFAULT_FLUSH_EVERY, RESULT_FIELDS, ResultWriter, iter_results, load_results
+from scored_images import SCORED_IMAGE_MODES, save_scored_image
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_START_TIME
 
+# In-process cache of normalized prompt embeddings, keyed by (model name, prompt); the scoring server
+# encodes prompts from several threads, so every access goes through the lock
+TEXT_EMBEDDING_CACHE = OrderedDict()
+TEXT_EMBEDDING_CACHE_SIZE = 1024
+TEXT_EMBEDDING_CACHE_LOCK = threading.Lock()
+
+# An image waiting to be scored: either a preprocessed tensor or features loaded from the embedding cache.
+# Archive members have no image_path and keep their bytes in image_data; prompt is an optional per-image prompt.
+ImageEntry = namedtuple("ImageEntry", ["image_name", "image_path", "image_tensor", "content_hash", "cached_features", "queued_at", "image_data", "prompt"], defaults=[None, None, None, None, None])
 
 # Function to create output directory
 def create_output_dir(output_dir):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-# Function to find the next batch folder
+# Function to find and claim the next batch folder
 def get_next_batch_folder(base_dir):
     """
-    Determines the next available batch folder name.
+    Creates the next available batch folder and returns its path.
+    The folder is claimed with os.mkdir, which fails if it already exists, so runs started
+    at the same time (also on other hosts sharing the filesystem) never get the same folder.
+    """
+    os.makedirs(base_dir, exist_ok=True)
+    batch_folders = [folder for folder in os.listdir(base_dir) if folder.startswith("Batch_")]
+    batch_numbers = [int(folder.split("_")[1]) for folder in batch_folders if folder.split("_")[1].isdigit()]
+    next_batch_number = max(batch_numbers) + 1 if batch_numbers else 1
+    while True:
+        batch_folder = os.path.join(base_dir, f"Batch_{next_batch_number}")
+        try:
+            os.mkdir(batch_folder)
+            return batch_folder
+        except FileExistsError:
+            next_batch_number += 1
+
+# Function to find the most recent batch folder
+def get_latest_batch_folder(base_dir):
+    """
+    Returns the existing batch folder with the highest number, or None if there is none.
     """
     if not os.path.exists(base_dir):
-        os.makedirs(base_dir)
-        return os.path.join(base_dir, "Batch_1")
+        return None
 
     batch_folders = [folder for folder in os.listdir(base_dir) if folder.startswith("Batch_")]
     batch_numbers = [int(folder.split("_")[1]) for folder in batch_folders if folder.split("_")[1].isdigit()]
-    next_batch_number = max(batch_numbers) + 1 if batch_numbers else 1
-    return os.path.join(base_dir, f"Batch_{next_batch_number}")
+    return os.path.join(base_dir, f"Batch_{max(batch_numbers)}") if batch_numbers else None
+
+# Function to find the output folder of one shard of a batch
+def get_shard_dir(batch_folder, shard):
+    """
+    Returns `<batch_folder>/shards/shard_<index>_of_<count>`, where a sharded run writes its
+    results until sharded_scoring.merge_shards combines them into the batch folder.
+    """
+    return os.path.join(batch_folder, "shards", f"shard_{shard.index}_of_{shard.count}")
+
+# Function to encode a batch of preprocessed images
+def encode_image_batch(model, images, device):
+    """
+    Stacks preprocessed image tensors and encodes them in a single forward pass.
+    Returns the normalized image features, one row per image.
+    """
+    image_input = torch.stack(images).to(device)
+    with torch.inference_mode():
+        image_features = model.encode_image(image_input)
+        image_features /= image_features.norm(dim=-1, keepdim=True)
+    return image_features
+
+# Function to encode prompts, reusing cached embeddings
+def encode_prompts(model, prompts, device, model_name=None):
+    """
+    Tokenizes, encodes and normalizes a list of prompts, returning one row per prompt.
+    Embeddings are cached per (model_name, prompt); prompts not in the cache are encoded
+    together in a single forward pass. When `model_name` is not given the model object
+    identity is used as the cache key. The cache is safe to use from several threads; the model
+    itself runs outside the cache lock.
+    """
+    model_key = model_name if model_name is not None else id(model)
+    found = {}
+    with TEXT_EMBEDDING_CACHE_LOCK:
+        for prompt in dict.fromkeys(prompts):
+            if (model_key, prompt) in TEXT_EMBEDDING_CACHE:
+                TEXT_EMBEDDING_CACHE.move_to_end((model_key, prompt))
+                found[prompt] = TEXT_EMBEDDING_CACHE[(model_key, prompt)]
+
+    missing = [prompt for prompt in dict.fromkeys(prompts) if prompt not in found]
+    if missing:
+        text = clip.tokenize(missing).to(device)
+        with torch.inference_mode():
+            text_features = model.encode_text(text)
+            text_features /= text_features.norm(dim=-1, keepdim=True)
+        with TEXT_EMBEDDING_CACHE_LOCK:
+            for prompt, features in zip(missing, text_features):
+                TEXT_EMBEDDING_CACHE[(model_key, prompt)] = features
+                found[prompt] = features
+            while len(TEXT_EMBEDDING_CACHE) > TEXT_EMBEDDING_CACHE_SIZE:
+                TEXT_EMBEDDING_CACHE.popitem(last=False)
+    return torch.stack([found[prompt] for prompt in prompts]).to(device)
+
+# Function to encode a single prompt
+def encode_prompt(model, prompt, device, model_name=None):
+    """
+    Returns the normalized text features of a single prompt with shape (1, dim).
+    """
+    return encode_prompts(model, [prompt], device, model_name=model_name)
+
+# Function to preprocess images and group them into batches
+def iter_image_batches(target_dir, preprocess, batch_size, embedding_cache=None, decode_workers=0, use_processes=False, skip_names=None, metrics=None, recursive=False, image_filter="extension", shard=None, max_decode_pixels=DEFAULT_MAX_DECODE_PIXELS, reduced_decode=False):
+    """
+    Yields lists of ImageEntry with at most `batch_size` entries, in the order the input
+    source yields them. `target_dir` is any source accepted by input_sources.iter_source
+    (a directory, a manifest or tar/zip shards); it is read lazily as batches are consumed.
+    Files that fail to open or preprocess are skipped, as are names in `skip_names`. With an embedding cache, files are
+    hashed first and cached images are not decoded at all; without one, entries have no content_hash. With `decode_workers`, images
+    are decoded and preprocessed on a worker pool while the caller encodes earlier batches;
+    at most two batches are prepared ahead. With `metrics`, hashing, decode and preprocess
+    times are recorded and each entry carries the time it was queued. With a `shard`
+    (input_sources.Shard), only the images of that shard are read. Images above
+    `max_decode_pixels` are downscaled while decoding; `reduced_decode` decodes every image
+    at the smallest size the preprocess needs (see image_pipeline.decode_bounded).
+    """
+    def scan_images():
+        for image_name, image_path, image_data, prompt in iter_source(target_dir, recursive=recursive, image_filter=image_filter, shard=shard):
+            if skip_names and image_name in skip_names:
+                continue
+
+            logger.debug(f"Processing: {image_name}")
+            queued_at = time.perf_counter() if metrics is not None else None
+            content_hash = None
+            cached_features = None
+            if embedding_cache is not None:
+                try:
+                    content_hash = hash_file(image_path) if image_data is None else hash_bytes(image_data)
+                except OSError as e:
+                    logger.warning(f"Error processing {image_name}: {e}")
+                    continue
+                cached_features = embedding_cache.get(content_hash)
+                if metrics is not None:
+                    metrics.add_time("hash", time.perf_counter() - queued_at)
+
+            entry = ImageEntry(image_name, image_path, None, content_hash, cached_features, queued_at, image_data, prompt)
+            if cached_features is not None:
+                yield entry, None
+            else:
+                yield entry, image_path if image_data is None else io.BytesIO(image_data)
+
+    batch = []
+    max_pending = 2 * batch_size + decode_workers
+    for entry, image_tensor, error, *stage_timings in prefetch_images(scan_images(), preprocess, workers=decode_workers, use_processes=use_processes, max_pending=max_pending, timings=metrics is not None, max_pixels=max_decode_pixels, reduced_decode=reduced_decode):
+        if metrics is not None:
+            for stage, seconds in stage_timings[0].items():
+                metrics.add_time(stage, seconds)
+        if error is not None:
+            logger.warning(f"Error processing {entry.image_name}: {error}")
+            if metrics is not None:
+                metrics.count("images_failed")
+            continue
+        if image_tensor is not None:
+            entry = entry._replace(image_tensor=image_tensor)
+        batch.append(entry)
+
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+# Function to encode the images of a batch, isolating failures
+def encode_image_entries(model, entries, device):
+    """
+    Encodes the image tensors of the given entries in one forward pass.
+    If the batched forward pass fails, each image is retried on its own so that a bad
+    image only drops itself. Returns normalized features aligned with `entries`, with
+    None for images that could not be encoded.
+    """
+    if not entries:
+        return []
+    try:
+        return list(encode_image_batch(model, [entry.image_tensor for entry in entries], device))
+    except Exception as e:
+        if len(entries) == 1:
+            logger.warning(f"Error processing {entries[0].image_name}: {e}")
+            return [None]
+        logger.warning(f"Batch encode failed ({e}), retrying images one by one.")
+        features = []
+        for entry in entries:
+            features.extend(encode_image_entries(model, [entry], device))
+        return features
+
+# Function to score a batch of images against one or more prompts
+def score_image_batch(batch, text_features, model, device, embedding_cache=None, metrics=None):
+    """
+    Calculates CLIP scores for a batch of ImageEntry against precomputed, normalized text
+    features of shape (num_prompts, dim). Only entries without cached features go through
+    the image encoder; newly encoded features are stored in `embedding_cache` if given.
+    Returns a list of (image_name, image_path, scores), where `scores` holds one similarity
+    per prompt. With `metrics`, encode and similarity times and cache use are recorded.
+    """
+    to_encode = [entry for entry in batch if entry.cached_features is None]
+    start_time = time.perf_counter()
+    new_features = iter(encode_image_entries(model, to_encode, device))
+    if metrics is not None:
+        encode_seconds = time.perf_counter() - start_time
+        metrics.count("images_encoded", len(to_encode))
+        metrics.count("images_from_cache", len(batch) - len(to_encode))
+        if to_encode:
+            metrics.add_time("encode", encode_seconds)
+            metrics.observe("batch_encode_ms", encode_seconds * 1000)
+    scored_entries = []
+    rows = []
+    for entry in batch:
+        if entry.cached_features is not None:
+            features = torch.from_numpy(entry.cached_features).to(text_features.device)
+        else:
+            features = next(new_features)
+            if features is None:
+                if metrics is not None:
+                    metrics.count("images_failed")
+                continue
+            if embedding_cache is not None and entry.content_hash is not None:
+                embedding_cache.put(entry.content_hash, features.float().cpu().numpy())
+        scored_entries.append(entry)
+        rows.append(features.to(text_features.dtype))
+
+    if not rows:
+        return []
+    start_time = time.perf_counter()
+    scores = (torch.stack(rows) @ text_features.T).tolist()
+    if metrics is not None:
+        metrics.add_time("similarity", time.perf_counter() - start_time)
+    return [(entry.image_name, entry.image_path, row) for entry, row in zip(scored_entries, scores)]
 
 # Function to calculate CLIP scores and save images, charts, and results
-def calculate_clip_scores_and_save(target_dir, prompt, output_dir, model, preprocess, device):
+def calculate_clip_scores_and_save(target_dir, prompt, output_dir, model, preprocess, device, batch_size=1, model_name=None, embedding_cache=None, decode_workers=0, use_processes=False, scored_image_mode="link", resume=False, flush_every=DEFAULT_FLUSH_EVERY, columnar=None, metrics=None, recursive=False, image_filter="extension", dedup=None, dedup_threshold=None, score_duplicates=False, shard=None, max_decode_pixels=DEFAULT_MAX_DECODE_PIXELS, reduced_decode=False, stop_event=None):
     """
     Calculates CLIP scores for images, saves processed images, results, and prepares folders for charts.
+    Images are preprocessed one by one and encoded in mini-batches of `batch_size`;
+    results keep the order of the input source (see iter_image_batches). The prompt is
+    encoded once per run. Images with their own prompt in a manifest are scored against
+    that prompt instead, and the results get a `prompt` column.
+    With an `embedding_cache`, only new or changed images are encoded. `decode_workers`
+    and `use_processes` configure the parallel decode/preprocess pipeline.
+    `max_decode_pixels` and `reduced_decode` bound the size images are decoded at.
+    `scored_image_mode` selects how `scored_images` is written (see scored_images.SCORED_IMAGE_MODES).
+    Results are streamed to `results.csv` and `results.jsonl` as they are scored (see
+    result_writers.ResultWriter); with `resume`, images already in the results are skipped.
+    Stage timings, counters and per-image latencies are collected in `metrics` (a new
+    metrics.Metrics if not given) and written to `results/metrics.json`.
+    With `dedup` (one of dedup.DEDUP_METHODS), images are first grouped into duplicate clusters,
+    written to `results/clusters.csv`, and only the first image of each cluster is scored
+    unless `score_duplicates` is set. The "clip" method compares cached embeddings, so it
+    needs an `embedding_cache`; images not cached yet are encoded into it first.
+    With a `shard` (input_sources.Shard), only that part of the source is scored. Duplicate
+    clusters are still found over the whole source, so every shard skips the same duplicates.
+    Once `stop_event` (a threading.Event) is set, scoring stops after the current batch;
+    the results so far are saved, and a run with `resume` continues from them.
     """
-    if not os.path.exists(target_dir):
+    if not source_exists(target_dir):
         raise FileNotFoundError(f"Target directory '{target_dir}' does not exist.")
+    if batch_size < 1:
+        raise ValueError(f"Batch size must be at least 1, got {batch_size}.")
 
     # Create necessary subdirectories
     scored_images_dir = os.path.join(output_dir, "scored_images")
@@ -50,113 +303,500 @@ def calculate_clip_scores_and_save(target_dir, prompt, output_dir, model, prepro
     os.makedirs(images_chart_dir, exist_ok=True)
     os.makedirs(results_dir, exist_ok=True)
 
-    # Process images and calculate scores
-    results = []
-    for image_name in os.listdir(target_dir):
-        image_path = os.path.join(target_dir, image_name)
-        if not os.path.isfile(image_path):  # Skip non-files
-            print(f"Skipping non-file: {image_name}")
-            continue
-
-        try:
-            # Preprocess the image
-            print(f"Processing: {image_name}")
-            image = preprocess(Image.open(image_path)).unsqueeze(0).to(device)
-            text = clip.tokenize([prompt]).to(device)
-
-            # Calculate features
-            with torch.no_grad():
-                image_features = model.encode_image(image)
-                text_features = model.encode_text(text)
-
-            # Normalize and calculate similarity
-            image_features /= image_features.norm(dim=-1, keepdim=True)
-            text_features /= text_features.norm(dim=-1, keepdim=True)
-            score = (image_features @ text_features.T).item()
-            print(f"Score for {image_name}: {score}")
-
-            # Save scored image
-            scored_image_name = f"{score:.4f}.jpg"
-            scored_image_path = os.path.join(scored_images_dir, scored_image_name)
-            Image.open(image_path).save(scored_image_path)
-            print(f"Saved scored image to: {scored_image_path}")
+    metrics = metrics if metrics is not None else Metrics()
+    per_image_prompts = is_manifest(target_dir)
+    def save_scored(scored, entries, prompt_columns):
+        for image_name, image_path, row in scored:
+            entry = entries[image_name]
+            image_prompt = entry.prompt or prompt
+            score = row[prompt_columns[image_prompt]]
+            logger.debug(f"Score for {image_name}: {score}")
+            try:
+                # Save scored image
+                with metrics.timer("save"):
+                    scored_image_name = save_scored_image(image_path or image_name, scored_images_dir, score, mode=scored_image_mode, image_data=entry.image_data)
+                if scored_image_name is not None:
+                    logger.debug(f"Saved scored image to: {os.path.join(scored_images_dir, scored_image_name)}")
+            except Exception as e:
+                logger.warning(f"Error processing {image_name}: {e}")
+                metrics.count("images_failed")
+                continue
 
             # Store results
-            results.append({
-                "image_index": len(results) + 1,
+            result = {
+                "image_index": len(writer) + 1,
                 "image_name": image_name,
                 "clip_score": score,
-                "scored_image_path": scored_image_name
-            })
+                "scored_image_path": scored_image_name or "",
+                "content_hash": entry.content_hash or ""
+            }
+            if per_image_prompts:
+                result["prompt"] = image_prompt
+            writer.write(result)
+            metrics.count("images_scored")
+            metrics.observe("image_latency_ms", (time.perf_counter() - entry.queued_at) * 1000)
 
-        except Exception as e:
-            print(f"Error processing {image_name}: {e}")
+    # Results are closed and the embedding cache is saved even if scoring stops early, so nothing scored is lost
+    try:
+        with ResultWriter(results_dir, resume=resume, flush_every=flush_every, columnar=columnar, fieldnames=RESULT_FIELDS + ["prompt"] if per_image_prompts else RESULT_FIELDS) as writer:
+            skip_names = writer.scored_names()
+            if skip_names:
+                logger.info(f"Resuming: {len(skip_names)} images already scored.")
+            with metrics.timer("text_encode"):
+                text_features = encode_prompt(model, prompt, device, model_name=model_name)
+
+            # Group duplicates before scoring, so compute scales with the unique images
+            if dedup:
+                with metrics.timer("dedup"):
+                    if dedup == "clip":
+                        if embedding_cache is None:
+                            raise ValueError("Deduplicating with CLIP embeddings needs an embedding cache.")
+                        if shard is not None:
+                            raise ValueError("Sharded runs cannot deduplicate with CLIP embeddings, which every shard would have to encode; use exact or phash.")
+                        # Encode the images missing from the cache; scoring below reads them back from it
+                        for batch in iter_image_batches(target_dir, preprocess, batch_size, embedding_cache=embedding_cache, decode_workers=decode_workers, use_processes=use_processes, skip_names=skip_names, recursive=recursive, image_filter=image_filter, max_decode_pixels=max_decode_pixels, reduced_decode=reduced_decode):
+                            score_image_batch(batch, text_features, model, device, embedding_cache=embedding_cache)
+                    clusters = find_duplicates(target_dir, dedup, dedup_threshold, recursive=recursive, image_filter=image_filter, workers=decode_workers, use_processes=use_processes, embedding_cache=embedding_cache)
+                logger.info(summarize_clusters(clusters))
+                logger.info(f"Clusters saved to: {save_clusters(clusters, os.path.join(results_dir, 'clusters.csv'))}")
+                if not score_duplicates:
+                    duplicates = {row["image_name"] for row in clusters if row["match"]}
+                    metrics.count("duplicates_skipped", len(duplicates - skip_names))
+                    skip_names = skip_names | duplicates
+
+            # Process images and calculate scores, streaming results as they come
+            batches = iter_image_batches(target_dir, preprocess, batch_size, embedding_cache=embedding_cache, decode_workers=decode_workers, use_processes=use_processes, skip_names=skip_names, metrics=metrics, recursive=recursive, image_filter=image_filter, shard=shard, max_decode_pixels=max_decode_pixels, reduced_decode=reduced_decode)
+            for batch in timed_iter(batches, metrics, "wait"):
+                if stop_event is not None and stop_event.is_set():
+                    logger.info(f"Scoring stopped after {len(writer)} images.")
+                    break
+                metrics.count("batches")
+                # Score the batch against the run prompt and any per-image prompts in it at once
+                batch_prompts = list(dict.fromkeys([prompt] + [entry.prompt for entry in batch if entry.prompt]))
+                batch_text_features = text_features
+                if len(batch_prompts) > 1:
+                    with metrics.timer("text_encode"):
+                        batch_text_features = encode_prompts(model, batch_prompts, device, model_name=model_name)
+                scored = score_image_batch(batch, batch_text_features, model, device, embedding_cache=embedding_cache, metrics=metrics)
+                save_scored(scored, {entry.image_name: entry for entry in batch}, {batch_prompt: column for column, batch_prompt in enumerate(batch_prompts)})
+    finally:
+        if embedding_cache is not None:
+            embedding_cache.save()
+    if embedding_cache is not None:
+        logger.info(f"Embedding cache: {embedding_cache.hits} hits, {embedding_cache.misses} misses, {len(embedding_cache)} stored.")
+
+    logger.info(f"Results saved to: {writer.csv_path}, {writer.jsonl_path} and {writer.json_path}")
+    logger.info(metrics.summary())
+    logger.info(f"Metrics saved to: {metrics.save(results_dir)}")
+    return load_results(results_dir), charts_dir, images_chart_dir
+
+# Function to score every image against every prompt and save the score matrix
+def calculate_clip_score_matrix_and_save(target_dir, prompts, output_dir, model, preprocess, device, batch_size=1, model_name=None, embedding_cache=None, decode_workers=0, use_processes=False, metrics=None, recursive=False, image_filter="extension", max_decode_pixels=DEFAULT_MAX_DECODE_PIXELS, reduced_decode=False, stop_event=None):
+    """
+    Scores every image in `target_dir` against every prompt in a single pass.
+    All prompts are encoded as one text batch and each image batch is scored with one
+    matrix multiply. Rows are streamed as they are scored (see result_writers.ResultWriter)
+    to `matrix_results.csv`/`matrix_results.jsonl`, one row per image with a `score_<k>`
+    column for the k-th prompt, and `matrix_results.json` is written at the end. From a
+    second pass over the rows, a dense `score_matrix.npy` of shape (num_images, num_prompts)
+    is written without holding the matrix in memory, with `matrix_prompts.json` describing
+    its rows and columns, plus `metrics.json` with the stage timings collected in `metrics`.
+    Per-image prompts from a manifest are ignored here; every image is scored against every
+    prompt. Once `stop_event` (a threading.Event) is set, scoring stops after the current
+    batch and the images scored so far are saved.
+
+    :param prompts: List of dictionaries with 'prompt' and 'prompt_file' keys.
+    :return: (score matrix memory-mapped from `score_matrix.npy`, image names)
+    """
+    if not source_exists(target_dir):
+        raise FileNotFoundError(f"Target directory '{target_dir}' does not exist.")
+    if batch_size < 1:
+        raise ValueError(f"Batch size must be at least 1, got {batch_size}.")
+    if not prompts:
+        raise ValueError("At least one prompt is required.")
+
+    results_dir = os.path.join(output_dir, "results")
+    os.makedirs(results_dir, exist_ok=True)
+
+    metrics = metrics if metrics is not None else Metrics()
+    score_columns = [f"score_{prompt_index}" for prompt_index in range(1, len(prompts) + 1)]
+
+    # Results are closed and the embedding cache is saved even if scoring stops early, so nothing scored is lost
+    try:
+        with ResultWriter(results_dir, fieldnames=["image_index", "image_name"] + score_columns, name="matrix_results") as writer:
+            with metrics.timer("text_encode"):
+                text_features = encode_prompts(model, [entry["prompt"] for entry in prompts], device, model_name=model_name)
+
+            batches = iter_image_batches(target_dir, preprocess, batch_size, embedding_cache=embedding_cache, decode_workers=decode_workers, use_processes=use_processes, metrics=metrics, recursive=recursive, image_filter=image_filter, max_decode_pixels=max_decode_pixels, reduced_decode=reduced_decode)
+            for batch in timed_iter(batches, metrics, "wait"):
+                if stop_event is not None and stop_event.is_set():
+                    logger.info(f"Scoring stopped after {len(writer)} images.")
+                    break
+                metrics.count("batches")
+                for image_name, _, row in score_image_batch(batch, text_features, model, device, embedding_cache=embedding_cache, metrics=metrics):
+                    writer.write({"image_index": len(writer) + 1, "image_name": image_name, **dict(zip(score_columns, row))})
+                    metrics.count("images_scored")
+    finally:
+        if embedding_cache is not None:
+            embedding_cache.save()
+
+    # Fill the dense matrix row by row from the streamed results
+    matrix_path = os.path.join(results_dir, "score_matrix.npy")
+    prompts_path = os.path.join(results_dir, "matrix_prompts.json")
+    score_matrix = np.lib.format.open_memmap(matrix_path, mode="w+", dtype=np.float32, shape=(len(writer), len(prompts)))
+    image_names = []
+    for image_index, row in enumerate(iter_results(results_dir, "matrix_results")):
+        score_matrix[image_index] = [row[column] for column in score_columns]
+        image_names.append(row["image_name"])
+    score_matrix.flush()
+    del score_matrix
+    with open(prompts_path, "w", encoding="utf-8") as jsonfile:
+        json.dump({"image_names": image_names, "prompts": prompts, "score_columns": score_columns}, jsonfile, indent=4)
+    metrics.save(results_dir)
+
+    logger.info(f"Score matrix ({len(image_names)} images x {len(prompts)} prompts) saved to: {matrix_path}")
+    logger.info(f"Results saved to: {writer.csv_path}, {writer.jsonl_path} and {writer.json_path}")
+    return np.load(matrix_path, mmap_mode="r"), image_names
+
+# Function to score the same images with several models and compare them
+def compare_models_and_save(target_dir, prompt, batch_folder, model_names, model_pool, embedding_cache_dir=None, cache_max_entries=DEFAULT_MAX_ENTRIES, **score_options):
+    """
+    Scores every image in `target_dir` against `prompt` with each model in `model_names`.
+    Each model writes its usual outputs under `batch_folder/models/<model>`. Models come from
+    `model_pool`, so models that fit in its memory budget stay loaded between runs.
+    Writes `results/model_comparison.csv` (one score column per model, for images every
+    model scored) and `results/model_summary.csv` (footprint, throughput, score statistics
+    and Spearman rank correlation with the first model).
+
+    :param score_options: Extra keyword arguments passed to `calculate_clip_scores_and_save`.
+    :return: List of per-model summary dictionaries.
+    """
+    results_dir = os.path.join(batch_folder, "results")
+    os.makedirs(results_dir, exist_ok=True)
+
+    scores_by_model = {}
+    summary = []
+    for model_name in model_names:
+        logger.info(f"Scoring with model: {model_name}")
+        model, preprocess, device = model_pool.get(model_name)
+        profiled_model_name = get_profiled_model_name(model_name, model_pool.cpu_profile, device)
+        embedding_cache = None
+        if embedding_cache_dir:
+            embedding_cache = EmbeddingCache(embedding_cache_dir, profiled_model_name, model.visual.input_resolution, max_entries=cache_max_entries)
 
-    # Save results to CSV and JSON
-    results_csv_path = os.path.join(results_dir, "results.csv")
-    results_json_path = os.path.join(results_dir, "results.json")
-    with open(results_csv_path, "w", newline="") as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=["image_index", "image_name", "clip_score", "scored_image_path"])
+        start_time = time.perf_counter()
+        model_folder = os.path.join(batch_folder, "models", model_name.replace("/", "_"))
+        rows, _, _ = calculate_clip_scores_and_save(target_dir, prompt, model_folder, model, preprocess, device, model_name=profiled_model_name, embedding_cache=embedding_cache, **score_options)
+        elapsed = time.perf_counter() - start_time
+
+        scores_by_model[model_name] = {row["image_name"]: row["clip_score"] for row in rows}
+        scores = np.array([row["clip_score"] for row in rows], dtype=np.float64)
+        summary.append({
+            "model": model_name,
+            "footprint_mb": round(model_pool.footprints[model_name] / 2**20, 1),
+            "images": len(rows),
+            "seconds": round(elapsed, 3),
+            "images_per_second": round(len(rows) / elapsed, 2) if elapsed > 0 else 0.0,
+            "mean": float(scores.mean()) if len(scores) else float("nan"),
+            "std": float(scores.std()) if len(scores) else float("nan"),
+            "min": float(scores.min()) if len(scores) else float("nan"),
+            "max": float(scores.max()) if len(scores) else float("nan")
+        })
+
+    # Compare on the images that every model scored
+    image_names = sorted(set.intersection(*(set(scores) for scores in scores_by_model.values())))
+    matrix = np.array([[scores_by_model[model_name][image_name] for model_name in model_names] for image_name in image_names], dtype=np.float64).reshape(len(image_names), len(model_names))
+    ranks = matrix.argsort(axis=0).argsort(axis=0).astype(np.float64)
+    for column, row in enumerate(summary):
+        if len(image_names) > 1 and ranks[:, 0].std() > 0 and ranks[:, column].std() > 0:
+            row["spearman_vs_first"] = float(np.corrcoef(ranks[:, 0], ranks[:, column])[0, 1])
+        else:
+            row["spearman_vs_first"] = float("nan")
+
+    comparison_path = os.path.join(results_dir, "model_comparison.csv")
+    with open(comparison_path, "w", newline="", encoding="utf-8") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["image_name"] + model_names)
+        for image_name, row in zip(image_names, matrix.tolist()):
+            writer.writerow([image_name] + row)
+    summary_path = os.path.join(results_dir, "model_summary.csv")
+    with open(summary_path, "w", newline="", encoding="utf-8") as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=list(summary[0]))
         writer.writeheader()
-        writer.writerows(results)
-    with open(results_json_path, "w") as jsonfile:
-        json.dump(results, jsonfile, indent=4)
+        writer.writerows(summary)
 
-    print(f"Results saved to: {results_csv_path} and {results_json_path}")
-    return results, charts_dir, images_chart_dir
+    # Print the comparison table
+    logger.info(f"{'Model':<16}{'MB':>9}{'Images':>8}{'img/s':>9}{'Mean':>9}{'Std':>9}{'Min':>9}{'Max':>9}{'Spearman':>10}")
+    for row in summary:
+        logger.info(f"{row['model']:<16}{row['footprint_mb']:>9.1f}{row['images']:>8}{row['images_per_second']:>9.2f}{row['mean']:>9.4f}{row['std']:>9.4f}{row['min']:>9.4f}{row['max']:>9.4f}{row['spearman_vs_first']:>10.4f}")
+    logger.info(f"Model comparison saved to: {comparison_path} and {summary_path}")
+    return summary
 
-if __name__ == "__main__":
-    # Parse command-line arguments
+# Function to render charts in a separate background process
+def start_async_visualization(batch_folder, summary_chart_type, summary_chart_color, single_chart_type, single_chart_color, advanced_settings, contact_sheet=None, chart_workers=0):
+    """
+    Starts `visualization_options.py` on the persisted results of `batch_folder` in the
+    background and returns immediately. Its output goes to `charts/render.log`.
+
+    :return: The started subprocess.Popen.
+    """
+    command = [
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "visualization_options.py"), batch_folder,
+        "--summary_chart_type", str(summary_chart_type),
+        "--summary_chart_color", summary_chart_color,
+        "--single_chart_type", str(single_chart_type),
+        "--single_chart_color", single_chart_color,
+        "--figsize", ",".join(str(v) for v in advanced_settings["figsize"]),
+        "--xlabel", advanced_settings["xlabel"],
+        "--ylabel", advanced_settings["ylabel"],
+        "--chart_workers", str(chart_workers)
+    ]
+    if contact_sheet:
+        command += ["--contact_sheet", f"{contact_sheet[0]}x{contact_sheet[1]}"]
+
+    charts_dir = os.path.join(batch_folder, "charts")
+    os.makedirs(charts_dir, exist_ok=True)
+    log_path = os.path.join(charts_dir, "render.log")
+    with open(log_path, "w") as log_file:
+        process = subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL, start_new_session=True)
+    logger.info(f"Rendering charts in the background (pid {process.pid}); log: {log_path}")
+    return process
+
+# Function to format the startup-time breakdown
+def format_startup_report(load_timings):
+    """
+    Formats the time spent importing modules and in each model loading stage as one line.
+    """
+    stages = [("imports", IMPORT_SECONDS)] + list(load_timings.items())
+    total = sum(seconds for _, seconds in stages)
+    return "Startup time: " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in stages) + f", total {total:.2f}s"
+
+# Function to build the command-line parser
+def build_arg_parser():
     parser = argparse.ArgumentParser(description="Calculate CLIP scores for target images.")
+    parser.add_argument("--config", type=str, default=None, help="JSON file whose keys provide defaults for any of these options (e.g., {\"model\": \"ViT-B/32\", \"skip_visualization\": true}).")
+    parser.add_argument("--non_interactive", "--headless", action="store_true", help="Never read from stdin; unset choices use their defaults. Implied when stdin is not a terminal.")
     parser.add_argument("--model", type=str, default=None, help="CLIP model to use. If not specified, it will be selected based on VRAM.")
+    parser.add_argument("--compare_models", type=str, nargs="+", default=None, help="Score the images with each of these models and write a per-model comparison table (e.g., RN50 ViT-B/32 ViT-B/16).")
+    parser.add_argument("--memory_budget_mb", type=float, default=None, help="Memory budget for models kept loaded with --compare_models; least recently used models are evicted beyond it. Defaults to half of the RAM or VRAM.")
     parser.add_argument("--prompt_dir", type=str, default="prompts", help="Directory containing prompts .txt files.")
-    args = parser.parse_args()
+    parser.add_argument("--prompt_file", type=str, default=None, help="Name of the prompts .txt file in --prompt_dir to use instead of asking.")
+    parser.add_argument("--prompt", type=str, action="append", default=None, help="Prompt text to score against; overrides --prompt_dir. Repeat to score several prompts as a matrix.")
+    parser.add_argument("--target_dir", type=str, default="target_images", help="Images to score: a directory, a .csv/.jsonl manifest (with optional per-image prompts), a .tar/.zip shard, or a glob pattern of these (e.g., 'shards/*.tar').")
+    parser.add_argument("--recursive", action="store_true", help="Also score images in subdirectories of --target_dir.")
+    parser.add_argument("--dedup", type=str, default=None, choices=DEDUP_METHODS, help="Group exact duplicates (exact), and near-duplicates by perceptual hash (phash) or CLIP embedding (clip, needs --embedding_cache), then score one image per cluster.")
+    parser.add_argument("--dedup_threshold", type=float, default=None, help="Maximum perceptual hash distance in bits (phash) or minimum cosine similarity (clip) of near-duplicates.")
+    parser.add_argument("--score_duplicates", action="store_true", help="With --dedup, still score every image and only write the clusters.")
+    parser.add_argument("--image_filter", type=str, default="extension", choices=IMAGE_FILTERS, help="How files are recognized as images: by extension, by their leading bytes (magic), or every file is tried (none).")
+    parser.add_argument("--num_shards", type=int, default=1, help="Split the input into this many shards and score only --shard_index; merge the shards with sharded_scoring.py.")
+    parser.add_argument("--shard_index", type=int, default=0, help="Shard scored by this process, from 0 to --num_shards - 1.")
+    parser.add_argument("--shard_by", type=str, default="hash", choices=SHARD_METHODS, help="Assign images to shards by a hash of their name (same on every host) or round-robin by position.")
+    parser.add_argument("--output_dir", type=str, default="Batches", help="Directory in which batch folders are created.")
+    parser.add_argument("--batch_output", type=str, default=None, help="Name of the batch output folder. Defaults to the next free Batch_X.")
+    parser.add_argument("--cpu_profile", type=str, default="fp32", help=f"CPU execution profile: comma-separated options from {CPU_PROFILE_OPTIONS} (e.g., bf16,channels_last). Check its accuracy with cpu_profiles.py.")
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op threads used by torch on the CPU.")
+    parser.add_argument("--interop_threads", type=int, default=None, help="Inter-op threads used by torch on the CPU.")
+    parser.add_argument("--log_level", type=str, default="info", choices=LOG_LEVELS, help="Messages to show; per-image messages are only shown at debug level.")
+    parser.add_argument("--profile", type=str, default=None, choices=PROFILERS, help="Profile the scoring run and save the report in the batch results folder.")
+    parser.add_argument("--batch_size", "--batch-size", type=int, default=1, help="Number of images encoded per forward pass.")
+    parser.add_argument("--decode_workers", type=int, default=0, help="Number of workers decoding and preprocessing images ahead of the encoder (0 = main thread).")
+    parser.add_argument("--max_decode_megapixels", type=float, default=DEFAULT_MAX_DECODE_PIXELS / 1e6, help="Pixel budget of each decoded image; larger images are downscaled while decoding instead of failing. Only JPEGs can be read above Pillow's decompression bomb limit; larger images of other formats, such as PNG, are skipped.")
+    parser.add_argument("--reduced_decode", action="store_true", help="Decode images at the smallest size the model's preprocess needs (JPEG DCT scaling); check its accuracy with image_pipeline.py.")
+    parser.add_argument("--decode_processes", action="store_true", help="Use worker processes instead of threads for decoding.")
+    parser.add_argument("--resume", action="store_true", help="Continue the batch given by --batch_output (or the latest batch), skipping images already scored.")
+    parser.add_argument("--flush_every", type=int, default=DEFAULT_FLUSH_EVERY, help="Number of result rows between flushes of the streamed results.")
+    parser.add_argument("--columnar", type=str, default=None, choices=COLUMNAR_FORMATS, help="Also write results in a columnar format (npy score arrays, or parquet with pyarrow).")
+    parser.add_argument("--scored_images", type=str, default="link", choices=SCORED_IMAGE_MODES, help="How to write score-named images: hard link, copy-on-write clone, byte copy, JPEG re-encode, or not at all.")
+    parser.add_argument("--embedding_cache", type=str, nargs="?", const=CACHE_DIR, default=None, help=f"Reuse image embeddings stored in this directory (default when given without a value: {CACHE_DIR}). Sharded runs only read it; sharded_scoring.py merges their new embeddings into it.")
+    parser.add_argument("--cache_max_entries", type=int, default=DEFAULT_MAX_ENTRIES, help="Maximum number of embeddings kept per model before the least recently used are evicted.")
+    parser.add_argument("--all_prompts", "--all-prompts", action="store_true", help="Score every image against every prompt line in the prompt directory.")
+    parser.add_argument("--skip_visualization", action="store_true", help="Do not render any charts.")
+    parser.add_argument("--summary_chart_type", type=validate_chart_type, default=None, help="Summary chart type (1-10, see chart_selection.CHART_TYPES).")
+    parser.add_argument("--summary_chart_color", type=validate_color, default=None, help="Summary chart color as a hex code (e.g., #1f77b4).")
+    parser.add_argument("--single_chart_type", type=validate_chart_type, default=None, help="Single-image chart type (1-10, see chart_selection.CHART_TYPES).")
+    parser.add_argument("--single_chart_color", type=validate_color, default=None, help="Single-image chart color as a hex code.")
+    parser.add_argument("--contact_sheet", type=parse_grid, default=None, help="Pack single-image charts into contact sheets of rowsxcols charts (e.g., 4x4) instead of one PNG per image.")
+    parser.add_argument("--chart_workers", type=int, default=0, help="Number of worker processes rendering single-image charts (0 = this process).")
+    parser.add_argument("--async_charts", action="store_true", help="Render charts in a background process after results are saved, without waiting for it.")
+    parser.add_argument("--figsize", type=parse_figsize, default=(12, 6), help="Figure size as width,height.")
+    parser.add_argument("--xlabel", type=str, default="Images", help="x-axis label of the summary chart.")
+    parser.add_argument("--ylabel", type=str, default="CLIP Scores", help="y-axis label of the summary chart.")
+    return parser
+
+# Function to parse command-line arguments, with defaults from an optional config file
+def parse_args(argv=None):
+    parser = build_arg_parser()
+    args, _ = parser.parse_known_args(argv)
+    if args.config:
+        with open(args.config, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        known_options = {action.dest for action in parser._actions}
+        unknown_options = sorted(set(config) - known_options)
+        if unknown_options:
+            parser.error(f"Unknown options in config file '{args.config}': {unknown_options}")
+        parser.set_defaults(**config)
+        args = parser.parse_args(argv)
+    else:
+        args = parser.parse_args(argv)
+
+    # Values coming from a config file bypass argparse type conversion
+    try:
+        args.figsize = parse_figsize(args.figsize)
+        parse_cpu_profile(args.cpu_profile)
+        if args.contact_sheet is not None:
+            args.contact_sheet = parse_grid(args.contact_sheet)
+        for option in ["summary_chart_type", "single_chart_type"]:
+            if getattr(args, option) is not None:
+                setattr(args, option, validate_chart_type(getattr(args, option)))
+        for option in ["summary_chart_color", "single_chart_color"]:
+            if getattr(args, option) is not None:
+                setattr(args, option, validate_color(getattr(args, option)))
+    except (argparse.ArgumentTypeError, ValueError) as e:
+        parser.error(str(e))
+    if args.prompt is not None and isinstance(args.prompt, str):
+        args.prompt = [args.prompt]
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_logging(args.log_level)
+    set_cpu_threads(args.threads, args.interop_threads)
+    interactive = not args.non_interactive and sys.stdin is not None and sys.stdin.isatty()
 
-    # Load the prompts using the new `prompt_selection.py` module
+    # Load the prompts from the command line or with the `prompt_selection.py` module
     try:
-        prompt = get_prompt_from_folder(args.prompt_dir)
+        if args.prompt:
+            prompts = [{"prompt_file": "", "prompt": prompt} for prompt in args.prompt]
+        elif args.all_prompts:
+            prompts = get_all_prompts_from_folder(args.prompt_dir)
+        else:
+            prompts = [{"prompt_file": args.prompt_file or "", "prompt": get_prompt_from_folder(args.prompt_dir, file_name=args.prompt_file, interactive=interactive)}]
     except FileNotFoundError as e:
-        print(e)
-        exit(1)
+        logger.error(e)
+        return 1
+    matrix_mode = args.all_prompts or len(prompts) > 1
+    shard = None
+    if args.num_shards > 1:
+        if not 0 <= args.shard_index < args.num_shards:
+            logger.error(f"--shard_index must be between 0 and {args.num_shards - 1}.")
+            return 1
+        if matrix_mode or args.compare_models:
+            logger.error("Sharded runs score a single prompt with a single model.")
+            return 1
+        if not args.batch_output:
+            logger.error("Sharded runs need --batch_output, so that every shard writes into the same batch folder.")
+            return 1
+        shard = Shard(args.shard_index, args.num_shards, args.shard_by)
+
+    if args.compare_models:
+        if matrix_mode:
+            logger.error("--compare_models scores a single prompt; it cannot be combined with several prompts.")
+            return 1
+        budget_bytes = int(args.memory_budget_mb * 2**20) if args.memory_budget_mb else None
+        if args.batch_output:
+            batch_folder = os.path.join(args.output_dir, args.batch_output)
+        elif args.resume and get_latest_batch_folder(args.output_dir):
+            batch_folder = get_latest_batch_folder(args.output_dir)
+        else:
+            batch_folder = get_next_batch_folder(args.output_dir)
+        create_output_dir(batch_folder)
+        logger.info(f"Running Batch: {os.path.basename(batch_folder)}")
+        # Charts are per model and are skipped here; render them from each models/<model> folder
+        compare_models_and_save(args.target_dir, prompts[0]["prompt"], batch_folder, args.compare_models, ModelPool(budget_bytes, cpu_profile=args.cpu_profile), embedding_cache_dir=args.embedding_cache, cache_max_entries=args.cache_max_entries, batch_size=args.batch_size, decode_workers=args.decode_workers, use_processes=args.decode_processes, scored_image_mode=args.scored_images, resume=args.resume, flush_every=args.flush_every, columnar=args.columnar, recursive=args.recursive, image_filter=args.image_filter, dedup=args.dedup, dedup_threshold=args.dedup_threshold, score_duplicates=args.score_duplicates, max_decode_pixels=int(args.max_decode_megapixels * 1e6), reduced_decode=args.reduced_decode)
+        return 0
 
     # Determine the model to use
     model_name = args.model if args.model else select_model_based_on_vram()
-    print(f"Selected model: {model_name}")
-    model, preprocess, device = load_model(model_name)
+    logger.info(f"Selected model: {model_name}")
+    load_timings = {}
+    model, preprocess, device = load_model(model_name, timings=load_timings)
+    logger.info(format_startup_report(load_timings))
+    model = apply_cpu_profile(model, args.cpu_profile, device)
+    model_name = get_profiled_model_name(model_name, args.cpu_profile, device)
+    embedding_cache = None
+    if args.embedding_cache:
+        embedding_cache = EmbeddingCache(args.embedding_cache, model_name, model.visual.input_resolution, max_entries=args.cache_max_entries, read_only=shard is not None)
 
     # Determine the batch folder for this run
-    batch_folder = get_next_batch_folder("Batches")
+    if args.batch_output:
+        batch_folder = os.path.join(args.output_dir, args.batch_output)
+    elif args.resume and get_latest_batch_folder(args.output_dir):
+        batch_folder = get_latest_batch_folder(args.output_dir)
+    else:
+        batch_folder = get_next_batch_folder(args.output_dir)
     create_output_dir(batch_folder)
-    print(f"Running Batch: {os.path.basename(batch_folder)}")
+    logger.info(f"Running Batch: {os.path.basename(batch_folder)}")
+    if shard is not None:
+        # Each shard writes its own results; sharded_scoring.py merges them into the batch folder
+        batch_folder = get_shard_dir(batch_folder, shard)
+        create_output_dir(batch_folder)
+        logger.info(f"Scoring shard {shard.index + 1} of {shard.count} into: {batch_folder}")
+        if embedding_cache is not None:
+            # Shards only read the shared cache; their new embeddings go to a store of their own, merged by sharded_scoring.py
+            embedding_cache = EmbeddingCache(os.path.join(batch_folder, "embedding_cache"), model_name, model.visual.input_resolution, max_entries=args.cache_max_entries, fallback=embedding_cache)
+
+    results_dir = os.path.join(batch_folder, "results")
+    metrics = Metrics()
+
+    if matrix_mode:
+        # Score the full image x prompt matrix; charts are per-prompt and are skipped here
+        with profile_run(args.profile, results_dir):
+            calculate_clip_score_matrix_and_save(args.target_dir, prompts, batch_folder, model, preprocess, device, batch_size=args.batch_size, model_name=model_name, embedding_cache=embedding_cache, decode_workers=args.decode_workers, use_processes=args.decode_processes, metrics=metrics, recursive=args.recursive, image_filter=args.image_filter, max_decode_pixels=int(args.max_decode_megapixels * 1e6), reduced_decode=args.reduced_decode)
+        return 0
 
     # Calculate CLIP scores and save images, charts, and results
-    scores, charts_dir, images_chart_dir = calculate_clip_scores_and_save("target_images", prompt, batch_folder, model, preprocess, "cuda" if torch.cuda.is_available() else "cpu")
+    with profile_run(args.profile, results_dir):
+        scores, charts_dir, images_chart_dir = calculate_clip_scores_and_save(args.target_dir, prompts[0]["prompt"], batch_folder, model, preprocess, device, batch_size=args.batch_size, model_name=model_name, embedding_cache=embedding_cache, decode_workers=args.decode_workers, use_processes=args.decode_processes, scored_image_mode=args.scored_images, resume=args.resume, flush_every=args.flush_every, columnar=args.columnar, metrics=metrics, recursive=args.recursive, image_filter=args.image_filter, dedup=args.dedup, dedup_threshold=args.dedup_threshold, score_duplicates=args.score_duplicates, shard=shard, max_decode_pixels=int(args.max_decode_megapixels * 1e6), reduced_decode=args.reduced_decode)
+
+    if args.skip_visualization:
+        logger.info("Skipping visualization.")
+        return 0
+    if shard is not None:
+        logger.info("Charts are rendered from the merged results of all shards.")
+        return 0
+    if not scores:
+        logger.info("No scores to visualize.")
+        return 0
 
-    # Prompt user for visualization settings
-    print("Select visualization settings:")
+    # Prompt user for visualization settings that were not given as options
+    if interactive:
+        logger.info("Select visualization settings:")
 
     # Summary chart options
-    summary_chart_type = select_chart_type("summary chart")
-    summary_chart_color = select_color("summary chart")
+    summary_chart_type = args.summary_chart_type or (select_chart_type("summary chart") if interactive else 1)
+    summary_chart_color = args.summary_chart_color or (select_color("summary chart") if interactive else DEFAULT_COLOR)
 
     # Single-image chart options
-    single_chart_type = select_chart_type("single-image chart")
-    single_chart_color = select_color("single-image chart")
+    single_chart_type = args.single_chart_type or (select_chart_type("single-image chart") if interactive else 1)
+    single_chart_color = args.single_chart_color or (select_color("single-image chart") if interactive else DEFAULT_COLOR)
 
     advanced_settings = {
-        "figsize": (12, 6),
-        "xlabel": "Images",
-        "ylabel": "CLIP Scores"
+        "figsize": args.figsize,
+        "xlabel": args.xlabel,
+        "ylabel": args.ylabel
     }
 
     # Visualize results
-    visualize(
-        scores,
-        summary_chart_type,
-        summary_chart_color,
-        advanced_settings,
-        charts_dir,
-        images_chart_dir,
-        single_chart_type=single_chart_type,
-        single_chart_color=single_chart_color
-    )
+    if args.async_charts:
+        start_async_visualization(batch_folder, summary_chart_type, summary_chart_color, single_chart_type, single_chart_color, advanced_settings, contact_sheet=args.contact_sheet, chart_workers=args.chart_workers)
+        return 0
+    from visualization_options import visualize  # Plotting libraries are only imported when charts are drawn
+
+    with metrics.timer("charts"):
+        visualize(
+            scores,
+            summary_chart_type,
+            summary_chart_color,
+            advanced_settings,
+            charts_dir,
+            images_chart_dir,
+            single_chart_type=single_chart_type,
+            single_chart_color=single_chart_color,
+            contact_sheet=args.contact_sheet,
+            chart_workers=args.chart_workers
+        )
+    metrics.save(results_dir)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
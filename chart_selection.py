@@ -1,3 +1,44 @@
+import argparse
+
+# Chart types offered for summary and single-image charts
+CHART_TYPES = {
+    1: "Line Chart",
+    2: "Histogram",
+    3: "Dot Chart",
+    4: "Scatter Chart",
+    5: "Box Plot",
+    6: "Violin Plot",
+    7: "Area Chart",
+    8: "Pie Chart",
+    9: "Heatmap",
+    10: "3D Scatter Plot"
+}
+
+# Color used when none is given
+DEFAULT_COLOR = "#1f77b4"
+
+def validate_chart_type(chart_type):
+    """
+    Validate a chart type given without prompting (e.g., from the command line or a config file).
+
+    :param chart_type: Chart type number as an integer or string.
+    :return: Chart type (integer).
+    """
+    if not str(chart_type).isdigit() or int(chart_type) not in CHART_TYPES:
+        raise ValueError(f"Invalid chart type '{chart_type}'. Choose a number from 1 to {len(CHART_TYPES)}.")
+    return int(chart_type)
+
+def validate_color(color):
+    """
+    Validate a hex color given without prompting (e.g., from the command line or a config file).
+
+    :param color: Hex color string such as #1f77b4.
+    :return: Color (hex string).
+    """
+    if not (isinstance(color, str) and color.startswith("#") and len(color) == 7):
+        raise ValueError(f"Invalid color code '{color}'. Use a hex color code (e.g., {DEFAULT_COLOR}).")
+    return color
+
 def select_chart_type(chart_name):
     """
     Prompt the user to select a chart type with a default option if no input is provided.
@@ -6,16 +47,8 @@ def select_chart_type(chart_name):
     :return: Selected chart type (integer).
     """
     print(f"Choose a chart type for the {chart_name}:")
-    print("1. Line Chart")
-    print("2. Histogram")
-    print("3. Dot Chart")
-    print("4. Scatter Chart")
-    print("5. Box Plot")
-    print("6. Violin Plot")
-    print("7. Area Chart")
-    print("8. Pie Chart")
-    print("9. Heatmap")
-    print("10. 3D Scatter Plot")
+    for number, name in CHART_TYPES.items():
+        print(f"{number}. {name}")
     choice = input(f"Enter the number corresponding to your choice for the {chart_name} (1-10, default is 1): ")
 
     # Default to Line Chart if input is invalid or empty
@@ -36,6 +69,32 @@ def select_color(chart_name):
 
     # Default to blue (#1f77b4) if input is empty or invalid
     if not color or not (color.startswith("#") and len(color) == 7):
-        print(f"Invalid or no input provided. Defaulting to color #1f77b4 for {chart_name}.")
-        return "#1f77b4"
+        print(f"Invalid or no input provided. Defaulting to color {DEFAULT_COLOR} for {chart_name}.")
+        return DEFAULT_COLOR
     return color
+
+def parse_figsize(value):
+    """
+    Converts "12,6" (or a [12, 6] list from a config file) into a (width, height) tuple.
+    """
+    if isinstance(value, str):
+        value = value.split(",")
+    try:
+        width, height = (float(v) for v in value)
+    except (TypeError, ValueError):
+        raise argparse.ArgumentTypeError(f"Invalid figure size '{value}'. Use width,height (e.g., 12,6).")
+    return width, height
+
+def parse_grid(value):
+    """
+    Converts "4x5" (or a [4, 5] list from a config file) into a (rows, cols) tuple.
+    """
+    if isinstance(value, str):
+        value = value.lower().split("x")
+    try:
+        rows, cols = (int(v) for v in value)
+    except (TypeError, ValueError):
+        raise argparse.ArgumentTypeError(f"Invalid grid '{value}'. Use rowsxcols (e.g., 4x4).")
+    if rows < 1 or cols < 1:
+        raise argparse.ArgumentTypeError(f"Invalid grid '{value}'. Rows and columns must be at least 1.")
+    return rows, cols
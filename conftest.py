@@ -0,0 +1,47 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+from clip.clip import _transform
+from clip.model import CLIP
+from PIL import Image
+
+
+# Function to build a small randomly initialized CLIP model, so tests need no downloaded weights
+def make_tiny_model(resolution=64):
+    torch.manual_seed(0)
+    model = CLIP(embed_dim=32, image_resolution=resolution, vision_layers=2, vision_width=64, vision_patch_size=16, context_length=77, vocab_size=49408, transformer_width=64, transformer_heads=2, transformer_layers=2).eval()
+    return model, _transform(resolution)
+
+
+# Function to write random JPEG images into a directory
+def make_images(image_dir, count, size=(96, 80)):
+    os.makedirs(image_dir, exist_ok=True)
+    rng = np.random.default_rng(0)
+    for index in range(count):
+        Image.fromarray(rng.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)).save(os.path.join(image_dir, f"img_{index}.jpg"))
+    return image_dir
+
+
+@pytest.fixture
+def tiny_model(monkeypatch):
+    """
+    Makes every model load in calculate_clip_score and model_pool return the same tiny CLIP model,
+    with an empty text embedding cache.
+    """
+    from collections import OrderedDict
+
+    import calculate_clip_score
+    import model_pool
+
+    model, preprocess = make_tiny_model()
+    monkeypatch.setattr(calculate_clip_score, "TEXT_EMBEDDING_CACHE", OrderedDict())
+    monkeypatch.setattr(calculate_clip_score, "load_model", lambda model_name, **kwargs: (model, preprocess, "cpu"))
+    monkeypatch.setattr(model_pool, "load_model", lambda model_name, **kwargs: (model, preprocess, "cpu"))
+    return model, preprocess
+
+
+@pytest.fixture
+def image_dir(tmp_path):
+    return make_images(str(tmp_path / "images"), 12)
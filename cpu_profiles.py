@@ -0,0 +1,271 @@
+import copy
+import os
+import time
+
+import numpy as np
+import torch
+from clip.model import ModifiedResNet
+
+from metrics import logger
+
+# Options that can be combined into a CPU execution profile, e.g. "bf16,channels_last"
+CPU_PROFILE_OPTIONS = ["fp32", "bf16", "int8", "channels_last", "compile"]
+
+# Number of images used by the profile check when none are given
+DEFAULT_CHECK_IMAGES = 64
+
+# Prompts used by the profile check when none are given
+DEFAULT_CHECK_PROMPTS = ["a photo of a cat", "a photo of a dog", "a scenic view of a mountain lake", "a diagram"]
+
+
+# Function to validate a CPU profile given as "opt1,opt2" or as a list
+def parse_cpu_profile(value):
+    """
+    Converts a CPU profile such as "bf16,channels_last" into a list of options.
+    Raises ValueError for unknown options.
+    """
+    options = [option.strip() for option in value.split(",")] if isinstance(value, str) else list(value)
+    unknown = [option for option in options if option not in CPU_PROFILE_OPTIONS]
+    if unknown or not options:
+        raise ValueError(f"Invalid CPU profile '{value}'. Combine options from: {CPU_PROFILE_OPTIONS}")
+    if "int8" in options and "bf16" in options:
+        raise ValueError("The int8 and bf16 CPU profile options cannot be combined; quantized layers only take float32 inputs.")
+    return [option for option in options if option != "fp32"]
+
+
+# Function to name a model together with its CPU profile
+def get_profiled_model_name(model_name, profile, device="cpu"):
+    """
+    Returns the key under which embeddings of `model_name` run with `profile` are cached.
+    Profiles other than fp32 change the embeddings slightly, so they get their own key.
+    """
+    options = parse_cpu_profile(profile)
+    return f"{model_name}@{','.join(options)}" if options and str(device) == "cpu" else model_name
+
+
+# Function to set the number of threads torch uses on the CPU
+def set_cpu_threads(intra_op_threads=None, inter_op_threads=None):
+    """
+    Sets the intra-op (within one operator) and inter-op (between operators) thread counts.
+    The inter-op count can only be changed before torch runs any parallel work.
+    """
+    if intra_op_threads:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError as e:
+            logger.warning(f"Could not set inter-op threads: {e}")
+
+
+# Function to quantize the linear layers of a CLIP model to int8
+def quantize_linear_layers(model):
+    """
+    Returns a copy of `model` whose nn.Linear layers use dynamic int8 quantization.
+    The attention pooling of the RN models reads its projection weights directly, and
+    nn.MultiheadAttention keeps its own projections, so those stay in float32.
+    """
+    qconfig_spec = {
+        name: torch.ao.quantization.default_dynamic_qconfig
+        for name, module in model.named_modules()
+        if type(module) is torch.nn.Linear and not name.startswith("visual.attnpool")
+    }
+    return torch.ao.quantization.quantize_dynamic(model, qconfig_spec, dtype=torch.qint8)
+
+
+class CPUProfileModel(torch.nn.Module):
+    """
+    Runs a CLIP model's `encode_image` and `encode_text` with a CPU execution profile.
+    Outputs are always float32, so callers can treat it like the original model.
+    """
+
+    def __init__(self, model, options):
+        super().__init__()
+        self.model = model
+        self.options = options
+        self.channels_last = "channels_last" in options and isinstance(model.visual, ModifiedResNet)
+        self.autocast = "bf16" in options
+        self.image_encoder = model.encode_image
+        self.text_encoder = model.encode_text
+        if "compile" in options:
+            # Fold the inference-only weights into the compiled graph. Passed per compile rather than
+            # set in torch._inductor.config, which would apply to every later compile in the process.
+            self.image_encoder = torch.compile(model.encode_image, options={"freezing": True})
+            self.text_encoder = torch.compile(model.encode_text, options={"freezing": True})
+
+    @property
+    def visual(self):
+        return self.model.visual
+
+    def encode_image(self, image):
+        if self.channels_last:
+            image = image.contiguous(memory_format=torch.channels_last)
+        with torch.autocast("cpu", dtype=torch.bfloat16, enabled=self.autocast):
+            return self.image_encoder(image).float()
+
+    def encode_text(self, text):
+        with torch.autocast("cpu", dtype=torch.bfloat16, enabled=self.autocast):
+            return self.text_encoder(text).float()
+
+
+# Function to apply a CPU execution profile to a loaded CLIP model
+def apply_cpu_profile(model, profile, device="cpu"):
+    """
+    Returns `model` prepared for the given CPU profile:
+    - "fp32": unchanged (the baseline);
+    - "bf16": bfloat16 autocast;
+    - "int8": dynamic int8 quantization of the linear layers;
+    - "channels_last": channels-last memory format for the RN image towers;
+    - "compile": torch.compile with weight freezing (the first batches are slow while it compiles).
+
+    The model may be changed in place; pass a copy to keep the original.
+    """
+    options = parse_cpu_profile(profile)
+    if not options:
+        return model
+    if str(device) != "cpu":
+        logger.warning(f"CPU profile '{profile}' ignored on device {device}.")
+        return model
+    if "int8" in options:
+        model = quantize_linear_layers(model)
+    if "channels_last" in options and isinstance(model.visual, ModifiedResNet):
+        model = model.to(memory_format=torch.channels_last)
+    return CPUProfileModel(model, options).eval()
+
+
+# Function to score images against prompts and time the image encoder
+def measure_scores(model, images, text, batch_size):
+    """
+    Returns (scores of shape (num_images, num_prompts), images per second, seconds of the first batch).
+    """
+    with torch.inference_mode():
+        text_features = model.encode_text(text).float()
+        text_features /= text_features.norm(dim=-1, keepdim=True)
+
+        start_time = time.perf_counter()
+        rows = [model.encode_image(images[:batch_size]).float()]
+        warmup_seconds = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        for start in range(batch_size, len(images), batch_size):
+            rows.append(model.encode_image(images[start:start + batch_size]).float())
+        elapsed = time.perf_counter() - start_time
+        image_features = torch.cat(rows)
+        image_features /= image_features.norm(dim=-1, keepdim=True)
+
+    timed_images = len(images) - min(batch_size, len(images))
+    images_per_second = timed_images / elapsed if timed_images and elapsed > 0 else len(images) / warmup_seconds
+    return (image_features @ text_features.T).numpy(), images_per_second, warmup_seconds
+
+
+# Function to compare a CPU profile against the fp32 baseline
+def check_cpu_profile(model, images, text, profile, batch_size=32, baseline=None):
+    """
+    Scores the same images with the fp32 model and with `profile` applied to a copy of it,
+    and reports the throughput change and how far the profiled scores drift.
+
+    :param images: Preprocessed image tensor of shape (num_images, 3, resolution, resolution).
+    :param text: Tokenized prompts.
+    :param baseline: Result of `measure_scores` for the fp32 model, to reuse across profiles.
+    :return: Dictionary with throughput, speedup and score differences.
+    """
+    baseline = baseline or measure_scores(model, images, text, batch_size)
+    profiled_model = apply_cpu_profile(copy.deepcopy(model), profile)
+    scores, images_per_second, warmup_seconds = measure_scores(profiled_model, images, text, batch_size)
+
+    return {
+        "profile": profile,
+        "images": len(images),
+        "images_per_second": round(images_per_second, 2),
+        "baseline_images_per_second": round(baseline[1], 2),
+        "speedup": round(images_per_second / baseline[1], 3),
+        "warmup_seconds": round(warmup_seconds, 3),
+        **compare_scores(scores, baseline[0])
+    }
+
+
+# Function to measure how far scores drift from baseline scores
+def compare_scores(scores, baseline_scores):
+    """
+    Compares two (num_images, num_prompts) score arrays: absolute differences, Spearman rank
+    correlation of the images per prompt, and how often both pick the same best prompt.
+    """
+    differences = np.abs(scores - baseline_scores)
+    ranks = scores.argsort(axis=0).argsort(axis=0)
+    baseline_ranks = baseline_scores.argsort(axis=0).argsort(axis=0)
+    correlations = [np.corrcoef(ranks[:, column], baseline_ranks[:, column])[0, 1] for column in range(scores.shape[1]) if len(scores) > 1 and baseline_ranks[:, column].std() > 0]
+    return {
+        "max_abs_diff": float(differences.max()),
+        "mean_abs_diff": float(differences.mean()),
+        "spearman": float(np.mean(correlations)) if correlations else float("nan"),
+        "top1_agreement": float((scores.argmax(axis=1) == baseline_scores.argmax(axis=1)).mean())
+    }
+
+
+# Function to load up to `count` preprocessed images from a folder
+def load_check_images(target_dir, preprocess, resolution, count=DEFAULT_CHECK_IMAGES):
+    """
+    Returns a tensor of preprocessed images from `target_dir`, or random images when the
+    folder does not exist or has no readable images.
+    """
+    from image_pipeline import load_and_preprocess
+
+    tensors = []
+    if target_dir and os.path.isdir(target_dir):
+        for name in sorted(os.listdir(target_dir)):
+            if len(tensors) >= count:
+                break
+            try:
+                tensors.append(load_and_preprocess(os.path.join(target_dir, name), preprocess))
+            except Exception:
+                continue  # Not an image
+    if not tensors:
+        logger.warning(f"No images found in '{target_dir}'; using {count} random images.")
+        return torch.randn(count, 3, resolution, resolution, generator=torch.Generator().manual_seed(0))
+    return torch.stack(tensors)
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    import clip
+
+    from dynamic_model_loader import load_model
+
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Compare CPU execution profiles against the fp32 baseline.")
+    parser.add_argument("--model", type=str, default="ViT-B/32", help="CLIP model to check.")
+    parser.add_argument("--profiles", type=str, nargs="+", default=["bf16", "int8", "channels_last", "bf16,channels_last"], help="CPU profiles to compare, e.g. bf16 int8 compile bf16,channels_last.")
+    parser.add_argument("--target_dir", type=str, default="target_images", help="Images to score (random images are used if it has none).")
+    parser.add_argument("--images", type=int, default=DEFAULT_CHECK_IMAGES, help="Number of images to score.")
+    parser.add_argument("--prompt", type=str, action="append", default=None, help="Prompt to score against; repeat for several.")
+    parser.add_argument("--batch_size", type=int, default=32, help="Number of images encoded per forward pass.")
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op threads used by torch.")
+    parser.add_argument("--interop_threads", type=int, default=None, help="Inter-op threads used by torch.")
+    parser.add_argument("--output", type=str, default=None, help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    for profile in args.profiles:
+        parse_cpu_profile(profile)
+    set_cpu_threads(args.threads, args.interop_threads)
+    model, preprocess, device = load_model(args.model)
+    if device != "cpu":
+        model, preprocess, device = model.float().cpu(), preprocess, "cpu"
+
+    images = load_check_images(args.target_dir, preprocess, model.visual.input_resolution, args.images)
+    text = clip.tokenize(args.prompt or DEFAULT_CHECK_PROMPTS)
+    baseline = measure_scores(model, images, text, args.batch_size)
+    print(f"fp32 baseline: {baseline[1]:.2f} images/s on {torch.get_num_threads()} threads")
+
+    results = []
+    print(f"{'Profile':<24}{'img/s':>9}{'Speedup':>9}{'Max diff':>11}{'Mean diff':>11}{'Spearman':>10}{'Top-1':>8}")
+    for profile in args.profiles:
+        result = check_cpu_profile(model, images, text, profile, batch_size=args.batch_size, baseline=baseline)
+        results.append(result)
+        print(f"{profile:<24}{result['images_per_second']:>9.2f}{result['speedup']:>9.2f}{result['max_abs_diff']:>11.5f}{result['mean_abs_diff']:>11.5f}{result['spearman']:>10.4f}{result['top1_agreement']:>8.3f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"model": args.model, "threads": torch.get_num_threads(), "results": results}, f, indent=4)
+        print(f"Results saved to: {args.output}")
@@ -0,0 +1,254 @@
+import argparse
+import csv
+import io
+
+import numpy as np
+from PIL import Image
+
+from embedding_cache import CACHE_DIR, EmbeddingCache, hash_bytes, hash_file
+from image_pipeline import prefetch_images
+from input_sources import IMAGE_FILTERS, iter_source
+from metrics import logger
+
+# Ways of grouping duplicates: identical content only, perceptual hash, or CLIP embedding similarity.
+# Every method starts with the exact content hash, so identical files are never decoded twice.
+DEDUP_METHODS = ["exact", "phash", "clip"]
+
+# Default near-duplicate thresholds: maximum Hamming distance between 64-bit perceptual
+# hashes, and minimum cosine similarity between CLIP embeddings
+DEFAULT_PHASH_DISTANCE = 6
+DEFAULT_CLIP_SIMILARITY = 0.95
+
+# Side of the grayscale image the DCT is taken of, and of the low-frequency block kept (8x8 = 64 bits)
+PHASH_IMAGE_SIZE = 32
+PHASH_BITS_SIZE = 8
+
+# Number of pairwise comparisons made at once when looking for near-duplicates
+PAIR_BLOCK_ELEMENTS = 1 << 24
+
+# Orthonormal DCT-II matrix, so that the 2D DCT of X is DCT_MATRIX @ X @ DCT_MATRIX.T
+DCT_MATRIX = np.sqrt(2 / PHASH_IMAGE_SIZE) * np.cos(np.pi * (2 * np.arange(PHASH_IMAGE_SIZE)[None, :] + 1) * np.arange(PHASH_IMAGE_SIZE)[:, None] / (2 * PHASH_IMAGE_SIZE))
+DCT_MATRIX[0] /= np.sqrt(2)
+
+# Number of set bits of every byte value, used to count differing hash bits
+POPCOUNT_TABLE = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+# Function to compute the perceptual hash of an opened image
+def perceptual_hash(image):
+    """
+    Returns a 64-bit pHash: the signs of the lowest DCT frequencies of a 32x32 grayscale copy,
+    compared with their median. JPEGs are decoded at a reduced scale, which is much cheaper
+    than a full decode. Takes an unloaded PIL image, so it can be used as the preprocess
+    function of image_pipeline.prefetch_images.
+    """
+    image.draft("L", (PHASH_IMAGE_SIZE * 2, PHASH_IMAGE_SIZE * 2))
+    pixels = np.asarray(image.convert("L").resize((PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE), Image.BILINEAR), dtype=np.float64)
+    low_frequencies = (DCT_MATRIX @ pixels @ DCT_MATRIX.T)[:PHASH_BITS_SIZE, :PHASH_BITS_SIZE].ravel()
+    bits = low_frequencies > np.median(low_frequencies[1:])  # The DC term only reflects brightness
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+# Function to count the differing bits between 64-bit hashes
+def hamming_distances(hashes, others):
+    """
+    Returns the (len(hashes), len(others)) matrix of Hamming distances between two uint64 arrays.
+    """
+    differences = hashes[:, None] ^ others[None, :]
+    if hasattr(np, "bitwise_count"):  # NumPy 2.0+
+        return np.bitwise_count(differences)
+    return POPCOUNT_TABLE[differences.view(np.uint8)].reshape(*differences.shape, 8).sum(axis=2, dtype=np.uint8)
+
+
+# Function to find pairs of hashes within a Hamming distance
+def hash_pairs(hashes, max_distance):
+    """
+    Yields (i, j) index arrays, i < j, of all pairs of perceptual hashes at most `max_distance` bits apart.
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    block_rows = max(1, PAIR_BLOCK_ELEMENTS // max(1, len(hashes)))
+    for start in range(0, len(hashes), block_rows):
+        rows, columns = np.nonzero(hamming_distances(hashes[start:start + block_rows], hashes[start:]) <= max_distance)
+        rows += start
+        columns += start
+        later = columns > rows
+        yield rows[later], columns[later]
+
+
+# Function to find pairs of similar embeddings
+def similarity_pairs(embeddings, min_similarity):
+    """
+    Yields (i, j) index arrays, i < j, of all pairs of normalized embeddings whose cosine
+    similarity is at least `min_similarity`, computed with blocked matrix multiplies.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    block_rows = max(1, PAIR_BLOCK_ELEMENTS // max(1, len(embeddings)))
+    for start in range(0, len(embeddings), block_rows):
+        rows, columns = np.nonzero(embeddings[start:start + block_rows] @ embeddings[start:].T >= min_similarity)
+        rows += start
+        columns += start
+        later = columns > rows
+        yield rows[later], columns[later]
+
+
+# Function to merge pairs of duplicates into clusters
+def cluster_pairs(count, pairs):
+    """
+    Returns, for each of `count` items, the index of the first item of its cluster. Clusters
+    are the connected components of the given (i, j) pairs (single linkage).
+    """
+    parent = list(range(count))
+
+    def find(index):
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    for rows, columns in pairs:
+        for row, column in zip(rows.tolist(), columns.tolist()):
+            root_row, root_column = find(row), find(column)
+            if root_row != root_column:
+                # The smaller index stays the root, so every cluster is represented by its first item
+                parent[max(root_row, root_column)] = min(root_row, root_column)
+    return [find(index) for index in range(count)]
+
+
+# Function to group the images of an input source into duplicate clusters
+def find_duplicates(target_dir, method="phash", threshold=None, recursive=False, image_filter="extension", workers=0, use_processes=False, embedding_cache=None):
+    """
+    Groups the images of `target_dir` (any input source) into clusters of duplicates.
+
+    Every file is hashed first and identical files join the cluster of their first copy
+    without being decoded. The remaining unique images are then compared with the selected
+    method: "phash" decodes them at a reduced scale on `workers` decode workers and links
+    hashes at most `threshold` bits apart; "clip" links embeddings from `embedding_cache`
+    with a cosine similarity of at least `threshold` (images without a cached embedding
+    stay on their own). The first image of each cluster, in source order, represents it.
+
+    :return: List of dictionaries with 'image_name', 'cluster', 'representative',
+             'cluster_size' and 'match' ("exact", "near" or "" for representatives).
+    """
+    if method not in DEDUP_METHODS:
+        raise ValueError(f"Unknown dedup method '{method}'. Choose from: {DEDUP_METHODS}")
+    if method == "clip" and embedding_cache is None:
+        raise ValueError("Deduplicating with CLIP embeddings needs an embedding cache.")
+
+    names = []
+    exact_first = []  # Index of the first image with the same content
+
+    # Exact duplicates, found from the file content before anything is decoded. Yields the
+    # (index, content hash, path or file object) of the first copy of each content as it is found.
+    def scan_unique():
+        first_of_hash = {}
+        for image_name, image_path, image_data, _ in iter_source(target_dir, recursive=recursive, image_filter=image_filter):
+            try:
+                content_hash = hash_file(image_path) if image_data is None else hash_bytes(image_data)
+            except OSError as e:
+                logger.warning(f"Error processing {image_name}: {e}")
+                continue
+            index = len(names)
+            names.append(image_name)
+            exact_first.append(first_of_hash.setdefault(content_hash, index))
+            if exact_first[index] == index:
+                yield index, content_hash, image_path if image_data is None else io.BytesIO(image_data)
+
+    # Near duplicates among the unique images
+    near_first = {}
+    if method == "phash":
+        hashed_indices = []
+        hashes = []
+        items = ((index, source) for index, _, source in scan_unique())
+        for index, image_hash, error in prefetch_images(items, perceptual_hash, workers=workers, use_processes=use_processes):
+            if error is not None:
+                logger.warning(f"Error processing {names[index]}: {error}")
+                continue
+            hashed_indices.append(index)
+            hashes.append(image_hash)
+        threshold = DEFAULT_PHASH_DISTANCE if threshold is None else threshold
+        for position, root in enumerate(cluster_pairs(len(hashes), hash_pairs(hashes, threshold))):
+            near_first[hashed_indices[position]] = hashed_indices[root]
+    elif method == "clip":
+        embedded_indices = []
+        embeddings = []
+        missing = 0
+        for index, content_hash, _ in scan_unique():
+            embedding = embedding_cache.get(content_hash)
+            if embedding is None:
+                missing += 1
+                continue
+            embedded_indices.append(index)
+            embeddings.append(embedding)
+        if missing:
+            logger.warning(f"{missing} images have no cached embedding and are not compared.")
+        threshold = DEFAULT_CLIP_SIMILARITY if threshold is None else threshold
+        if embeddings:
+            for position, root in enumerate(cluster_pairs(len(embeddings), similarity_pairs(np.stack(embeddings), threshold))):
+                near_first[embedded_indices[position]] = embedded_indices[root]
+    else:
+        for _ in scan_unique():
+            pass
+
+    representatives = [near_first.get(exact_first[index], exact_first[index]) for index in range(len(names))]
+    cluster_ids = {}
+    for representative in representatives:
+        cluster_ids.setdefault(representative, len(cluster_ids))
+    cluster_sizes = np.bincount([cluster_ids[representative] for representative in representatives], minlength=len(cluster_ids))
+    return [
+        {
+            "image_name": names[index],
+            "cluster": cluster_ids[representative],
+            "representative": names[representative],
+            "cluster_size": int(cluster_sizes[cluster_ids[representative]]),
+            "match": "" if representative == index else ("exact" if exact_first[index] != index else "near")
+        }
+        for index, representative in enumerate(representatives)
+    ]
+
+
+# Function to write cluster assignments to a CSV file
+def save_clusters(clusters, clusters_path):
+    with open(clusters_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["image_name", "cluster", "representative", "cluster_size", "match"])
+        writer.writeheader()
+        writer.writerows(clusters)
+    return clusters_path
+
+
+# Function to summarize cluster assignments
+def summarize_clusters(clusters):
+    exact = sum(1 for row in clusters if row["match"] == "exact")
+    near = sum(1 for row in clusters if row["match"] == "near")
+    return f"{len(clusters)} images in {len(clusters) - exact - near} clusters: {exact} exact and {near} near duplicates."
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Group exact and near-duplicate images into clusters.")
+    parser.add_argument("--target_dir", type=str, default="target_images", help="Images to deduplicate: a directory, manifest, tar/zip shard or glob of these.")
+    parser.add_argument("--method", type=str, default="phash", choices=DEDUP_METHODS, help="How near-duplicates are found after exact duplicates are removed.")
+    parser.add_argument("--threshold", type=float, default=None, help=f"Maximum Hamming distance for phash (default {DEFAULT_PHASH_DISTANCE}) or minimum cosine similarity for clip (default {DEFAULT_CLIP_SIMILARITY}).")
+    parser.add_argument("--recursive", action="store_true", help="Also include images in subdirectories.")
+    parser.add_argument("--image_filter", type=str, default="extension", choices=IMAGE_FILTERS, help="How files are recognized as images.")
+    parser.add_argument("--workers", type=int, default=0, help="Number of workers decoding images for perceptual hashes.")
+    parser.add_argument("--cache_dir", type=str, default=CACHE_DIR, help="Embedding cache used by the clip method.")
+    parser.add_argument("--model", type=str, default=None, help="Model the cached embeddings were computed with (clip method).")
+    parser.add_argument("--resolution", type=int, default=None, help="Preprocess resolution of the cached embeddings (clip method).")
+    parser.add_argument("--output", type=str, default="clusters.csv", help="CSV file the cluster assignments are written to.")
+    args = parser.parse_args(argv)
+
+    embedding_cache = None
+    if args.method == "clip":
+        if not args.model:
+            parser.error("--method clip needs --model.")
+        from retrieval_index import find_cache_resolution
+
+        embedding_cache = EmbeddingCache(args.cache_dir, args.model, args.resolution or find_cache_resolution(args.cache_dir, args.model))
+
+    clusters = find_duplicates(args.target_dir, args.method, args.threshold, recursive=args.recursive, image_filter=args.image_filter, workers=args.workers, embedding_cache=embedding_cache)
+    print(summarize_clusters(clusters))
+    print(f"Clusters saved to: {save_clusters(clusters, args.output)}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
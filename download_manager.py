@@ -0,0 +1,177 @@
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from embedding_cache import hash_file
+from metrics import logger
+
+# Directory to store downloaded models
+MODEL_DIR = "models"
+
+# CLIP model URLs from the OpenAI project; the SHA256 of each file is part of its URL
+CLIP_MODEL_URLS = {
+    "RN50": "https://openaipublic.azureedge.net/clip/models/afeb0e10f9e5a86da6080e35cf09123aca3b358a0c3e3b6c78a7b63bc04b6762/RN50.pt",
+    "RN101": "https://openaipublic.azureedge.net/clip/models/8fa8567bab74a42d41c5915025a8e4538c3bdbe8804a470a72f30b0d94fab599/RN101.pt",
+    "RN50x4": "https://openaipublic.azureedge.net/clip/models/7e526bd135e493cef0776de27d5f42653e6b4c8bf9e0f653bb11773263205fdd/RN50x4.pt",
+    "RN50x16": "https://openaipublic.azureedge.net/clip/models/52378b407f34354e150460fe41077663dd5b39c54cd0bfd2b27167a4a06ec9aa/RN50x16.pt",
+    "RN50x64": "https://openaipublic.azureedge.net/clip/models/be1cfb55d75a9666199fb2206c106743da0f6468c9d327f3e0d0a543a9919d9c/RN50x64.pt",
+    "ViT-B/32": "https://openaipublic.azureedge.net/clip/models/40d365715913c9da98579312b702a82c18be219cc2a73407c4526f58eba950af/ViT-B-32.pt",
+    "ViT-B/16": "https://openaipublic.azureedge.net/clip/models/5806e77cd80f8b59890b7e101eabd078d9fb84e6937f9e85e4ecb61988df416f/ViT-B-16.pt",
+    "ViT-L/14": "https://openaipublic.azureedge.net/clip/models/b8cca3fd41ae0c99ba7e8951adf17d267cdb84cd88be6f7c2e0eca1737a03836/ViT-L-14.pt",
+    "ViT-L/14@336px": "https://openaipublic.azureedge.net/clip/models/3035c92b350959924f9f00213499208652fc7ea050643e8b385c2dac08641f02/ViT-L-14-336px.pt",
+}
+
+# Size of the chunks read from the network and written to disk
+CHUNK_SIZE = 1 << 20
+
+# Default number of models downloaded at the same time
+DEFAULT_DOWNLOAD_WORKERS = 4
+
+# Number of attempts per file; each retry resumes from the bytes already on disk
+MAX_ATTEMPTS = 5
+
+# Seconds to wait for the server before an attempt fails
+REQUEST_TIMEOUT = 30
+
+# Suffix of a partially downloaded file
+PARTIAL_SUFFIX = ".part"
+
+
+class ChecksumError(Exception):
+    pass
+
+
+# Function to get the local path of a model
+def get_model_path(model_name, model_dir=MODEL_DIR):
+    """
+    Returns the file a model is saved to, e.g. `models/ViT-B_32.pt` for ViT-B/32.
+    """
+    return os.path.join(model_dir, f"{model_name.replace('/', '_')}.pt")
+
+
+# Function to read the expected SHA256 from an OpenAI model URL
+def get_expected_sha256(url):
+    """
+    Returns the 64-character hex digest embedded in the URL path, or None if there is none.
+    """
+    match = re.search(r"/([0-9a-f]{64})/", url)
+    return match.group(1) if match else None
+
+
+# Function to download one file with resume, checksum verification and an atomic rename
+def download_file(url, file_path, expected_sha256=None, chunk_size=CHUNK_SIZE, max_attempts=MAX_ATTEMPTS, session=None):
+    """
+    Downloads `url` to `file_path`.
+
+    Bytes are written to `<file_path>.part`. A failed or interrupted download keeps the part
+    file and the next attempt (or the next run) continues it with an HTTP Range request.
+    The finished file is checked against `expected_sha256` and only then renamed to
+    `file_path`, so `file_path` never holds a partial or corrupt download.
+
+    :return: Number of bytes received over the network.
+    """
+    import requests
+
+    session = session or requests.Session()
+    partial_path = file_path + PARTIAL_SUFFIX
+    received = 0
+    for attempt in range(1, max_attempts + 1):
+        offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as response:
+                if response.status_code == 416:
+                    pass  # The part file already holds every byte
+                else:
+                    response.raise_for_status()
+                    if offset and response.status_code != 206:
+                        offset = 0  # The server ignored the range; start over
+                    with open(partial_path, "ab" if offset else "wb") as f:
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            f.write(chunk)
+                            received += len(chunk)
+        except (requests.RequestException, OSError) as e:
+            if attempt == max_attempts:
+                raise
+            logger.warning(f"Download of {os.path.basename(file_path)} interrupted ({e}); retrying ({attempt}/{max_attempts - 1}).")
+            time.sleep(min(2 ** attempt, 30))
+            continue
+
+        if expected_sha256 and hash_file(partial_path) != expected_sha256:
+            os.remove(partial_path)
+            # A fresh download that does not match will not match on a retry either
+            if offset == 0 or attempt == max_attempts:
+                raise ChecksumError(f"{os.path.basename(file_path)} does not match its SHA256 {expected_sha256}.")
+            logger.warning(f"Checksum mismatch for {os.path.basename(file_path)} after resuming; downloading it again from the start.")
+            continue
+
+        os.replace(partial_path, file_path)
+        return received
+
+
+# Function to check a downloaded model against the hash in its URL
+def verify_model(model_name, model_dir=MODEL_DIR, urls=CLIP_MODEL_URLS):
+    """
+    Returns True if the model file exists and matches the SHA256 in its URL.
+    """
+    model_path = get_model_path(model_name, model_dir)
+    if not os.path.exists(model_path):
+        return False
+    expected_sha256 = get_expected_sha256(urls[model_name])
+    return expected_sha256 is None or hash_file(model_path) == expected_sha256
+
+
+# Function to download one model unless it is already present
+def download_model(model_name, model_dir=MODEL_DIR, urls=CLIP_MODEL_URLS, session=None):
+    """
+    Downloads a model into `model_dir` and returns its path. Files already in place were
+    verified when they were downloaded and are not hashed again.
+    """
+    if model_name not in urls:
+        raise ValueError(f"Model {model_name} is not available. Choose from: {list(urls.keys())}")
+
+    model_path = get_model_path(model_name, model_dir)
+    if os.path.exists(model_path):
+        logger.info(f"{model_name} is already downloaded.")
+        return model_path
+
+    os.makedirs(model_dir, exist_ok=True)
+    url = urls[model_name]
+    resuming = os.path.exists(model_path + PARTIAL_SUFFIX)
+    logger.info(f"{'Resuming' if resuming else 'Downloading'} {model_name} from {url}...")
+    start_time = time.perf_counter()
+    received = download_file(url, model_path, expected_sha256=get_expected_sha256(url), session=session)
+    elapsed = time.perf_counter() - start_time
+    logger.info(f"{model_name} downloaded and verified ({received / 2**20:.1f} MB in {elapsed:.1f}s).")
+    return model_path
+
+
+# Function to download several models concurrently
+def download_models(model_names, workers=DEFAULT_DOWNLOAD_WORKERS, model_dir=MODEL_DIR, urls=CLIP_MODEL_URLS):
+    """
+    Downloads models on a pool of threads.
+
+    :return: Dictionary mapping each model name to its path, or to the exception that stopped it.
+    """
+    import requests
+
+    # requests sessions are not thread-safe, so each worker thread gets its own
+    local = threading.local()
+
+    def download(model_name):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return download_model(model_name, model_dir=model_dir, urls=urls, session=local.session)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="download") as executor:
+        futures = {model_name: executor.submit(download, model_name) for model_name in model_names}
+        for model_name, future in futures.items():
+            try:
+                results[model_name] = future.result()
+            except Exception as e:
+                logger.error(f"Failed to download {model_name}: {e}")
+                results[model_name] = e
+    return results
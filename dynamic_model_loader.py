@@ -1,66 +1,128 @@
+import inspect
 import os
+import time
 import clip
 import torch
-import requests
-import GPUtil
-
-# Directory to store downloaded models
-MODEL_DIR = "models"
-
-# CLIP model URLs from the OpenAI project
-CLIP_MODEL_URLS = {
-    "RN50": "https://openaipublic.azureedge.net/clip/models/afeb0e10f9e5a86da6080e35cf09123aca3b358a0c3e3b6c78a7b63bc04b6762/RN50.pt",
-    "RN101": "https://openaipublic.azureedge.net/clip/models/8fa8567bab74a42d41c5915025a8e4538c3bdbe8804a470a72f30b0d94fab599/RN101.pt",
-    "RN50x4": "https://openaipublic.azureedge.net/clip/models/7e526bd135e493cef0776de27d5f42653e6b4c8bf9e0f653bb11773263205fdd/RN50x4.pt",
-    "RN50x16": "https://openaipublic.azureedge.net/clip/models/52378b407f34354e150460fe41077663dd5b39c54cd0bfd2b27167a4a06ec9aa/RN50x16.pt",
-    "RN50x64": "https://openaipublic.azureedge.net/clip/models/be1cfb55d75a9666199fb2206c106743da0f6468c9d327f3e0d0a543a9919d9c/RN50x64.pt",
-    "ViT-B/32": "https://openaipublic.azureedge.net/clip/models/40d365715913c9da98579312b702a82c18be219cc2a73407c4526f58eba950af/ViT-B-32.pt",
-    "ViT-B/16": "https://openaipublic.azureedge.net/clip/models/5806e77cd80f8b59890b7e101eabd078d9fb84e6937f9e85e4ecb61988df416f/ViT-B-16.pt",
-    "ViT-L/14": "https://openaipublic.azureedge.net/clip/models/b8cca3fd41ae0c99ba7e8951adf17d267cdb84cd88be6f7c2e0eca1737a03836/ViT-L-14.pt",
-    "ViT-L/14@336px": "https://openaipublic.azureedge.net/clip/models/3035c92b350959924f9f00213499208652fc7ea050643e8b385c2dac08641f02/ViT-L-14-336px.pt",
-}
-
-# Function to download a model if it's not already downloaded
-def download_model(model_name):
-    if model_name not in CLIP_MODEL_URLS:
-        raise ValueError(f"Model {model_name} is not available. Choose from: {list(CLIP_MODEL_URLS.keys())}")
-
-    url = CLIP_MODEL_URLS[model_name]
-    sanitized_model_name = model_name.replace("/", "_")  # Replace forward slash with underscore
-    model_path = os.path.join(MODEL_DIR, f"{sanitized_model_name}.pt")
-    os.makedirs(MODEL_DIR, exist_ok=True)
-
-    if not os.path.exists(model_path):
-        print(f"Downloading {model_name} from {url}...")
-        response = requests.get(url, stream=True)
-        with open(model_path, "wb") as f:
-            for chunk in response.iter_content(chunk_size=1024):
-                f.write(chunk)
-        print(f"{model_name} downloaded successfully!")
-    else:
-        print(f"{model_name} is already downloaded.")
-    return model_path
+from clip.clip import _transform
+from clip.model import build_model, convert_weights
+from download_manager import MODEL_DIR, download_model
+from metrics import logger
+
+# Suffix of the fast-loading copy written next to each downloaded model
+FAST_MODEL_SUFFIX = ".state.pt"
+
+# Memory-mapping the copy (torch.load(mmap=...)) and assigning its tensors (load_state_dict(assign=...))
+# need torch 2.1; older versions load the copy into memory and build the model normally
+FAST_LOAD_SUPPORTED = "mmap" in inspect.signature(torch.load).parameters and "assign" in inspect.signature(torch.nn.Module.load_state_dict).parameters
+
+
+# Function to get the path of the fast-loading copy of a model
+def get_fast_model_path(model_name):
+    return os.path.join(MODEL_DIR, model_name.replace("/", "_") + FAST_MODEL_SUFFIX)
+
+
+# Function to convert a downloaded model into the fast-loading format
+def convert_model(model_path, fast_model_path):
+    """
+    Loads the OpenAI archive once and saves the float32 state dict of the non-JIT model as a
+    plain torch zip file, which `load_fast_model` can memory-map instead of deserializing.
+    """
+    model, _ = clip.load(model_path, device="cpu")
+    temp_path = f"{fast_model_path}.tmp"
+    torch.save(model.state_dict(), temp_path)
+    os.replace(temp_path, fast_model_path)
+
+
+# Function to build a CLIP model from its fast-loading copy
+def load_fast_model(fast_model_path, device):
+    """
+    Memory-maps the saved state dict and builds the non-JIT CLIP model around it.
+    The module is created on the meta device, so no memory is allocated or initialized for
+    weights that are replaced right away. Matches `clip.load(..., jit=False)` on `device`.
+    Without FAST_LOAD_SUPPORTED, the state dict is read into memory and the model is built
+    with `build_model`, as `clip.load` does.
+    """
+    if not FAST_LOAD_SUPPORTED:
+        model = build_model(torch.load(fast_model_path, map_location="cpu"))
+        if str(device) == "cpu":
+            model.float()  # build_model converts to float16, which clip.load undoes on the CPU
+        model = model.to(device).eval()
+        return model, _transform(model.visual.input_resolution)
+
+    state_dict = torch.load(fast_model_path, map_location="cpu", mmap=True, weights_only=True)
+    with torch.device("meta"):
+        model = build_model(dict(state_dict))
+    model.load_state_dict(state_dict, assign=True)
+
+    # The causal attention mask is a plain attribute rather than a buffer, so rebuild it off the meta device
+    attn_mask = model.build_attention_mask().to("cpu") if model.transformer.resblocks[0].attn_mask is not None else None
+    for block in model.transformer.resblocks:
+        block.attn_mask = attn_mask
+
+    if str(device) != "cpu":
+        convert_weights(model)  # clip.load keeps float16 weights off the CPU
+    model = model.to(device).eval()
+    return model, _transform(model.visual.input_resolution)
 
 
 # Function to load the CLIP model and preprocess function
-def load_model(model_name):
+def load_model(model_name, use_fast_cache=True, timings=None):
     """
     Load a CLIP model from a pre-downloaded file or URL.
+
+    The first load converts the downloaded archive into a fast-loading copy
+    (`models/<model>.state.pt`); later loads build the model from that copy.
+
+    :param use_fast_cache: Set to False to always load the original archive with `clip.load`.
+    :param timings: Optional dictionary that receives the seconds spent in each loading stage.
     """
-    model_path = download_model(model_name)
+    timings = timings if timings is not None else {}
     device = "cuda" if torch.cuda.is_available() else "cpu"
-    model, preprocess = clip.load(model_path, device=device)
+    fast_model_path = get_fast_model_path(model_name)
+
+    start_time = time.perf_counter()
+    if use_fast_cache and os.path.exists(fast_model_path):
+        model_path = None  # The original archive is only needed to rebuild the copy
+    else:
+        model_path = download_model(model_name)
+    timings["download"] = time.perf_counter() - start_time
+
+    if not use_fast_cache:
+        start_time = time.perf_counter()
+        model, preprocess = clip.load(model_path, device=device)
+        timings["clip.load"] = time.perf_counter() - start_time
+        return model, preprocess, device
+
+    if model_path is not None:
+        start_time = time.perf_counter()
+        logger.info(f"Converting {model_name} to a fast-loading copy: {fast_model_path}")
+        convert_model(model_path, fast_model_path)
+        timings["convert"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    try:
+        model, preprocess = load_fast_model(fast_model_path, device)
+    except Exception as e:
+        if model_path is not None:
+            raise  # Freshly converted, so the archive itself is the problem
+        # A damaged copy is rebuilt from the original archive
+        logger.warning(f"Could not load {fast_model_path} ({e}); converting it again.")
+        os.remove(fast_model_path)
+        return load_model(model_name, use_fast_cache=use_fast_cache, timings=timings)
+    timings["load"] = time.perf_counter() - start_time
     return model, preprocess, device
 
 # Function to select a model based on VRAM
 def select_model_based_on_vram():
+    import GPUtil  # Only needed when no model is given
+
     gpus = GPUtil.getGPUs()
     if not gpus:
-        print("No GPU found. Defaulting to the smallest model (RN50).")
+        logger.info("No GPU found. Defaulting to the smallest model (RN50).")
         return "RN50"
 
     available_vram = max(gpu.memoryFree for gpu in gpus)  # Get the largest available VRAM
-    print(f"Available VRAM: {available_vram} MB")
+    logger.info(f"Available VRAM: {available_vram} MB")
 
     if available_vram >= 16000:
         return "ViT-L/14@336px"
@@ -0,0 +1,305 @@
+import hashlib
+import heapq
+import json
+import os
+
+import numpy as np
+
+# Directory to store cached image embeddings
+CACHE_DIR = "cache"
+
+# Default number of embeddings kept per model/resolution before the least recently used are evicted
+DEFAULT_MAX_ENTRIES = 200000
+
+# Fraction of entries dropped at once when the cache is full
+EVICTION_FRACTION = 0.1
+
+# Tolerance used when checking that stored embeddings are still normalized
+NORM_TOLERANCE = 1e-2
+
+
+# Function to hash the content of a file
+def hash_file(file_path, chunk_size=1 << 20):
+    """
+    Returns the SHA256 hex digest of a file's content, read in chunks without decoding it.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Function to hash image bytes held in memory, e.g. an archive member
+def hash_bytes(data):
+    """
+    Returns the SHA256 hex digest of `data`, equal to hash_file of a file with that content.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent store of normalized CLIP image embeddings.
+
+    Embeddings live in a memory-mapped float16 matrix (`embeddings.f16`) next to an index file
+    (`index.json`) that maps file content hashes to matrix rows. Each (model name, preprocess
+    resolution) pair gets its own store directory, so the effective key is
+    (content hash, model name, resolution). When the store holds `max_entries` embeddings the
+    least recently used ones are evicted. Their rows are only reused once `save` has written an
+    index without them, so a run that stops early never leaves the index on disk pointing at a
+    row that holds another image's embedding.
+
+    A store is not locked, so only one process may write it at a time. Other processes open it
+    with `read_only` and, like shard workers, pass it as the `fallback` of a store of their own:
+    lookups that miss their own store are served from it, and their new embeddings are merged
+    into it afterwards (see merge).
+    """
+
+    def __init__(self, cache_dir, model_name, resolution, max_entries=DEFAULT_MAX_ENTRIES, read_only=False, fallback=None):
+        if max_entries < 1:
+            raise ValueError(f"max_entries must be at least 1, got {max_entries}.")
+
+        self.model_name = model_name
+        self.resolution = resolution
+        self.max_entries = max_entries
+        self.read_only = read_only
+        self.fallback = fallback
+        sanitized_model_name = model_name.replace("/", "_")  # Replace forward slash with underscore
+        self.store_dir = os.path.join(cache_dir, f"{sanitized_model_name}_{resolution}px")
+        self.index_path = os.path.join(self.store_dir, "index.json")
+        self.matrix_path = os.path.join(self.store_dir, "embeddings.f16")
+        if not read_only:
+            os.makedirs(self.store_dir, exist_ok=True)
+
+        self.entries = {}  # content hash -> [row, last_used]
+        self.dim = None
+        self.capacity = 0
+        self.clock = 0
+        self.matrix = None
+        self.free_rows = []
+        self.pending_rows = []  # Rows evicted since the index was last saved, not reused before the next save
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self):
+        """
+        Loads the index and maps the embedding matrix, if the store already exists.
+        """
+        if not os.path.exists(self.index_path):
+            return
+
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        self.dim = index["dim"]
+        self.capacity = index["capacity"]
+        self.clock = index["clock"]
+        self.entries = {content_hash: list(entry) for content_hash, entry in index["entries"].items()}
+
+        if self.capacity and os.path.exists(self.matrix_path):
+            self.matrix = np.memmap(self.matrix_path, dtype=np.float16, mode="r" if self.read_only else "r+", shape=(self.capacity, self.dim))
+        used_rows = {row for row, _ in self.entries.values()}
+        self.free_rows = sorted(set(range(self.capacity)) - used_rows, reverse=True)
+
+        if len(self.entries) > self.max_entries:
+            self.evict(len(self.entries) - self.max_entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, content_hash):
+        return content_hash in self.entries or (self.fallback is not None and content_hash in self.fallback)
+
+    def get(self, content_hash):
+        """
+        Returns the cached embedding as a float32 array, or None if it is not cached.
+        """
+        entry = self.entries.get(content_hash)
+        if entry is None or self.matrix is None:
+            embedding = self.fallback.get(content_hash) if self.fallback is not None else None
+            if embedding is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return embedding
+
+        self.clock += 1
+        entry[1] = self.clock
+        self.hits += 1
+        return np.asarray(self.matrix[entry[0]], dtype=np.float32)
+
+    def put(self, content_hash, embedding):
+        """
+        Stores a normalized embedding for the given content hash.
+        """
+        if self.read_only:
+            raise ValueError(f"Embedding cache {self.store_dir} was opened read-only.")
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        if self.dim is None:
+            self.dim = embedding.shape[0]
+        elif embedding.shape[0] != self.dim:
+            raise ValueError(f"Embedding dimension {embedding.shape[0]} does not match cache dimension {self.dim}.")
+
+        self.clock += 1
+        entry = self.entries.get(content_hash)
+        if entry is None:
+            if len(self.entries) >= self.max_entries:
+                self.evict(max(1, int(self.max_entries * EVICTION_FRACTION)))
+            if not self.free_rows and self.pending_rows:
+                self.save()
+            if not self.free_rows:
+                self.grow()
+            entry = [self.free_rows.pop(), self.clock]
+            self.entries[content_hash] = entry
+        else:
+            entry[1] = self.clock
+        self.matrix[entry[0]] = embedding
+
+    def merge(self, other):
+        """
+        Copies the entries of another store, e.g. one written by a shard worker, into this one.
+        Entries are added least recently used first, so the most recent ones are kept when
+        the store is full. Returns the number of entries merged.
+        """
+        for content_hash, (row, _) in sorted(other.entries.items(), key=lambda item: item[1][1]):
+            self.put(content_hash, other.matrix[row])
+        return len(other.entries)
+
+    def evict(self, count):
+        """
+        Drops the `count` least recently used entries. Their rows are freed by the next `save`.
+        """
+        for content_hash, (row, _) in heapq.nsmallest(count, self.entries.items(), key=lambda item: item[1][1]):
+            del self.entries[content_hash]
+            self.pending_rows.append(row)
+
+    def grow(self):
+        """
+        Doubles the capacity of the embedding matrix, up to `max_entries` rows.
+        """
+        new_capacity = min(max(1024, self.capacity * 2), self.max_entries)
+        if self.matrix is not None:
+            self.matrix.flush()
+            self.matrix = None
+        mode = "r+" if os.path.exists(self.matrix_path) and self.capacity else "w+"
+        if mode == "r+":
+            with open(self.matrix_path, "r+b") as f:
+                f.truncate(new_capacity * self.dim * 2)
+        self.matrix = np.memmap(self.matrix_path, dtype=np.float16, mode=mode, shape=(new_capacity, self.dim))
+        self.free_rows = list(range(new_capacity - 1, self.capacity - 1, -1)) + self.free_rows
+        self.capacity = new_capacity
+
+    def save(self):
+        """
+        Flushes the embedding matrix and atomically rewrites the index file, then frees the
+        rows of entries evicted since the last save.
+        """
+        if self.read_only:
+            return
+        if self.matrix is not None:
+            self.matrix.flush()
+        index = {
+            "model_name": self.model_name,
+            "resolution": self.resolution,
+            "dim": self.dim,
+            "capacity": self.capacity,
+            "clock": self.clock,
+            "entries": self.entries
+        }
+        temp_path = f"{self.index_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(temp_path, self.index_path)
+        self.free_rows.extend(self.pending_rows)
+        self.pending_rows = []
+
+    def verify(self, repair=False):
+        """
+        Checks that the index and the embedding matrix agree with each other.
+        Returns a list of problems found; with `repair=True` inconsistent entries are dropped.
+
+        :param repair: Remove entries that point outside the matrix, share a row, or hold a non-normalized vector.
+        """
+        problems = []
+        if not self.entries:
+            return problems
+
+        if self.matrix is None:
+            problems.append(f"Index lists {len(self.entries)} entries but {self.matrix_path} is missing.")
+            if repair:
+                self.entries = {}
+                self.free_rows = []
+                self.capacity = 0
+            return problems
+
+        expected_size = self.capacity * self.dim * 2
+        actual_size = os.path.getsize(self.matrix_path)
+        if actual_size != expected_size:
+            problems.append(f"Matrix file size mismatch. Expected {expected_size}, got {actual_size}.")
+
+        bad_hashes = []
+        seen_rows = set()
+        for content_hash, (row, _) in self.entries.items():
+            if not 0 <= row < self.capacity:
+                problems.append(f"Entry {content_hash} points to row {row} outside capacity {self.capacity}.")
+                bad_hashes.append(content_hash)
+            elif row in seen_rows:
+                problems.append(f"Entry {content_hash} shares row {row} with another entry.")
+                bad_hashes.append(content_hash)
+            else:
+                seen_rows.add(row)
+
+        if seen_rows:
+            rows = np.fromiter(seen_rows, dtype=np.int64)
+            norms = np.linalg.norm(np.asarray(self.matrix[rows], dtype=np.float32), axis=1)
+            bad_rows = set(rows[np.abs(norms - 1.0) > NORM_TOLERANCE].tolist())
+            for content_hash, (row, _) in self.entries.items():
+                if row in bad_rows:
+                    problems.append(f"Entry {content_hash} at row {row} is not a normalized embedding.")
+                    bad_hashes.append(content_hash)
+
+        if len(self.entries) > self.max_entries:
+            problems.append(f"Index holds {len(self.entries)} entries, above the limit of {self.max_entries}.")
+
+        if repair and bad_hashes:
+            for content_hash in set(bad_hashes):
+                del self.entries[content_hash]
+            used_rows = {row for row, _ in self.entries.values()}
+            self.free_rows = sorted(set(range(self.capacity)) - used_rows, reverse=True)
+            self.pending_rows = []
+            self.save()
+        return problems
+
+    def stats(self):
+        """
+        Returns a dictionary describing the store size and hit rate for this session.
+        """
+        return {
+            "store_dir": self.store_dir,
+            "entries": len(self.entries),
+            "capacity": self.capacity,
+            "max_entries": self.max_entries,
+            "dim": self.dim,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Inspect and verify the persistent image-embedding cache.")
+    parser.add_argument("--cache_dir", type=str, default=CACHE_DIR, help="Directory containing the embedding cache.")
+    parser.add_argument("--model", type=str, required=True, help="CLIP model the embeddings were computed with (e.g., ViT-B/32).")
+    parser.add_argument("--resolution", type=int, required=True, help="Preprocess resolution of the model (e.g., 224).")
+    parser.add_argument("--repair", action="store_true", help="Drop inconsistent entries instead of only reporting them.")
+    args = parser.parse_args()
+
+    cache = EmbeddingCache(args.cache_dir, args.model, args.resolution)
+    print(json.dumps(cache.stats(), indent=4))
+    problems = cache.verify(repair=args.repair)
+    for problem in problems:
+        print(problem)
+    print("Cache is consistent." if not problems else f"Found {len(problems)} problems.")
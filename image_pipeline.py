@@ -0,0 +1,278 @@
+import math
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from PIL import Image, JpegImagePlugin
+
+# Default pixel budget of one decoded image, per decode worker (about 200 MB as RGB). Larger
+# images are decoded at a reduced scale where the format allows it and downscaled to fit.
+DEFAULT_MAX_DECODE_PIXELS = 64_000_000
+
+# With a reduced decode, images keep a short side of at least this many times the preprocess
+# resolution, so the preprocess resize still downsamples and its output barely changes
+REDUCE_MARGIN = 2
+
+# Over-budget images of formats that can only be decoded at full size are decoded one at a
+# time per process, so concurrent decode threads never hold several of them at once
+FULL_DECODE_LOCK = threading.Lock()
+
+# Leading bytes of every JPEG file
+JPEG_SIGNATURE = b"\xff\xd8\xff"
+
+
+# Function to find the resolution a preprocess transform resizes images to
+def get_preprocess_size(preprocess):
+    """
+    Returns the short side size of the first Resize in a torchvision Compose (CLIP resizes
+    the short side, then center crops), or None for other preprocess functions.
+    """
+    for transform in getattr(preprocess, "transforms", []):
+        if type(transform).__name__ == "Resize":
+            size = transform.size
+            return size if isinstance(size, int) else min(size)
+    return None
+
+
+# Function to open an image, also when Pillow considers a JPEG a decompression bomb
+def open_image(image_path):
+    """
+    Opens an image lazily. JPEGs above Pillow's decompression bomb limit are opened anyway,
+    since decode_bounded decodes them at a reduced scale (at most 1/8 of each side, below the
+    limit for any JPEG size). Other formats can only be decoded at full size, so for them the
+    DecompressionBombError is raised as usual. Pillow's limit itself is never changed, since
+    other threads decode with it at the same time; JPEGs are opened with the JPEG plugin
+    directly, which skips the check in Image.open.
+    """
+    try:
+        return Image.open(image_path)
+    except Image.DecompressionBombError:
+        if hasattr(image_path, "read"):
+            image_path.seek(0)
+            header = image_path.read(len(JPEG_SIGNATURE))
+            image_path.seek(0)
+        else:
+            with open(image_path, "rb") as f:
+                header = f.read(len(JPEG_SIGNATURE))
+        if header != JPEG_SIGNATURE:
+            raise
+    return JpegImagePlugin.JpegImageFile(image_path)  # Only reads the header
+
+
+# Function to decode an opened image within a pixel budget
+def decode_bounded(image, min_short_side=None, max_pixels=DEFAULT_MAX_DECODE_PIXELS):
+    """
+    Decodes an opened, unloaded image at the smallest size that still has a short side of
+    `min_short_side` (None keeps the full resolution), and at most `max_pixels` pixels.
+
+    JPEGs are decoded at 1/2, 1/4 or 1/8 scale by the decoder itself (PIL draft), so a
+    reduced decode costs a fraction of the time and memory of a full one. Other formats are
+    decoded at full size and then shrunk with a box filter; over-budget ones are decoded one
+    at a time, and only up to Pillow's decompression bomb limit (see open_image).
+    Returns the image itself when nothing needs to be reduced.
+    """
+    width, height = image.size
+    scale = 1.0
+    if min_short_side:
+        scale = min(scale, min_short_side / min(width, height))
+    if max_pixels and width * height > max_pixels:
+        scale = min(scale, math.sqrt(max_pixels / (width * height)))
+    if scale >= 1:
+        return image
+
+    image.draft(None, (max(1, math.ceil(width * scale)), max(1, math.ceil(height * scale))))
+    width, height = image.size
+    factor = max(1, min(width, height) // min_short_side) if min_short_side else 1
+    if max_pixels and width * height > max_pixels:
+        factor = max(factor, math.ceil(math.sqrt(width * height / max_pixels)))
+        with FULL_DECODE_LOCK:
+            image.load()
+    if factor < 2:
+        return image
+    if image.mode in ("1", "P"):
+        image = image.convert("RGB")  # Box reduction needs real pixel values
+    return image.reduce(factor)
+
+
+# Function to decode and preprocess a single image
+def load_and_preprocess(image_path, preprocess, timings=None, max_pixels=DEFAULT_MAX_DECODE_PIXELS, reduced_decode=False):
+    """
+    Opens an image file, applies the CLIP preprocess transform and closes the file.
+    If a `timings` dictionary is given, the seconds spent decoding and preprocessing are stored in it.
+    Images above `max_pixels` are downscaled to fit instead of failing; with `reduced_decode`,
+    every image is decoded at the smallest size the preprocess resize needs (see decode_bounded).
+    Without a pixel budget, Pillow's decompression bomb limit applies to every format.
+    """
+    preprocess_size = get_preprocess_size(preprocess) if reduced_decode else None
+    min_short_side = REDUCE_MARGIN * preprocess_size if preprocess_size else None
+    with (open_image(image_path) if max_pixels else Image.open(image_path)) as opened_image:
+        start_time = time.perf_counter()
+        image = decode_bounded(opened_image, min_short_side, max_pixels)
+        if timings is None:
+            return preprocess(image)
+        image.load()
+        decoded_time = time.perf_counter()
+        image_tensor = preprocess(image)
+        timings["decode"] = decoded_time - start_time
+        timings["preprocess"] = time.perf_counter() - decoded_time
+        return image_tensor
+
+
+# Function to run a task and capture its error instead of raising it
+def run_task(image_path, preprocess, with_timings=False, max_pixels=DEFAULT_MAX_DECODE_PIXELS, reduced_decode=False):
+    """
+    Returns (image_tensor, None) on success and (None, error) when the image cannot be loaded.
+    With `with_timings`, a dictionary of decode/preprocess seconds is appended to the tuple.
+    """
+    timings = {} if with_timings else None
+    try:
+        result = load_and_preprocess(image_path, preprocess, timings, max_pixels, reduced_decode), None
+    except Exception as e:
+        result = None, e
+    return (*result, timings) if with_timings else result
+
+
+# Function to decode and preprocess images ahead of the consumer
+def prefetch_images(items, preprocess, workers=0, use_processes=False, max_pending=None, timings=False, max_pixels=DEFAULT_MAX_DECODE_PIXELS, reduced_decode=False):
+    """
+    Decodes and preprocesses images on a pool of workers while the caller consumes earlier results.
+
+    :param items: Iterable of (key, image_path) pairs. An image_path of None means there is nothing to decode.
+    :param preprocess: CLIP preprocess transform applied to each opened image.
+    :param workers: Number of decode workers. 0 decodes on the calling thread.
+    :param use_processes: Use a process pool instead of a thread pool (the preprocess transform must be picklable).
+    :param max_pending: Maximum number of images decoded ahead of the consumer, which bounds queue memory.
+    :param timings: Also yield a dictionary with the decode and preprocess seconds of each image.
+    :param max_pixels: Pixel budget of each decoded image (see decode_bounded).
+    :param reduced_decode: Decode images at the smallest size the preprocess resize needs.
+    :return: Generator of (key, image_tensor, error) in the same order as `items`, or
+             (key, image_tensor, error, timings) with `timings`.
+    """
+    skipped = (None, None, {}) if timings else (None, None)
+    if workers < 1:
+        for key, image_path in items:
+            if image_path is None:
+                yield (key, *skipped)
+            else:
+                yield (key, *run_task(image_path, preprocess, timings, max_pixels, reduced_decode))
+        return
+
+    max_pending = max_pending or workers * 2
+    if use_processes:
+        # Spawn avoids forking a process that already runs torch threads
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="decode")
+
+    pending = deque()
+    try:
+        for key, image_path in items:
+            if image_path is None:
+                future = Future()
+                future.set_result(skipped)
+            else:
+                future = executor.submit(run_task, image_path, preprocess, timings, max_pixels, reduced_decode)
+            pending.append((key, future))
+
+            if len(pending) >= max_pending:
+                key, future = pending.popleft()
+                yield (key, *future.result())
+
+        while pending:
+            key, future = pending.popleft()
+            yield (key, *future.result())
+    finally:
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+# Function to compare reduced and full decoding of the same images
+def compare_decodes(image_sources, preprocess, max_pixels=DEFAULT_MAX_DECODE_PIXELS):
+    """
+    Decodes and preprocesses every image twice: at full resolution without any budget, and
+    with a reduced decode within `max_pixels`.
+
+    :param image_sources: Paths or file objects of the images.
+    :return: (full tensors, reduced tensors, summary) with the decode and preprocess seconds
+             and decoded megapixels of both modes and the largest tensor difference. Images
+             that fail to decode are left out.
+    """
+    preprocess_size = get_preprocess_size(preprocess)
+    min_short_side = REDUCE_MARGIN * preprocess_size if preprocess_size else None
+    tensors = {"full": [], "reduced": []}
+    summary = {f"{mode}_{measure}": 0.0 for mode in tensors for measure in ["decode_seconds", "preprocess_seconds", "megapixels"]}
+    for image_source in image_sources:
+        results = {}
+        try:
+            for mode, options in [("full", (None, None)), ("reduced", (min_short_side, max_pixels))]:
+                if hasattr(image_source, "seek"):
+                    image_source.seek(0)
+                with Image.open(image_source) as opened_image:  # The full decode must stay below the bomb limit
+                    start_time = time.perf_counter()
+                    image = decode_bounded(opened_image, *options)
+                    image.load()
+                    decoded_time = time.perf_counter()
+                    results[mode] = preprocess(image)
+                    summary[f"{mode}_preprocess_seconds"] += time.perf_counter() - decoded_time
+                    summary[f"{mode}_decode_seconds"] += decoded_time - start_time
+                    summary[f"{mode}_megapixels"] += image.size[0] * image.size[1] / 1e6
+        except Exception:
+            continue  # Not an image
+        for mode, image_tensor in results.items():
+            tensors[mode].append(image_tensor)
+    summary["images"] = len(tensors["full"])
+    summary["max_tensor_diff"] = max((float((full - reduced).abs().max()) for full, reduced in zip(tensors["full"], tensors["reduced"])), default=0.0)
+    return tensors["full"], tensors["reduced"], summary
+
+
+if __name__ == "__main__":
+    import argparse
+    import io
+    import itertools
+    import json
+
+    import clip
+    import torch
+
+    from cpu_profiles import DEFAULT_CHECK_IMAGES, DEFAULT_CHECK_PROMPTS, compare_scores, measure_scores
+    from dynamic_model_loader import load_model
+    from input_sources import iter_source
+
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Compare CLIP scores of images decoded at a reduced size against a full decode.")
+    parser.add_argument("--model", type=str, default="ViT-B/32", help="CLIP model to check.")
+    parser.add_argument("--target_dir", type=str, default="target_images", help="Images to check: a directory, manifest, tar/zip shard or glob of these.")
+    parser.add_argument("--images", type=int, default=DEFAULT_CHECK_IMAGES, help="Number of images to check.")
+    parser.add_argument("--max_decode_megapixels", type=float, default=DEFAULT_MAX_DECODE_PIXELS / 1e6, help="Pixel budget of each reduced decode, in megapixels.")
+    parser.add_argument("--prompt", type=str, action="append", default=None, help="Prompt to score against; repeat for several.")
+    parser.add_argument("--batch_size", type=int, default=32, help="Number of images encoded per forward pass.")
+    parser.add_argument("--output", type=str, default=None, help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    model, preprocess, device = load_model(args.model)
+    if device != "cpu":
+        model = model.float().cpu()
+
+    sources = (image_path if image_data is None else io.BytesIO(image_data) for _, image_path, image_data, _ in iter_source(args.target_dir))
+    full, reduced, summary = compare_decodes(itertools.islice(sources, args.images), preprocess, int(args.max_decode_megapixels * 1e6))
+    if not full:
+        print(f"No images found in '{args.target_dir}'.")
+        raise SystemExit(1)
+
+    text = clip.tokenize(args.prompt or DEFAULT_CHECK_PROMPTS)
+    full_scores = measure_scores(model, torch.stack(full), text, args.batch_size)[0]
+    reduced_scores = measure_scores(model, torch.stack(reduced), text, args.batch_size)[0]
+    summary.update(compare_scores(reduced_scores, full_scores))
+
+    print(f"{summary['images']} images, reduced decode vs full decode:")
+    for mode in ["full", "reduced"]:
+        print(f"  {mode:<8} decode {summary[f'{mode}_decode_seconds'] / summary['images'] * 1000:8.2f} ms/image, preprocess {summary[f'{mode}_preprocess_seconds'] / summary['images'] * 1000:8.2f} ms/image, {summary[f'{mode}_megapixels'] / summary['images']:8.2f} MP decoded/image")
+    print(f"  Tensor max diff {summary['max_tensor_diff']:.5f}, score max diff {summary['max_abs_diff']:.5f}, mean diff {summary['mean_abs_diff']:.5f}, Spearman {summary['spearman']:.4f}, top-1 agreement {summary['top1_agreement']:.3f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(dict(summary, model=args.model), f, indent=4)
+        print(f"Results saved to: {args.output}")
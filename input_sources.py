@@ -0,0 +1,242 @@
+import csv
+import glob
+import json
+import os
+import tarfile
+import zipfile
+import zlib
+from collections import Counter, namedtuple
+
+from metrics import logger
+
+# File extensions treated as images by the "extension" filter
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp", ".tif", ".tiff"}
+
+# (offset, bytes) signatures of the image formats accepted by the "magic" filter
+IMAGE_SIGNATURES = [
+    (0, b"\xff\xd8\xff"),  # JPEG
+    (0, b"\x89PNG\r\n\x1a\n"),  # PNG
+    (0, b"GIF87a"),
+    (0, b"GIF89a"),
+    (0, b"BM"),  # BMP
+    (0, b"II*\x00"),  # TIFF, little endian
+    (0, b"MM\x00*"),  # TIFF, big endian
+    (8, b"WEBP")
+]
+
+# Number of leading bytes read to check a file signature
+SIGNATURE_BYTES = 16
+
+# How files are recognized as images: by extension, by their leading bytes, or not at all
+IMAGE_FILTERS = ["extension", "magic", "none"]
+
+# Suffixes of the manifest and archive files accepted as input sources
+MANIFEST_EXTENSIONS = (".csv", ".jsonl")
+ARCHIVE_EXTENSIONS = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz", ".zip")
+
+# Manifest columns that may hold the image path, in order of preference
+MANIFEST_PATH_KEYS = ["path", "image_path", "image"]
+
+# An image found by an input source. Files on disk have a `path`; archive members have no
+# path and carry their bytes in `data`. `prompt` is an optional per-image prompt from a manifest.
+SourceImage = namedtuple("SourceImage", ["name", "path", "data", "prompt"], defaults=[None, None])
+
+# Ways of splitting an input source into shards: by a hash of the image name, or round-robin by position
+SHARD_METHODS = ["hash", "index"]
+
+# One of `count` disjoint parts of an input source, selected with one of SHARD_METHODS
+Shard = namedtuple("Shard", ["index", "count", "by"], defaults=["hash"])
+
+
+# Function to check the leading bytes of a file against known image signatures
+def has_image_signature(header):
+    return any(header[offset:offset + len(signature)] == signature for offset, signature in IMAGE_SIGNATURES)
+
+
+# Function to check whether a file name has an image extension
+def is_image_name(name):
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+# Function to decide whether a file on disk should be scored
+def is_image_file(path, image_filter="extension"):
+    """
+    Applies one of IMAGE_FILTERS to a file. The "magic" filter reads only the first
+    SIGNATURE_BYTES bytes, so images are recognized whatever their extension.
+    """
+    if image_filter == "extension":
+        return is_image_name(path)
+    if image_filter == "magic":
+        try:
+            with open(path, "rb") as f:
+                return has_image_signature(f.read(SIGNATURE_BYTES))
+        except OSError:
+            return False
+    return True
+
+
+# Function to walk a directory lazily with os.scandir
+def walk_directory(root, recursive=False, image_filter="extension"):
+    """
+    Yields a SourceImage for every image file in `root`, and in its subdirectories when
+    `recursive` is set. Only one directory is open at a time and nothing is listed ahead,
+    so scoring starts as soon as the first image is found. Names are paths relative to
+    `root` with "/" separators. Symbolic links to directories are not followed.
+    """
+    pending = [""]
+    while pending:
+        relative_dir = pending.pop()
+        with os.scandir(os.path.join(root, relative_dir)) as entries:
+            for entry in entries:
+                name = f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+                if entry.is_dir(follow_symlinks=False) and recursive:
+                    pending.append(name)
+                elif not entry.is_file():
+                    logger.debug(f"Skipping non-file: {name}")
+                elif not is_image_file(entry.path, image_filter):
+                    logger.debug(f"Skipping non-image: {name}")
+                else:
+                    yield SourceImage(name, entry.path)
+
+
+# Function to read the images listed in a CSV or JSON Lines manifest
+def read_manifest(manifest_path):
+    """
+    Yields a SourceImage per manifest entry, reading the file line by line.
+
+    Each entry needs an image path in one of MANIFEST_PATH_KEYS; relative paths are relative
+    to the manifest. An optional `prompt` scores the image against its own prompt and an
+    optional `name` replaces the path in the results. Names must be unique, so give each
+    entry a `name` to score the same file with several prompts.
+    """
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, "r", newline="", encoding="utf-8") as f:
+        if manifest_path.lower().endswith(".csv"):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for line_number, row in enumerate(rows, start=1):
+            path_key = next((key for key in MANIFEST_PATH_KEYS if row.get(key)), None)
+            if path_key is None:
+                raise ValueError(f"Entry {line_number} of manifest '{manifest_path}' has no image path (one of {MANIFEST_PATH_KEYS}).")
+            path = row[path_key]
+            yield SourceImage(row.get("name") or path, os.path.join(base_dir, path), prompt=row.get("prompt") or None)
+
+
+# Function to read images from a tar or zip shard without extracting it
+def read_archive(archive_path, image_filter="extension"):
+    """
+    Yields a SourceImage holding the bytes of each image member of a tar (optionally
+    compressed) or zip archive. Tar files are read as a stream, one member at a time.
+    Names are `<archive file name>/<member name>`.
+    """
+    archive_name = os.path.basename(archive_path)
+
+    def accept(member_name, data=None):
+        if image_filter == "extension":
+            return is_image_name(member_name)
+        if image_filter == "magic":
+            return data is None or has_image_signature(data[:SIGNATURE_BYTES])
+        return True
+
+    if archive_path.lower().endswith(".zip"):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not accept(info.filename):
+                    continue
+                data = archive.read(info)
+                if accept(info.filename, data):
+                    yield SourceImage(f"{archive_name}/{info.filename}", None, data)
+                else:
+                    logger.debug(f"Skipping non-image: {archive_name}/{info.filename}")
+        return
+
+    with tarfile.open(archive_path, "r|*") as archive:
+        for member in archive:
+            if not member.isfile() or not accept(member.name):
+                continue
+            data = archive.extractfile(member).read()
+            if accept(member.name, data):
+                yield SourceImage(f"{archive_name}/{member.name}", None, data)
+            else:
+                logger.debug(f"Skipping non-image: {archive_name}/{member.name}")
+
+
+# Function to find the shard an image belongs to
+def shard_of(image_name, position, num_shards, shard_by="hash"):
+    """
+    Returns the shard, in [0, num_shards), of the image at `position` in source order.
+    "hash" uses the CRC32 of the name, so the split does not depend on the listing order and
+    is the same in every process and on every host; "index" deals images round-robin, which
+    balances shards exactly but needs every host to list the source in the same order.
+    """
+    if shard_by == "hash":
+        return zlib.crc32(image_name.encode("utf-8")) % num_shards
+    if shard_by == "index":
+        return position % num_shards
+    raise ValueError(f"Unknown shard method '{shard_by}'. Choose from: {SHARD_METHODS}")
+
+
+# Function to check whether a source is a glob pattern of several sources
+def is_pattern(source):
+    return any(char in source for char in "*?[")
+
+
+# Function to check whether a source is a manifest file
+def is_manifest(source):
+    return source.lower().endswith(MANIFEST_EXTENSIONS) and (is_pattern(source) or os.path.isfile(source))
+
+
+# Function to check whether an input source exists
+def source_exists(source):
+    if is_pattern(source):
+        return next(glob.iglob(source), None) is not None
+    return os.path.exists(source)
+
+
+# Function to read images from any supported input source
+def iter_source(source, recursive=False, image_filter="extension", shard=None):
+    """
+    Yields SourceImage lazily from a directory, a manifest (.csv/.jsonl), a tar/zip shard,
+    or a glob pattern matching any of these (e.g. `shards/*.tar`).
+
+    When a pattern matches several sources, the names of images from directories and
+    manifests start with the file name of their source (`<source name>/<name>`), as archive
+    members always do, so equal names in different sources stay apart. Sources with the same
+    file name in different folders raise ValueError.
+
+    :param recursive: Also walk subdirectories of directory sources.
+    :param image_filter: One of IMAGE_FILTERS, applied to directory and archive sources.
+                         Manifest entries are always used.
+    :param shard: Optional Shard; only the images of that shard are yielded (see shard_of).
+    """
+    if image_filter not in IMAGE_FILTERS:
+        raise ValueError(f"Unknown image filter '{image_filter}'. Choose from: {IMAGE_FILTERS}")
+    if shard is not None and not 0 <= shard.index < shard.count:
+        raise ValueError(f"Shard index {shard.index} is out of range for {shard.count} shards.")
+
+    def read_sources():
+        sources = sorted(glob.glob(source)) if is_pattern(source) else [source]
+        source_names = [os.path.basename(os.path.normpath(path)) for path in sources]
+        duplicates = sorted(name for name, count in Counter(source_names).items() if count > 1)
+        if duplicates:
+            raise ValueError(f"Sources matched by '{source}' share the names {duplicates}, so their images could not be told apart.")
+        for path, source_name in zip(sources, source_names):
+            prefix = f"{source_name}/" if len(sources) > 1 else ""
+            if os.path.isdir(path):
+                for image in walk_directory(path, recursive=recursive, image_filter=image_filter):
+                    yield image._replace(name=prefix + image.name)
+            elif path.lower().endswith(MANIFEST_EXTENSIONS):
+                for image in read_manifest(path):
+                    yield image._replace(name=prefix + image.name)
+            elif path.lower().endswith(ARCHIVE_EXTENSIONS):
+                yield from read_archive(path, image_filter=image_filter)
+            else:
+                raise ValueError(f"Unsupported input source '{path}': expected a directory, a {'/'.join(MANIFEST_EXTENSIONS)} manifest or a {'/'.join(ARCHIVE_EXTENSIONS)} archive.")
+
+    if shard is None:
+        yield from read_sources()
+        return
+    for position, image in enumerate(read_sources()):
+        if shard_of(image.name, position, shard.count, shard.by) == shard.index:
+            yield image
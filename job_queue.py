@@ -0,0 +1,566 @@
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from calculate_clip_score import calculate_clip_score_matrix_and_save, calculate_clip_scores_and_save, create_output_dir, get_next_batch_folder
+from chart_selection import DEFAULT_COLOR, parse_figsize, parse_grid, validate_chart_type, validate_color
+from cpu_profiles import CPU_PROFILE_OPTIONS, get_profiled_model_name, parse_cpu_profile
+from dynamic_model_loader import select_model_based_on_vram
+from embedding_cache import DEFAULT_MAX_ENTRIES, EmbeddingCache
+from input_sources import source_exists
+from metrics import LOG_LEVELS, Metrics, configure_logging, logger
+from model_pool import ModelPool
+
+# Job store used when none is given
+DEFAULT_DB_PATH = "jobs.db"
+
+# States of a job. Queued jobs wait for the scheduler; running jobs are scored on its worker thread.
+JOB_STATES = ["queued", "running", "succeeded", "failed", "cancelled"]
+FINISHED_STATES = ["succeeded", "failed", "cancelled"]
+
+# Seconds between checks of the store for new jobs, cancel requests and progress updates
+DEFAULT_POLL_INTERVAL = 1.0
+
+# Jobs of the loaded model run back-to-back, but at most this many in a row while jobs of other models wait
+DEFAULT_MAX_CONSECUTIVE = 16
+
+# Options of calculate_clip_scores_and_save a job may set; `embedding_cache` is a cache directory
+SCORE_OPTIONS = ["batch_size", "decode_workers", "use_processes", "scored_image_mode", "flush_every", "columnar", "recursive", "image_filter", "dedup", "dedup_threshold", "score_duplicates", "max_decode_pixels", "reduced_decode", "embedding_cache"]
+
+# Subset of SCORE_OPTIONS understood by calculate_clip_score_matrix_and_save (jobs with several prompts)
+MATRIX_OPTIONS = ["batch_size", "decode_workers", "use_processes", "recursive", "image_filter", "max_decode_pixels", "reduced_decode", "embedding_cache"]
+
+# Chart options of a job and their defaults (see visualization_options.visualize)
+CHART_OPTIONS = {
+    "summary_chart_type": 1,
+    "summary_chart_color": DEFAULT_COLOR,
+    "single_chart_type": 1,
+    "single_chart_color": DEFAULT_COLOR,
+    "figsize": (12, 6),
+    "xlabel": "Images",
+    "ylabel": "CLIP Scores",
+    "contact_sheet": None,
+    "chart_workers": 0
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    model TEXT NOT NULL,
+    spec TEXT NOT NULL,
+    submitted_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    batch_folder TEXT,
+    images_scored INTEGER NOT NULL DEFAULT 0,
+    images_failed INTEGER NOT NULL DEFAULT 0,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, submitted_at);
+"""
+
+
+# Function to build the specification of a scoring job
+def make_job_spec(target_dir, prompts, model=None, output_dir="Batches", batch_output=None, charts=None, **score_options):
+    """
+    Checks the options of a job and returns its JSON-serializable specification.
+
+    :param prompts: A prompt or a list of prompts. Several prompts score the image x prompt
+                    matrix (calculate_clip_score_matrix_and_save), which has no charts.
+    :param model: CLIP model; selected based on VRAM when not given, so the job can be grouped with others of that model.
+    :param charts: Dictionary of CHART_OPTIONS to override, or False to skip visualization.
+    :param score_options: Any of SCORE_OPTIONS.
+    """
+    prompts = [prompts] if isinstance(prompts, str) else list(prompts or [])
+    if not prompts or not all(isinstance(prompt, str) and prompt for prompt in prompts):
+        raise ValueError("A job needs at least one non-empty prompt.")
+    if not source_exists(target_dir):
+        raise FileNotFoundError(f"Target directory '{target_dir}' does not exist.")
+    unknown_options = sorted(set(score_options) - set(SCORE_OPTIONS))
+    if unknown_options:
+        raise ValueError(f"Unknown scoring options {unknown_options}. Choose from: {SCORE_OPTIONS}")
+    if len(prompts) > 1:
+        unsupported_options = sorted(set(score_options) - set(MATRIX_OPTIONS))
+        if unsupported_options:
+            raise ValueError(f"Options {unsupported_options} are not supported with several prompts.")
+
+    if charts is not False:
+        charts = dict(charts or {})
+        unknown_options = sorted(set(charts) - set(CHART_OPTIONS))
+        if unknown_options:
+            raise ValueError(f"Unknown chart options {unknown_options}. Choose from: {sorted(CHART_OPTIONS)}")
+        charts = dict(CHART_OPTIONS, **charts)
+        for option in ["summary_chart_type", "single_chart_type"]:
+            charts[option] = validate_chart_type(charts[option])
+        for option in ["summary_chart_color", "single_chart_color"]:
+            charts[option] = validate_color(charts[option])
+        charts["figsize"] = list(parse_figsize(charts["figsize"]))
+        if charts["contact_sheet"] is not None:
+            charts["contact_sheet"] = list(parse_grid(charts["contact_sheet"]))
+
+    return {
+        "target_dir": target_dir,
+        "prompts": prompts,
+        "model": model or select_model_based_on_vram(),
+        "output_dir": output_dir,
+        "batch_output": batch_output,
+        "charts": charts,
+        "options": score_options
+    }
+
+
+class JobStore:
+    """
+    Persists scoring jobs in a SQLite database, so they survive restarts and can be submitted,
+    queried and cancelled from other processes. Methods may be called from any thread.
+    Only the scheduler holding `lock_scheduler()` may requeue running jobs.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.scheduler_lock = None
+        self.connection = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.unlock_scheduler()
+        with self.lock:
+            self.connection.close()
+
+    def lock_scheduler(self):
+        """
+        Takes an exclusive lock on `<db_path>.lock`, held until `unlock_scheduler()` or until the
+        process exits, so a single scheduler runs the jobs of the store. Raises RuntimeError if
+        another scheduler holds it.
+        """
+        lock_file = open(f"{self.db_path}.lock", "a+")
+        try:
+            try:
+                import fcntl  # Not available on Windows
+
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except ImportError:
+                import msvcrt
+
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            lock_file.close()
+            raise RuntimeError(f"Another scheduler is already running the jobs of {self.db_path}.")
+        self.scheduler_lock = lock_file
+
+    def unlock_scheduler(self):
+        if self.scheduler_lock is not None:
+            self.scheduler_lock.close()  # Closing the file releases the lock
+            self.scheduler_lock = None
+
+    def execute(self, query, parameters=()):
+        with self.lock:
+            return self.connection.execute(query, parameters).fetchall()
+
+    def add(self, spec):
+        """
+        Stores a new queued job for `spec` (see make_job_spec) and returns its ID.
+        """
+        job_id = uuid.uuid4().hex
+        self.execute("INSERT INTO jobs (job_id, state, model, spec, submitted_at) VALUES (?, 'queued', ?, ?, ?)", (job_id, spec["model"], json.dumps(spec), time.time()))
+        return job_id
+
+    def get(self, job_id):
+        """
+        Returns the job as a dictionary, with its decoded `spec`, or None if it does not exist.
+        """
+        rows = self.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,))
+        return self.to_job(rows[0]) if rows else None
+
+    def list(self, states=None):
+        """
+        Returns the jobs in any of `states` (all jobs if not given), oldest first.
+        """
+        if states:
+            rows = self.execute(f"SELECT * FROM jobs WHERE state IN ({','.join('?' * len(states))}) ORDER BY submitted_at, rowid", tuple(states))
+        else:
+            rows = self.execute("SELECT * FROM jobs ORDER BY submitted_at, rowid")
+        return [self.to_job(row) for row in rows]
+
+    def update(self, job_id, **fields):
+        self.execute(f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in fields)} WHERE job_id = ?", (*fields.values(), job_id))
+
+    def next_job(self, model=None):
+        """
+        Claims the oldest queued job of `model`, or the oldest queued job if there is none
+        (or if `model` is not given), and returns it in the running state. Returns None if no
+        job is queued. A job cancelled or claimed elsewhere in the meantime is skipped.
+        """
+        while True:
+            rows = []
+            if model is not None:
+                rows = self.execute("SELECT job_id FROM jobs WHERE state = 'queued' AND model = ? ORDER BY submitted_at, rowid LIMIT 1", (model,))
+            if not rows:
+                rows = self.execute("SELECT job_id FROM jobs WHERE state = 'queued' ORDER BY submitted_at, rowid LIMIT 1")
+            if not rows:
+                return None
+            if self.claim(rows[0]["job_id"]):
+                return self.get(rows[0]["job_id"])
+
+    def claim(self, job_id):
+        """
+        Moves a queued job to the running state. Returns False if it is no longer queued.
+        """
+        with self.lock:
+            cursor = self.connection.execute("UPDATE jobs SET state = 'running', started_at = COALESCE(started_at, ?), error = NULL WHERE job_id = ? AND state = 'queued'", (time.time(), job_id))
+            return cursor.rowcount > 0
+
+    def request_cancel(self, job_id):
+        """
+        Cancels a queued job at once and flags a running one, which the scheduler stops after
+        its current batch. Returns False if the job does not exist or has already finished.
+        """
+        with self.lock:
+            cursor = self.connection.execute("UPDATE jobs SET state = 'cancelled', finished_at = ? WHERE job_id = ? AND state = 'queued'", (time.time(), job_id))
+            if cursor.rowcount:
+                return True
+            cursor = self.connection.execute("UPDATE jobs SET cancel_requested = 1 WHERE job_id = ? AND state = 'running'", (job_id,))
+            return cursor.rowcount > 0
+
+    def requeue_interrupted(self):
+        """
+        Puts jobs left running by a stopped scheduler back in the queue; they resume into
+        their batch folder. Returns the number of requeued jobs.
+
+        :raises RuntimeError: If this store does not hold the scheduler lock, as the running
+                              jobs may belong to a live scheduler.
+        """
+        if self.scheduler_lock is None:
+            raise RuntimeError("Requeueing interrupted jobs needs the scheduler lock.")
+        with self.lock:
+            return self.connection.execute("UPDATE jobs SET state = 'queued' WHERE state = 'running'").rowcount
+
+    @staticmethod
+    def to_job(row):
+        job = dict(row)
+        job["spec"] = json.loads(job["spec"])
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+
+class JobQueue:
+    """
+    Runs scoring jobs from a JobStore one at a time, with an asyncio API to submit, query and
+    cancel them while `run()` schedules them.
+
+    Each job is scored with calculate_clip_scores_and_save (or the score matrix for several
+    prompts) on a worker thread, then charted with visualize. Models come from a ModelPool,
+    and the next job is preferably one of the model used last, so queued jobs of the same
+    model run back-to-back without reloading it (at most `max_consecutive` in a row while
+    jobs of other models wait). Progress is read from the running job's metrics and written
+    to the store every `poll_interval` seconds, which is also how often jobs submitted or
+    cancelled by other processes are noticed. Jobs interrupted by a stop or a crash are
+    requeued when the queue starts again and resume where they stopped. Only one queue runs
+    the jobs of a store at a time (see JobStore.lock_scheduler).
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, memory_budget_bytes=None, cpu_profile="fp32", poll_interval=DEFAULT_POLL_INTERVAL, max_consecutive=DEFAULT_MAX_CONSECUTIVE, cache_max_entries=DEFAULT_MAX_ENTRIES):
+        self.store = JobStore(db_path)
+        self.model_pool = ModelPool(memory_budget_bytes, cpu_profile=cpu_profile)
+        self.poll_interval = poll_interval
+        self.max_consecutive = max_consecutive
+        self.cache_max_entries = cache_max_entries
+        self.executor = None
+        self.running = {}  # job_id -> (stop event, metrics, images scored before a restart) of the running job
+        self.last_model = None
+        self.consecutive = 0
+        self.stopping = False
+        self.wakeup = None
+
+    async def submit(self, target_dir, prompts, model=None, output_dir="Batches", batch_output=None, charts=None, **score_options):
+        """
+        Queues a scoring job (see make_job_spec for the options) and returns its job ID.
+        """
+        spec = await asyncio.to_thread(make_job_spec, target_dir, prompts, model, output_dir, batch_output, charts, **score_options)
+        job_id = self.store.add(spec)
+        logger.info(f"Queued job {job_id} ({spec['model']}, {spec['target_dir']})")
+        if self.wakeup is not None:
+            self.wakeup.set()
+        return job_id
+
+    async def status(self, job_id):
+        """
+        Returns the job as a dictionary with its state, batch folder and progress; the
+        progress of the running job is live. Raises KeyError for unknown jobs.
+        """
+        job = self.store.get(job_id)
+        if job is None:
+            raise KeyError(f"Unknown job '{job_id}'.")
+        if job_id in self.running:
+            job.update(self.progress(job_id))
+        return job
+
+    def progress(self, job_id):
+        """
+        Returns the live progress counters of a running job.
+        """
+        _, metrics, scored_before = self.running[job_id]
+        return {"images_scored": scored_before + metrics.counters["images_scored"], "images_failed": metrics.counters["images_failed"]}
+
+    async def list_jobs(self, states=None):
+        return self.store.list(states)
+
+    async def cancel(self, job_id):
+        """
+        Cancels a queued job, or stops a running one after its current batch; the images
+        scored so far are kept. Returns False if the job had already finished.
+        """
+        if self.store.get(job_id) is None:
+            raise KeyError(f"Unknown job '{job_id}'.")
+        cancelled = self.store.request_cancel(job_id)
+        if job_id in self.running:
+            self.running[job_id][0].set()
+        return cancelled
+
+    async def wait(self, job_id):
+        """
+        Waits until the job has finished and returns its final status.
+        """
+        while True:
+            job = await self.status(job_id)
+            if job["state"] in FINISHED_STATES:
+                return job
+            await asyncio.sleep(self.poll_interval)
+
+    def stop(self):
+        """
+        Makes `run()` return after stopping the running job at its current batch. The job is
+        left queued and resumes when the queue runs again.
+        """
+        self.stopping = True
+        for stop_event, _, _ in self.running.values():
+            stop_event.set()
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def close(self):
+        self.store.close()
+
+    async def run(self):
+        """
+        Schedules queued jobs until `stop()` is called or the task is cancelled. Raises
+        RuntimeError if another queue is already running the jobs of the store.
+        """
+        self.store.lock_scheduler()
+        self.wakeup = asyncio.Event()
+        self.stopping = False
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="clip_job")
+        try:
+            requeued = self.store.requeue_interrupted()
+            if requeued:
+                logger.info(f"Requeued {requeued} interrupted jobs.")
+            while not self.stopping:
+                preferred_model = self.last_model if self.consecutive < self.max_consecutive else None
+                job = self.store.next_job(preferred_model)
+                if job is None:
+                    self.wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                self.consecutive = self.consecutive + 1 if preferred_model is not None and job["model"] == preferred_model else 1
+                self.last_model = job["model"]
+                await self.execute(job)
+        finally:
+            self.executor.shutdown(wait=True)
+            self.store.unlock_scheduler()
+
+    async def execute(self, job):
+        job_id = job["job_id"]
+        stop_event = threading.Event()
+        metrics = Metrics()
+        # A requeued job resumes, so the images it scored before count towards its progress (score matrices start over)
+        resumes = job["batch_folder"] is not None and len(job["spec"]["prompts"]) == 1
+        self.running[job_id] = (stop_event, metrics, job["images_scored"] if resumes else 0)
+        logger.info(f"Running job {job_id} with {job['model']}")
+
+        future = asyncio.get_running_loop().run_in_executor(self.executor, self.run_job, job, stop_event, metrics)
+        try:
+            while not future.done():
+                await asyncio.wait([future], timeout=self.poll_interval)
+                self.store.update(job_id, **self.progress(job_id))
+                current = self.store.get(job_id)
+                if current is not None and current["cancel_requested"]:
+                    stop_event.set()
+            future.result()
+        except asyncio.CancelledError:
+            # Stop the job at its current batch and leave it queued, so it resumes on the next run
+            stop_event.set()
+            await asyncio.wait([future])
+            self.store.update(job_id, state="queued")
+            raise
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            self.store.update(job_id, state="failed", finished_at=time.time(), error=str(e))
+            return
+        finally:
+            progress = self.progress(job_id)
+            del self.running[job_id]
+            self.store.update(job_id, **progress)
+
+        if not stop_event.is_set():
+            self.store.update(job_id, state="succeeded", finished_at=time.time())
+            logger.info(f"Job {job_id} succeeded: {progress['images_scored']} images scored")
+        elif self.store.get(job_id)["cancel_requested"]:
+            self.store.update(job_id, state="cancelled", finished_at=time.time())
+            logger.info(f"Job {job_id} cancelled after {progress['images_scored']} images")
+        else:
+            self.store.update(job_id, state="queued")
+            logger.info(f"Job {job_id} interrupted; it resumes when the queue runs again")
+
+    # Function run on the worker thread to score and chart one job
+    def run_job(self, job, stop_event, metrics):
+        spec = job["spec"]
+        model, preprocess, device = self.model_pool.get(spec["model"])
+        model_name = get_profiled_model_name(spec["model"], self.model_pool.cpu_profile, device)
+        options = dict(spec["options"])
+        embedding_cache = None
+        cache_dir = options.pop("embedding_cache", None)
+        if cache_dir:
+            embedding_cache = EmbeddingCache(cache_dir, model_name, model.visual.input_resolution, max_entries=self.cache_max_entries)
+
+        # A requeued job continues in the batch folder it started
+        batch_folder = job["batch_folder"]
+        resume = batch_folder is not None
+        if batch_folder is None:
+            if spec["batch_output"]:
+                batch_folder = os.path.join(spec["output_dir"], spec["batch_output"])
+            else:
+                batch_folder = get_next_batch_folder(spec["output_dir"])
+            create_output_dir(batch_folder)
+            self.store.update(job["job_id"], batch_folder=batch_folder)
+
+        if len(spec["prompts"]) > 1:
+            prompts = [{"prompt_file": "", "prompt": prompt} for prompt in spec["prompts"]]
+            calculate_clip_score_matrix_and_save(spec["target_dir"], prompts, batch_folder, model, preprocess, device, model_name=model_name, embedding_cache=embedding_cache, metrics=metrics, stop_event=stop_event, **options)
+            return
+        scores, charts_dir, images_chart_dir = calculate_clip_scores_and_save(spec["target_dir"], spec["prompts"][0], batch_folder, model, preprocess, device, model_name=model_name, embedding_cache=embedding_cache, resume=resume, metrics=metrics, stop_event=stop_event, **options)
+        if stop_event.is_set() or not spec["charts"] or not scores:
+            return
+        from visualization_options import visualize  # Plotting libraries are only imported when charts are drawn
+
+        charts = spec["charts"]
+        with metrics.timer("charts"):
+            visualize(
+                scores,
+                charts["summary_chart_type"],
+                charts["summary_chart_color"],
+                {"figsize": tuple(charts["figsize"]), "xlabel": charts["xlabel"], "ylabel": charts["ylabel"]},
+                charts_dir,
+                images_chart_dir,
+                single_chart_type=charts["single_chart_type"],
+                single_chart_color=charts["single_chart_color"],
+                contact_sheet=tuple(charts["contact_sheet"]) if charts["contact_sheet"] else None,
+                chart_workers=charts["chart_workers"]
+            )
+        metrics.save(os.path.join(batch_folder, "results"))
+
+
+# Function to format jobs as a table
+def format_jobs(jobs):
+    lines = [f"{'Job':<34}{'State':<11}{'Model':<16}{'Scored':>8}{'Failed':>8}  Batch folder"]
+    for job in jobs:
+        lines.append(f"{job['job_id']:<34}{job['state']:<11}{job['model']:<16}{job['images_scored']:>8}{job['images_failed']:>8}  {job['batch_folder'] or ''}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Queue CLIP scoring jobs in a local job store and run them.")
+    parser.add_argument("--db", type=str, default=DEFAULT_DB_PATH, help="SQLite job store.")
+    parser.add_argument("--log_level", type=str, default="info", choices=LOG_LEVELS, help="Messages to show.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="Run queued jobs until interrupted.")
+    serve.add_argument("--memory_budget_mb", type=float, default=None, help="Memory budget for models kept loaded between jobs. Defaults to half of the RAM or VRAM.")
+    serve.add_argument("--cpu_profile", type=str, default="fp32", help=f"CPU execution profile: comma-separated options from {CPU_PROFILE_OPTIONS}.")
+    serve.add_argument("--poll_interval", type=float, default=DEFAULT_POLL_INTERVAL, help="Seconds between checks for new jobs, cancellations and progress.")
+    serve.add_argument("--max_consecutive", type=int, default=DEFAULT_MAX_CONSECUTIVE, help="Maximum jobs of the same model run in a row while jobs of other models wait.")
+
+    submit = commands.add_parser("submit", help="Queue a scoring job and print its ID.")
+    submit.add_argument("--target_dir", type=str, required=True, help="Images to score: a directory, manifest, tar/zip shard or glob of these.")
+    submit.add_argument("--prompt", type=str, action="append", required=True, help="Prompt text to score against. Repeat to score several prompts as a matrix.")
+    submit.add_argument("--model", type=str, default=None, help="CLIP model to use. If not specified, it will be selected based on VRAM.")
+    submit.add_argument("--output_dir", type=str, default="Batches", help="Directory in which the batch folder is created.")
+    submit.add_argument("--batch_output", type=str, default=None, help="Name of the batch output folder. Defaults to the next free Batch_X.")
+    submit.add_argument("--options", type=json.loads, default={}, help=f"JSON object of scoring options: {SCORE_OPTIONS} (e.g., '{{\"batch_size\": 16}}').")
+    submit.add_argument("--charts", type=json.loads, default={}, help=f"JSON object of chart options: {sorted(CHART_OPTIONS)}.")
+    submit.add_argument("--skip_visualization", action="store_true", help="Do not render any charts.")
+
+    status = commands.add_parser("status", help="Show one job, or all jobs.")
+    status.add_argument("job_id", type=str, nargs="?", default=None)
+    status.add_argument("--state", type=str, nargs="+", default=None, choices=JOB_STATES, help="Only list jobs in these states.")
+
+    cancel = commands.add_parser("cancel", help="Cancel a queued or running job.")
+    cancel.add_argument("job_id", type=str)
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level)
+
+    if args.command == "serve":
+        try:
+            parse_cpu_profile(args.cpu_profile)
+        except ValueError as e:
+            parser.error(str(e))
+        budget_bytes = int(args.memory_budget_mb * 2**20) if args.memory_budget_mb else None
+        queue = JobQueue(args.db, budget_bytes, args.cpu_profile, args.poll_interval, args.max_consecutive)
+        logger.info(f"Running jobs from {args.db}; press Ctrl+C to stop.")
+        try:
+            asyncio.run(queue.run())
+        except KeyboardInterrupt:
+            logger.info("Stopped; interrupted jobs resume on the next run.")
+        except RuntimeError as e:
+            logger.error(e)
+            return 1
+        finally:
+            queue.close()
+        return 0
+
+    store = JobStore(args.db)
+    try:
+        if args.command == "submit":
+            try:
+                spec = make_job_spec(args.target_dir, args.prompt, args.model, args.output_dir, args.batch_output, False if args.skip_visualization else args.charts, **args.options)
+            except (ValueError, FileNotFoundError) as e:
+                logger.error(e)
+                return 1
+            print(store.add(spec))
+        elif args.command == "status":
+            if args.job_id:
+                job = store.get(args.job_id)
+                if job is None:
+                    logger.error(f"Unknown job '{args.job_id}'.")
+                    return 1
+                print(json.dumps(job, indent=4))
+            else:
+                print(format_jobs(store.list(args.state)))
+        elif args.command == "cancel":
+            if store.get(args.job_id) is None:
+                logger.error(f"Unknown job '{args.job_id}'.")
+                return 1
+            if not store.request_cancel(args.job_id):
+                logger.error(f"Job {args.job_id} has already finished.")
+                return 1
+            print(f"Cancelling job {args.job_id}")
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
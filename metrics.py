@@ -0,0 +1,254 @@
+import bisect
+import json
+import logging
+import os
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Names accepted by --log_level
+LOG_LEVELS = ["debug", "info", "warning", "error"]
+
+# Upper bounds (milliseconds) of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = [0.5 * 2 ** power for power in range(20)]
+
+# Profilers that can be enabled with --profile
+PROFILERS = ["cprofile", "torch"]
+
+# Number of entries listed in the text profile reports
+PROFILE_REPORT_LINES = 40
+
+# Logger used for progress messages; per-image messages are logged at debug level
+logger = logging.getLogger("clip_calculator")
+
+
+class StdoutHandler(logging.StreamHandler):
+    """
+    Writes to whatever sys.stdout is at the time of the message, so redirecting stdout
+    (e.g. with contextlib.redirect_stdout) also redirects log messages.
+    """
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+
+# Function to send log messages to stdout at the chosen level
+def configure_logging(level="info"):
+    """
+    Prints messages at `level` and above to stdout without any prefix, like the plain print
+    output they replace. Per-image messages are debug level, so the default "info" skips them.
+    """
+    handler = StdoutHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.handlers = [handler]
+    logger.setLevel(level.upper())
+    logger.propagate = False
+
+
+configure_logging()
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram of latencies in milliseconds. Memory does not grow with the
+    number of observations; percentiles are estimated from the bucket bounds.
+    """
+
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, fraction):
+        """
+        Returns the upper bound of the bucket holding the given fraction of observations
+        (capped at the largest value seen).
+        """
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= target and count:
+                return min(self.bounds[index], self.max) if index < len(self.bounds) else self.max
+        return self.max
+
+    def to_dict(self):
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": self.total / self.count,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "buckets": {label: count for label, count in zip(self.labels(), self.buckets) if count}
+        }
+
+    def labels(self):
+        return [f"<={bound:g}" for bound in self.bounds] + [f">{self.bounds[-1]:g}"]
+
+
+class Metrics:
+    """
+    Collects stage timers, counters and latency histograms for one batch run.
+
+    Stage times from worker pools (decode, preprocess) are summed over workers, so they can
+    exceed the wall-clock time of the run.
+    """
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.stage_seconds = defaultdict(float)
+        self.stage_calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.histograms = defaultdict(Histogram)
+
+    @contextmanager
+    def timer(self, stage):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start_time)
+
+    def add_time(self, stage, seconds, calls=1):
+        self.stage_seconds[stage] += seconds
+        self.stage_calls[stage] += calls
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def observe(self, name, milliseconds):
+        self.histograms[name].observe(milliseconds)
+
+    def to_dict(self):
+        wall_seconds = time.perf_counter() - self.start_time
+        return {
+            "wall_seconds": wall_seconds,
+            "stages": {stage: {"seconds": seconds, "calls": self.stage_calls[stage]} for stage, seconds in self.stage_seconds.items()},
+            "counters": dict(self.counters),
+            "latency_ms": {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+            "memory": get_memory_usage()
+        }
+
+    def save(self, results_dir):
+        """
+        Writes the metrics to `metrics.json` in `results_dir` and returns its path.
+        """
+        metrics_path = os.path.join(results_dir, "metrics.json")
+        with open(metrics_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=4)
+        return metrics_path
+
+    def summary(self):
+        """
+        Returns a one-line summary of where the time went.
+        """
+        stages = sorted(self.stage_seconds.items(), key=lambda item: -item[1])
+        return "Stage time: " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in stages)
+
+
+# Function to time how long a consumer waits on each item of an iterable
+def timed_iter(iterable, metrics, stage):
+    """
+    Yields the items of `iterable`, adding the time spent producing each one to `stage`.
+    """
+    iterator = iter(iterable)
+    while True:
+        start_time = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            metrics.add_time(stage, time.perf_counter() - start_time)
+        yield item
+
+
+# Function to measure the memory used by this process
+def get_memory_usage():
+    """
+    Returns the current and peak resident set size of this process in MB, plus the peak
+    torch CUDA allocation when a GPU is in use. Values that cannot be read are None.
+    """
+    memory = {"rss_mb": None, "peak_rss_mb": None, "torch_cuda_peak_mb": None}
+    try:
+        with open("/proc/self/statm") as f:
+            memory["rss_mb"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        pass  # Not Linux
+    try:
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        memory["peak_rss_mb"] = peak / 2**20 if sys.platform == "darwin" else peak / 2**10  # Bytes on macOS, KB elsewhere
+    except ImportError:
+        pass  # Not available on Windows
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available() and torch.cuda.is_initialized():
+        memory["torch_cuda_peak_mb"] = torch.cuda.max_memory_allocated() / 2**20
+    return memory
+
+
+# Function to profile a block of code with cProfile or torch.profiler
+@contextmanager
+def profile_run(profiler, results_dir):
+    """
+    Profiles the enclosed block and writes the report into `results_dir`:
+    `profile.pstats` and `profile.txt` for cProfile, `torch_trace.json` (Chrome trace) and
+    `torch_profile.txt` for torch.profiler. Does nothing when `profiler` is None.
+    """
+    if profiler is None:
+        yield
+        return
+    if profiler not in PROFILERS:
+        raise ValueError(f"Unknown profiler '{profiler}'. Choose from: {PROFILERS}")
+    os.makedirs(results_dir, exist_ok=True)
+
+    if profiler == "cprofile":
+        import cProfile
+        import io
+        import pstats
+
+        cprofiler = cProfile.Profile()
+        cprofiler.enable()
+        try:
+            yield
+        finally:
+            cprofiler.disable()
+            cprofiler.dump_stats(os.path.join(results_dir, "profile.pstats"))
+            report = io.StringIO()
+            pstats.Stats(cprofiler, stream=report).sort_stats("cumulative").print_stats(PROFILE_REPORT_LINES)
+            with open(os.path.join(results_dir, "profile.txt"), "w", encoding="utf-8") as f:
+                f.write(report.getvalue())
+            logger.info(f"Profile saved to: {os.path.join(results_dir, 'profile.pstats')}")
+        return
+
+    import torch.profiler
+
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    with torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=True) as torch_profiler:
+        yield
+    torch_profiler.export_chrome_trace(os.path.join(results_dir, "torch_trace.json"))
+    with open(os.path.join(results_dir, "torch_profile.txt"), "w", encoding="utf-8") as f:
+        f.write(torch_profiler.key_averages().table(sort_by="self_cpu_time_total", row_limit=PROFILE_REPORT_LINES))
+    logger.info(f"Torch profile saved to: {os.path.join(results_dir, 'torch_trace.json')}")
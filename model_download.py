@@ -1,117 +1,34 @@
-import os
-import requests
+import argparse
 
-# Define a list of models with their URLs and expected file sizes for verification
-MODELS = [
-    {
-        "name": "RN50",
-        "url": "https://openaipublic.blob.core.windows.net/clip/models/clip/RN50.pt",
-        "expected_size": 102884236  # File size in bytes
-    },
-    {
-        "name": "RN101",
-        "url": "https://openaipublic.blob.core.windows.net/clip/models/clip/RN101.pt",
-        "expected_size": 170257303  # File size in bytes
-    },
-    {
-        "name": "RN50x4",
-        "url": "https://openaipublic.blob.core.windows.net/clip/models/clip/RN50x4.pt",
-        "expected_size": 178604983  # File size in bytes
-    },
-    {
-        "name": "RN50x16",
-        "url": "https://openaipublic.blob.core.windows.net/clip/models/clip/RN50x16.pt",
-        "expected_size": 329455054  # File size in bytes
-    },
-    {
-        "name": "RN50x64",
-        "url": "https://openaipublic.blob.core.windows.net/clip/models/clip/RN50x64.pt",
-        "expected_size": 1105943367  # File size in bytes
-    },
-    {
-        "name": "ViT-B/32",
-        "url": "https://openaipublic.blob.core.windows.net/clip/models/clip/ViT-B-32.pt",
-        "expected_size": 170257303  # File size in bytes
-    },
-    {
-        "name": "ViT-B/16",
-        "url": "https://openaipublic.blob.core.windows.net/clip/models/clip/ViT-B-16.pt",
-        "expected_size": 344380155  # File size in bytes
-    },
-    {
-        "name": "ViT-L/14",
-        "url": "https://openaipublic.blob.core.windows.net/clip/models/clip/ViT-L-14.pt",
-        "expected_size": 428531238  # File size in bytes
-    },
-    {
-        "name": "ViT-L/14@336px",
-        "url": "https://openaipublic.blob.core.windows.net/clip/models/clip/ViT-L-14-336px.pt",
-        "expected_size": 546766937  # File size in bytes
-    }
-]
-
-# Define the directory where models will be downloaded
-MODELS_DIR = "models"
-
-
-def download_model(model):
-    """Download a model file and save it to the models directory."""
-    model_path = os.path.join(MODELS_DIR, f"{model['name']}.pt")
-
-    if os.path.exists(model_path):
-        print(f"{model['name']} already exists. Skipping download.")
-        return True
-
-    print(f"Downloading {model['name']}...")
-    try:
-        response = requests.get(model["url"], stream=True)
-        response.raise_for_status()
-
-        with open(model_path, "wb") as file:
-            for chunk in response.iter_content(chunk_size=8192):
-                file.write(chunk)
-
-        print(f"Download completed: {model['name']}")
-        return True
-    except Exception as e:
-        print(f"Failed to download {model['name']}: {e}")
-        return False
-
-
-def verify_model(model):
-    """Verify the downloaded model's size and integrity."""
-    model_path = os.path.join(MODELS_DIR, f"{model['name']}.pt")
-
-    if not os.path.exists(model_path):
-        print(f"{model['name']} is missing.")
-        return False
-
-    actual_size = os.path.getsize(model_path)
-    if actual_size != model["expected_size"]:
-        print(f"{model['name']} size mismatch. Expected {model['expected_size']}, got {actual_size}.")
-        return False
-
-    print(f"{model['name']} verified successfully.")
-    return True
+from download_manager import CLIP_MODEL_URLS, DEFAULT_DOWNLOAD_WORKERS, MODEL_DIR, download_models, get_model_path, verify_model
 
 
 def main():
     """Main function to download and verify all models."""
-    if not os.path.exists(MODELS_DIR):
-        os.makedirs(MODELS_DIR)
+    parser = argparse.ArgumentParser(description="Download CLIP models concurrently and verify their SHA256 checksums.")
+    parser.add_argument("--models", type=str, nargs="+", default=list(CLIP_MODEL_URLS), help="Models to download (default: all).")
+    parser.add_argument("--workers", type=int, default=DEFAULT_DOWNLOAD_WORKERS, help="Number of models downloaded at the same time.")
+    parser.add_argument("--model_dir", type=str, default=MODEL_DIR, help="Directory the models are saved to.")
+    parser.add_argument("--verify", action="store_true", help="Also re-check the SHA256 of models that were already downloaded.")
+    args = parser.parse_args()
 
     print("Starting model downloads...\n")
-    for model in MODELS:
-        success = download_model(model)
-        if success:
-            verified = verify_model(model)
-            if not verified:
-                print(f"Verification failed for {model['name']}. Please re-download.")
-        else:
-            print(f"Download failed for {model['name']}.")
+    results = download_models(args.models, workers=args.workers, model_dir=args.model_dir)
+
+    failed = [model_name for model_name, result in results.items() if isinstance(result, Exception)]
+    if args.verify:
+        for model_name in args.models:
+            if model_name in failed:
+                continue
+            if verify_model(model_name, args.model_dir):
+                print(f"{model_name} verified successfully.")
+            else:
+                print(f"Verification failed for {model_name}. Delete {get_model_path(model_name, args.model_dir)} and download it again.")
+                failed.append(model_name)
 
-    print("\nAll models processed.")
+    print(f"\nAll models processed. {len(args.models) - len(failed)} ok, {len(failed)} failed{': ' + ', '.join(failed) if failed else ''}.")
+    return 1 if failed else 0
 
 
 if __name__ == "__main__":
-    main()
+    raise SystemExit(main())
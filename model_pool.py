@@ -0,0 +1,129 @@
+import gc
+import os
+import threading
+from collections import OrderedDict
+
+import torch
+
+from cpu_profiles import apply_cpu_profile
+from dynamic_model_loader import load_model
+from metrics import logger
+
+# Share of the device memory the pool may fill when no budget is given
+DEFAULT_BUDGET_FRACTION = 0.5
+
+
+# Function to measure the memory taken by a model's weights
+def model_footprint(model):
+    """
+    Returns the number of bytes held by the parameters and buffers of `model`, including the
+    packed weights of quantized layers.
+    """
+    total = 0
+    for value in model.state_dict(keep_vars=True).values():
+        for tensor in value if isinstance(value, tuple) else (value,):
+            if isinstance(tensor, torch.Tensor):
+                total += tensor.numel() * tensor.element_size()
+    return total
+
+
+# Function to pick a memory budget for the device models are loaded on
+def default_memory_budget(device):
+    """
+    Returns DEFAULT_BUDGET_FRACTION of the total VRAM (CUDA) or physical RAM (CPU) in bytes,
+    or None if it cannot be determined.
+    """
+    if str(device).startswith("cuda") and torch.cuda.is_available():
+        _, total = torch.cuda.mem_get_info()
+        return int(total * DEFAULT_BUDGET_FRACTION)
+    try:
+        total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None  # Not available on this platform
+    return int(total * DEFAULT_BUDGET_FRACTION)
+
+
+class ModelPool:
+    """
+    Keeps several loaded CLIP models within a memory budget.
+
+    `get` returns a resident model or loads it with `load_model`. When the footprints of the
+    resident models exceed `budget_bytes`, the least recently used models are evicted, before
+    the load when the footprint of the requested model is known from an earlier load. The
+    model just requested is never evicted, so one model larger than the budget still loads.
+    `on_evict(model_name)` is called for every evicted model. Models are loaded with
+    `cpu_profile` applied (see cpu_profiles.py).
+    """
+
+    def __init__(self, budget_bytes=None, device=None, on_evict=None, cpu_profile="fp32"):
+        device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.budget_bytes = budget_bytes if budget_bytes is not None else default_memory_budget(device)
+        self.on_evict = on_evict
+        self.cpu_profile = cpu_profile
+        self.models = OrderedDict()  # model_name -> (model, preprocess, device), least recently used first
+        self.footprints = {}  # Known footprints, kept after eviction to make room before reloading
+        self.lock = threading.RLock()
+
+    def __contains__(self, model_name):
+        return model_name in self.models
+
+    def __len__(self):
+        return len(self.models)
+
+    def used_bytes(self):
+        return sum(self.footprints[model_name] for model_name in self.models)
+
+    def get(self, model_name):
+        """
+        Returns (model, preprocess, device) for `model_name`, loading it if needed.
+        """
+        with self.lock:
+            if model_name in self.models:
+                self.models.move_to_end(model_name)
+                return self.models[model_name]
+
+            # Make room up front when the size of this model is known from an earlier load
+            if model_name in self.footprints:
+                self.evict_until(self.footprints[model_name])
+
+            model, preprocess, device = load_model(model_name)
+            self.models[model_name] = (apply_cpu_profile(model, self.cpu_profile, device), preprocess, device)
+            self.footprints[model_name] = model_footprint(self.models[model_name][0])
+            self.evict_until(0)
+            return self.models[model_name]
+
+    def evict_until(self, needed_bytes):
+        """
+        Evicts least recently used models until `needed_bytes` more fit in the budget. Making
+        room for a model about to be loaded (`needed_bytes` > 0) may evict every resident model;
+        otherwise the most recently used model, the one just loaded, is kept.
+        """
+        if self.budget_bytes is None:
+            return
+        keep = 0 if needed_bytes > 0 else 1
+        while len(self.models) > keep and self.used_bytes() + needed_bytes > self.budget_bytes:
+            self.evict(next(iter(self.models)))
+
+    def evict(self, model_name):
+        """
+        Drops a resident model and releases its memory.
+        """
+        with self.lock:
+            if self.models.pop(model_name, None) is None:
+                return
+            logger.info(f"Evicting model: {model_name} ({self.footprints[model_name] / 2**20:.1f} MB)")
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        if self.on_evict:
+            self.on_evict(model_name)
+
+    def stats(self):
+        """
+        Returns the footprint of every resident model, in least to most recently used order.
+        """
+        return {
+            "budget_bytes": self.budget_bytes,
+            "used_bytes": self.used_bytes(),
+            "models": {model_name: {"device": str(device), "footprint_bytes": self.footprints[model_name]} for model_name, (_, _, device) in self.models.items()}
+        }
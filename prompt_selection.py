@@ -1,19 +1,27 @@
 import os
 
-def get_prompt_from_folder(prompt_dir):
+from metrics import logger
+
+def get_prompt_from_folder(prompt_dir, file_name=None, interactive=True):
     """
     Reads the first .txt file in the given folder and returns its content as a string.
-    If multiple files are found, prompts the user to select one.
+    If multiple files are found, prompts the user to select one unless `file_name` names
+    the file to use or `interactive` is False, in which case the first file is used.
     """
     if not os.path.exists(prompt_dir):
         raise FileNotFoundError(f"Prompt directory '{prompt_dir}' does not exist.")
 
-    txt_files = [f for f in os.listdir(prompt_dir) if f.endswith(".txt")]
+    if file_name is not None:
+        if not os.path.isfile(os.path.join(prompt_dir, file_name)):
+            raise FileNotFoundError(f"Prompt file '{file_name}' not found in '{prompt_dir}'.")
+        txt_files = [file_name]
+    else:
+        txt_files = sorted(f for f in os.listdir(prompt_dir) if f.endswith(".txt"))
     if not txt_files:
         raise FileNotFoundError(f"No .txt files found in the directory '{prompt_dir}'.")
 
-    # If only one file, use it
-    if len(txt_files) == 1:
+    # If only one file, or no one to ask, use the first
+    if len(txt_files) == 1 or not interactive:
         selected_file = txt_files[0]
     else:
         # Prompt user to select a file if multiple files are present
@@ -27,5 +35,33 @@ def get_prompt_from_folder(prompt_dir):
     prompt_file_path = os.path.join(prompt_dir, selected_file)
     with open(prompt_file_path, "r", encoding="utf-8") as file:
         prompt = file.read().strip()
-    print(f"Using prompts from file: {prompt_file_path}")
+    logger.info(f"Using prompts from file: {prompt_file_path}")
     return prompt
+
+
+def get_all_prompts_from_folder(prompt_dir):
+    """
+    Reads every .txt file in the given folder and returns each non-empty line as a prompt.
+    Files are read in sorted order so the prompt order is stable between runs.
+
+    :return: List of dictionaries with 'prompt_file' and 'prompt' keys.
+    """
+    if not os.path.exists(prompt_dir):
+        raise FileNotFoundError(f"Prompt directory '{prompt_dir}' does not exist.")
+
+    txt_files = sorted(f for f in os.listdir(prompt_dir) if f.endswith(".txt"))
+    if not txt_files:
+        raise FileNotFoundError(f"No .txt files found in the directory '{prompt_dir}'.")
+
+    prompts = []
+    for file_name in txt_files:
+        with open(os.path.join(prompt_dir, file_name), "r", encoding="utf-8") as file:
+            for line in file:
+                line = line.strip()
+                if line:
+                    prompts.append({"prompt_file": file_name, "prompt": line})
+
+    if not prompts:
+        raise FileNotFoundError(f"No prompts found in the .txt files of '{prompt_dir}'.")
+    logger.info(f"Loaded {len(prompts)} prompts from {len(txt_files)} files in: {prompt_dir}")
+    return prompts
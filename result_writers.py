@@ -0,0 +1,225 @@
+import csv
+import json
+import os
+import time
+
+import numpy as np
+
+# Columns of the per-image results; `content_hash` is the SHA256 of the image file, recorded when
+# it is computed anyway for the embedding cache and empty otherwise
+RESULT_FIELDS = ["image_index", "image_name", "clip_score", "scored_image_path", "content_hash"]
+
+# Columnar formats that can be written next to the CSV/JSON results
+COLUMNAR_FORMATS = ["npy", "parquet"]
+
+# Default number of rows and seconds between flushes of the streamed results
+DEFAULT_FLUSH_EVERY = 100
+DEFAULT_FLUSH_INTERVAL = 5.0
+
+# Number of rows per Parquet row group, so the table is never built in memory at once
+PARQUET_CHUNK_ROWS = 10000
+
+
+# Function to convert a row read back from CSV into its original types
+def parse_result_row(row):
+    """
+    Converts the string fields of a CSV result row back to int and float.
+    """
+    row = dict(row)
+    row["image_index"] = int(row["image_index"])
+    row["clip_score"] = float(row["clip_score"])
+    return row
+
+
+# Function to read results written by ResultWriter or by earlier versions one row at a time
+def iter_results(results_dir, name="results"):
+    """
+    Yields per-image results from a `results` folder, preferring the streamed `results.jsonl`,
+    then `results.csv`, then `results.json`. A truncated last line left by a crash is ignored.
+
+    :param name: File name of the results without extension, e.g. "matrix_results".
+    """
+    jsonl_path = os.path.join(results_dir, f"{name}.jsonl")
+    csv_path = os.path.join(results_dir, f"{name}.csv")
+    json_path = os.path.join(results_dir, f"{name}.json")
+
+    if os.path.exists(jsonl_path):
+        with open(jsonl_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    return  # Partially written line from an interrupted run
+                yield row
+    elif os.path.exists(csv_path):
+        with open(csv_path, "r", newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                try:
+                    row = parse_result_row(row)
+                except (KeyError, TypeError, ValueError):
+                    return  # Partially written line from an interrupted run
+                yield row
+    elif os.path.exists(json_path):
+        with open(json_path, "r", encoding="utf-8") as f:
+            yield from json.load(f)
+
+
+# Function to load results written by ResultWriter or by earlier versions
+def load_results(results_dir, name="results"):
+    """
+    Loads all per-image results from a `results` folder (see `iter_results`).
+
+    :return: List of result dictionaries, or an empty list if no results exist.
+    """
+    return list(iter_results(results_dir, name))
+
+
+class ResultWriter:
+    """
+    Streams per-image results to `results.csv` and `results.jsonl` as they are scored.
+
+    Files are flushed every `flush_every` rows or `flush_interval` seconds, so an interrupted run
+    keeps everything scored up to the last flush. Only the names of the scored images are kept in
+    memory; on close, `results.json` is written for compatibility and, optionally, a columnar copy
+    (`scores.npy`, `image_names.npy` and `content_hashes.npy`, or `results.parquet` when pyarrow
+    is installed), both from a second pass over `results.jsonl`. With `resume=True`, rows already
+    in the folder are rewritten without any truncated trailing line, and new rows are appended.
+    Columns outside `fieldnames`, such as the `prompt` of rows resumed from a manifest run,
+    are kept in the JSON outputs but left out of the CSV. `name` replaces "results" in the
+    file names, e.g. "matrix_results" for the score matrix.
+    """
+
+    def __init__(self, results_dir, resume=False, flush_every=DEFAULT_FLUSH_EVERY, flush_interval=DEFAULT_FLUSH_INTERVAL, columnar=None, fieldnames=RESULT_FIELDS, name="results"):
+        if columnar is not None and columnar not in COLUMNAR_FORMATS:
+            raise ValueError(f"Unknown columnar format '{columnar}'. Choose from: {COLUMNAR_FORMATS}")
+
+        os.makedirs(results_dir, exist_ok=True)
+        self.results_dir = results_dir
+        self.name = name
+        self.csv_path = os.path.join(results_dir, f"{name}.csv")
+        self.jsonl_path = os.path.join(results_dir, f"{name}.jsonl")
+        self.json_path = os.path.join(results_dir, f"{name}.json")
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.columnar = columnar
+        self.fieldnames = fieldnames
+        self.names = set()
+
+        # Rewrite the kept rows atomically, dropping anything a crash left half-written
+        self.csv_file = open(f"{self.csv_path}.tmp", "w", newline="", encoding="utf-8")
+        self.jsonl_file = open(f"{self.jsonl_path}.tmp", "w", encoding="utf-8")
+        self.csv_writer = csv.DictWriter(self.csv_file, fieldnames=fieldnames, extrasaction="ignore")
+        try:
+            self.csv_writer.writeheader()
+            for row in iter_results(results_dir, name) if resume else []:
+                self.write_row(row)
+        finally:
+            self.csv_file.close()
+            self.jsonl_file.close()
+        os.replace(f"{self.csv_path}.tmp", self.csv_path)
+        os.replace(f"{self.jsonl_path}.tmp", self.jsonl_path)
+
+        self.csv_file = open(self.csv_path, "a", newline="", encoding="utf-8")
+        self.jsonl_file = open(self.jsonl_path, "a", encoding="utf-8")
+        self.csv_writer = csv.DictWriter(self.csv_file, fieldnames=fieldnames, extrasaction="ignore")
+        self.unflushed = 0
+        self.last_flush = time.monotonic()
+        self.flush()
+
+    def write_row(self, row):
+        self.names.add(row["image_name"])
+        self.csv_writer.writerow(row)
+        self.jsonl_file.write(json.dumps(row) + "\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self.names)
+
+    def scored_names(self):
+        """
+        Returns the set of image names that already have a result.
+        """
+        return set(self.names)
+
+    def write(self, row):
+        """
+        Appends one result row to the CSV and JSON Lines files.
+        """
+        self.write_row(row)
+        self.unflushed += 1
+        if self.unflushed >= self.flush_every or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.csv_file.flush()
+        self.jsonl_file.flush()
+        self.unflushed = 0
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        """
+        Flushes and closes the streamed files, then writes `results.json` and the columnar output.
+        """
+        if self.csv_file.closed:
+            return
+        self.flush()
+        self.csv_file.close()
+        self.jsonl_file.close()
+
+        # Stream the rows back from the JSON Lines file into one JSON array, replaced atomically
+        temp_path = f"{self.json_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as jsonfile:
+            jsonfile.write("[")
+            for index, row in enumerate(iter_results(self.results_dir, self.name)):
+                jsonfile.write((", " if index else "") + json.dumps(row))
+            jsonfile.write("]")
+        os.replace(temp_path, self.json_path)
+
+        if self.columnar == "npy":
+            columns = {"clip_score": [], "image_name": [], "content_hash": []}
+            for row in iter_results(self.results_dir, self.name):
+                for field, values in columns.items():
+                    values.append(row.get(field, ""))
+            np.save(os.path.join(self.results_dir, "scores.npy"), np.array(columns["clip_score"], dtype=np.float32))
+            np.save(os.path.join(self.results_dir, "image_names.npy"), np.array(columns["image_name"], dtype=str))
+            np.save(os.path.join(self.results_dir, "content_hashes.npy"), np.array(columns["content_hash"], dtype=str))
+        elif self.columnar == "parquet":
+            write_parquet(iter_results(self.results_dir, self.name), os.path.join(self.results_dir, "results.parquet"), self.fieldnames)
+
+
+# Function to write result rows as a Parquet file
+def write_parquet(rows, parquet_path, fieldnames=RESULT_FIELDS):
+    """
+    Writes result rows as a Parquet table, `PARQUET_CHUNK_ROWS` rows at a time. Requires the
+    optional `pyarrow` package.
+
+    :param rows: Iterable of result dictionaries.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Writing Parquet results requires pyarrow. Install it with `pip install pyarrow` or use the npy format.")
+
+    def write_chunk(parquet_writer, chunk):
+        table = pa.table({field: [row.get(field, "") for row in chunk] for field in fieldnames})  # Rows from earlier versions lack some columns
+        if parquet_writer is None:
+            parquet_writer = pq.ParquetWriter(parquet_path, table.schema)
+        parquet_writer.write_table(table)
+        return parquet_writer
+
+    parquet_writer = None
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= PARQUET_CHUNK_ROWS:
+            parquet_writer = write_chunk(parquet_writer, chunk)
+            chunk = []
+    if chunk or parquet_writer is None:
+        parquet_writer = write_chunk(parquet_writer, chunk)
+    parquet_writer.close()
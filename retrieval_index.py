@@ -0,0 +1,415 @@
+import argparse
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+from embedding_cache import CACHE_DIR, EmbeddingCache, hash_bytes, hash_file
+from input_sources import IMAGE_FILTERS, iter_source
+from metrics import logger
+
+# Directory an index is written to by default
+INDEX_DIR = "index"
+
+# Number of results returned per query by default
+DEFAULT_TOP_K = 100
+
+# Rows of the embedding matrix scored at once by exact search
+SEARCH_BLOCK_ROWS = 65536
+
+# Largest float32 copy of the embeddings kept in memory between queries
+MAX_CACHED_BYTES = 2 << 30
+
+# Approximate (IVF-PQ) index defaults: sub-vectors per embedding, centroids per sub-vector,
+# lists probed per query, and candidates re-scored exactly per requested result
+DEFAULT_PQ_SUBSPACES = 16
+PQ_CENTROIDS = 256
+DEFAULT_NPROBE = 8
+DEFAULT_RERANK = 4
+
+# k-means settings used to train the approximate index
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 32768
+
+# Size of the distance matrices computed at once when assigning vectors to centroids
+ASSIGN_BLOCK_ELEMENTS = 1 << 24
+
+
+# Function to pick the rows with the highest scores
+def top_k_rows(scores, k):
+    """
+    Returns (top scores, column indices) of each row of `scores`, best first.
+    """
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.empty((scores.shape[0], 0), dtype=np.float32), np.empty((scores.shape[0], 0), dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind="stable")
+    return np.take_along_axis(candidate_scores, order, axis=1), np.take_along_axis(candidates, order, axis=1)
+
+
+# Function to find the nearest centroid of each vector
+def assign_clusters(vectors, centroids):
+    """
+    Returns the index of the closest centroid (squared L2 distance) for each row of `vectors`.
+    """
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    block_rows = max(1, ASSIGN_BLOCK_ELEMENTS // len(centroids))
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), block_rows):
+        block = np.asarray(vectors[start:start + block_rows], dtype=np.float32)
+        labels[start:start + len(block)] = np.argmin(centroid_norms - 2 * block @ centroids.T, axis=1)
+    return labels
+
+
+# Function to cluster vectors with k-means
+def kmeans(vectors, num_clusters, iterations=KMEANS_ITERATIONS, seed=0):
+    """
+    Returns `num_clusters` centroids of `vectors` (float32). Empty clusters are re-seeded
+    with random vectors.
+    """
+    rng = np.random.default_rng(seed)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    num_clusters = min(num_clusters, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), num_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        labels = assign_clusters(vectors, centroids)
+        counts = np.bincount(labels, minlength=num_clusters)
+        # Sum the members of each cluster in one pass over the vectors sorted by cluster
+        filled = np.flatnonzero(counts)
+        starts = (np.cumsum(counts) - counts)[filled]
+        centroids[filled] = np.add.reduceat(vectors[np.argsort(labels, kind="stable")], starts, axis=0) / counts[filled, None]
+        empty = counts == 0
+        centroids[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+    return centroids
+
+
+# Function to product-quantize vectors with trained codebooks
+def encode_pq(vectors, codebooks):
+    """
+    Returns the (rows, subspaces) uint8 codes of the nearest codebook entry of each sub-vector.
+    All subspaces are handled in one batched matrix multiply per block of rows.
+    """
+    subspaces, centroids, sub_dim = codebooks.shape
+    codebook_norms = (codebooks ** 2).sum(axis=2)[:, None, :]
+    codebooks_t = codebooks.transpose(0, 2, 1)
+    block_rows = max(1, ASSIGN_BLOCK_ELEMENTS // (subspaces * centroids))
+    codes = np.empty((len(vectors), subspaces), dtype=np.uint8)
+    for start in range(0, len(vectors), block_rows):
+        block = np.asarray(vectors[start:start + block_rows], dtype=np.float32).reshape(-1, subspaces, sub_dim).transpose(1, 0, 2)
+        codes[start:start + block.shape[1]] = np.argmin(codebook_norms - 2 * block @ codebooks_t, axis=2).T
+    return codes
+
+
+# Function to train an IVF-PQ approximate index
+def train_ivfpq(embeddings, nlist=None, subspaces=DEFAULT_PQ_SUBSPACES, seed=0):
+    """
+    Clusters the embeddings into `nlist` inverted lists and product-quantizes each residual
+    (embedding minus its list centroid) into `subspaces` one-byte codes.
+
+    :return: Dictionary of arrays: coarse centroids, PQ codebooks (subspaces, 256, dim / subspaces),
+             codes (rows, subspaces), and the rows of each list (`list_rows` split at `list_offsets`).
+    """
+    count, dim = embeddings.shape
+    if dim % subspaces:
+        raise ValueError(f"The embedding dimension {dim} is not divisible by {subspaces} PQ subspaces.")
+    nlist = nlist or max(1, int(math.sqrt(count)))
+    rng = np.random.default_rng(seed)
+    sample_rows = np.sort(rng.choice(count, min(count, KMEANS_SAMPLE), replace=False))
+    sample = np.asarray(embeddings[sample_rows], dtype=np.float32)
+
+    coarse_centroids = kmeans(sample, nlist, seed=seed)
+    labels = assign_clusters(embeddings, coarse_centroids)
+
+    sub_dim = dim // subspaces
+    sample_residuals = sample - coarse_centroids[assign_clusters(sample, coarse_centroids)]
+    codebooks = np.zeros((subspaces, PQ_CENTROIDS, sub_dim), dtype=np.float32)
+    for m in range(subspaces):
+        trained = kmeans(sample_residuals[:, m * sub_dim:(m + 1) * sub_dim], PQ_CENTROIDS, seed=seed + m)
+        codebooks[m, :len(trained)] = trained
+
+    codes = np.empty((count, subspaces), dtype=np.uint8)
+    for start in range(0, count, SEARCH_BLOCK_ROWS):
+        block = np.asarray(embeddings[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+        codes[start:start + len(block)] = encode_pq(block - coarse_centroids[labels[start:start + len(block)]], codebooks)
+
+    list_rows = np.argsort(labels, kind="stable").astype(np.int64)
+    list_offsets = np.searchsorted(labels[list_rows], np.arange(len(coarse_centroids) + 1)).astype(np.int64)
+    return {
+        "coarse_centroids": coarse_centroids,
+        "codebooks": codebooks,
+        "codes": codes,
+        "list_rows": list_rows,
+        "list_offsets": list_offsets
+    }
+
+
+# Function to find the embedding cache store of a model
+def find_cache_resolution(cache_dir, model_name):
+    """
+    Returns the preprocess resolution of the only cache store of `model_name`.
+    Raises ValueError when there is none or more than one.
+    """
+    prefix = f"{model_name.replace('/', '_')}_"
+    resolutions = [int(name[len(prefix):-2]) for name in os.listdir(cache_dir) if name.startswith(prefix) and name.endswith("px") and name[len(prefix):-2].isdigit()] if os.path.isdir(cache_dir) else []
+    if len(resolutions) != 1:
+        raise ValueError(f"Found {len(resolutions)} embedding cache stores for {model_name} in {cache_dir}; give the resolution explicitly.")
+    return resolutions[0]
+
+
+# Function to build an index from embeddings stored in the embedding cache
+def build_index(target_dir, model_name, index_dir=INDEX_DIR, cache_dir=CACHE_DIR, resolution=None, recursive=False, image_filter="extension", approximate=False, nlist=None, subspaces=DEFAULT_PQ_SUBSPACES):
+    """
+    Collects the cached embedding of every image in `target_dir` (any input source) and
+    writes an index to `index_dir`. Images are only hashed, never decoded or encoded; images
+    without a cached embedding are counted as missing. Score them with `--embedding_cache`
+    first.
+
+    Writes `embeddings.npy` (float16, one normalized row per image), `images.json` (name and
+    path of each row), `index.json` (model and counts) and, with `approximate`, the IVF-PQ
+    arrays in `ivfpq.npz`.
+
+    :param model_name: Key the embeddings are cached under, e.g. "ViT-B/32" or "ViT-B/32@bf16".
+    :return: The contents of `index.json`.
+    """
+    resolution = resolution or find_cache_resolution(cache_dir, model_name)
+    cache = EmbeddingCache(cache_dir, model_name, resolution)
+
+    images = []
+    rows = []
+    missing = 0
+    for image_name, image_path, image_data, _ in iter_source(target_dir, recursive=recursive, image_filter=image_filter):
+        try:
+            content_hash = hash_file(image_path) if image_data is None else hash_bytes(image_data)
+        except OSError as e:
+            logger.warning(f"Error processing {image_name}: {e}")
+            continue
+        embedding = cache.get(content_hash)
+        if embedding is None:
+            missing += 1
+            logger.debug(f"No cached embedding for {image_name}")
+            continue
+        images.append({"name": image_name, "path": image_path})
+        rows.append(embedding.astype(np.float16))
+    if not rows:
+        raise ValueError(f"None of the images in {target_dir} have a cached embedding for {model_name}.")
+
+    os.makedirs(index_dir, exist_ok=True)
+    embeddings = np.stack(rows)
+    np.save(os.path.join(index_dir, "embeddings.npy"), embeddings)
+    with open(os.path.join(index_dir, "images.json"), "w", encoding="utf-8") as f:
+        json.dump(images, f)
+
+    info = {
+        "model_name": model_name,
+        "resolution": resolution,
+        "dim": int(embeddings.shape[1]),
+        "images": len(images),
+        "missing": missing,
+        "approximate": None
+    }
+    if approximate:
+        start_time = time.perf_counter()
+        ivfpq = train_ivfpq(embeddings, nlist=nlist, subspaces=subspaces)
+        np.savez(os.path.join(index_dir, "ivfpq.npz"), **ivfpq)
+        info["approximate"] = {"nlist": len(ivfpq["coarse_centroids"]), "subspaces": subspaces, "train_seconds": time.perf_counter() - start_time}
+    with open(os.path.join(index_dir, "index.json"), "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=4)
+    return info
+
+
+class RetrievalIndex:
+    """
+    Top-K search over an index written by build_index.
+
+    Exact search scores every embedding with blocked matrix multiplies and keeps a running
+    top-K per query. Approximate search probes the `nprobe` IVF lists closest to each query,
+    ranks their members with PQ lookup tables and re-scores the best `rerank * top_k`
+    candidates exactly. Queries are normalized CLIP embeddings of shape (queries, dim).
+    """
+
+    def __init__(self, index_dir=INDEX_DIR):
+        with open(os.path.join(index_dir, "index.json"), "r", encoding="utf-8") as f:
+            self.info = json.load(f)
+        with open(os.path.join(index_dir, "images.json"), "r", encoding="utf-8") as f:
+            self.images = json.load(f)
+        self.embeddings = np.load(os.path.join(index_dir, "embeddings.npy"), mmap_mode="r")
+        self.row_of_name = {image["name"]: row for row, image in enumerate(self.images)}
+        self.blocks = {}  # Block start -> float32 copy, kept while it fits in MAX_CACHED_BYTES
+
+        self.ivfpq = None
+        ivfpq_path = os.path.join(index_dir, "ivfpq.npz")
+        if os.path.exists(ivfpq_path):
+            with np.load(ivfpq_path) as arrays:
+                self.ivfpq = {name: arrays[name] for name in arrays.files}
+
+    def __len__(self):
+        return len(self.images)
+
+    def get_block(self, start, block_rows=SEARCH_BLOCK_ROWS):
+        block = self.blocks.get(start)
+        if block is None:
+            block = np.asarray(self.embeddings[start:start + block_rows], dtype=np.float32)
+            if self.embeddings.shape[0] * self.embeddings.shape[1] * 4 <= MAX_CACHED_BYTES:
+                self.blocks[start] = block
+        return block
+
+    def image_embeddings(self, image_names):
+        """
+        Returns the stored embeddings of images in the index, to query with them.
+        """
+        return np.asarray(self.embeddings[[self.row_of_name[name] for name in image_names]], dtype=np.float32)
+
+    def search_exact(self, queries, top_k=DEFAULT_TOP_K):
+        queries = np.asarray(queries, dtype=np.float32)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(self), SEARCH_BLOCK_ROWS):
+            scores, rows = top_k_rows(queries @ self.get_block(start).T, top_k)
+            merged_scores = np.concatenate([best_scores, scores], axis=1)
+            merged_rows = np.concatenate([best_rows, rows + start], axis=1)
+            best_scores, order = top_k_rows(merged_scores, top_k)
+            best_rows = np.take_along_axis(merged_rows, order, axis=1)
+        return best_scores, best_rows
+
+    def search_approximate(self, queries, top_k=DEFAULT_TOP_K, nprobe=DEFAULT_NPROBE, rerank=DEFAULT_RERANK):
+        if self.ivfpq is None:
+            raise ValueError("This index has no approximate index; build it with --approximate.")
+        coarse_centroids = self.ivfpq["coarse_centroids"]
+        codebooks = self.ivfpq["codebooks"]
+        codes = self.ivfpq["codes"]
+        list_rows = self.ivfpq["list_rows"]
+        list_offsets = self.ivfpq["list_offsets"]
+        subspaces, _, sub_dim = codebooks.shape
+
+        results = []
+        for query in np.asarray(queries, dtype=np.float32):
+            # Inner products with the list centroids, plus a lookup table of each sub-vector
+            # against its codebook: score(x) ~ q.centroid + sum_m table[m, code_m(x)]
+            coarse_scores = coarse_centroids @ query
+            table = np.einsum("mkd,md->mk", codebooks, query.reshape(subspaces, sub_dim))
+            lists = np.argsort(-coarse_scores)[:nprobe]
+            rows = np.concatenate([list_rows[list_offsets[index]:list_offsets[index + 1]] for index in lists])
+            list_scores = np.concatenate([np.full(list_offsets[index + 1] - list_offsets[index], coarse_scores[index], dtype=np.float32) for index in lists])
+            approximate_scores = list_scores + table[np.arange(subspaces), codes[rows]].sum(axis=1)
+
+            _, candidates = top_k_rows(approximate_scores[None, :], rerank * top_k)
+            candidate_rows = np.sort(rows[candidates[0]])  # Sorted rows read the memory map in order
+            exact_scores = np.asarray(self.embeddings[candidate_rows], dtype=np.float32) @ query
+            scores, order = top_k_rows(exact_scores[None, :], top_k)
+            results.append((scores[0], candidate_rows[order[0]]))
+
+        width = max((len(scores) for scores, _ in results), default=0)
+        best_scores = np.full((len(results), width), -np.inf, dtype=np.float32)
+        best_rows = np.full((len(results), width), -1, dtype=np.int64)
+        for index, (scores, rows) in enumerate(results):
+            best_scores[index, :len(scores)] = scores
+            best_rows[index, :len(rows)] = rows
+        return best_scores, best_rows
+
+    def search(self, queries, top_k=DEFAULT_TOP_K, approximate=False, nprobe=DEFAULT_NPROBE, rerank=DEFAULT_RERANK):
+        """
+        Returns one ranked list per query of {"rank", "image_name", "path", "score"} dictionaries.
+        """
+        if approximate:
+            scores, rows = self.search_approximate(queries, top_k, nprobe=nprobe, rerank=rerank)
+        else:
+            scores, rows = self.search_exact(queries, top_k)
+        return [
+            [{"rank": rank, "image_name": self.images[row]["name"], "path": self.images[row]["path"], "score": float(score)} for rank, (score, row) in enumerate(zip(query_scores, query_rows), start=1) if row >= 0]
+            for query_scores, query_rows in zip(scores, rows)
+        ]
+
+
+# Function to encode text queries with the model an index was built with
+def encode_text_queries(model_name, prompts):
+    """
+    Loads the model named in the index (with its CPU profile, e.g. "ViT-B/32@bf16") and
+    returns the normalized text features of `prompts` as a float32 array.
+    """
+    from calculate_clip_score import encode_prompts
+    from cpu_profiles import apply_cpu_profile
+    from dynamic_model_loader import load_model
+
+    base_model_name, _, profile = model_name.partition("@")
+    model, _, device = load_model(base_model_name)
+    model = apply_cpu_profile(model, profile or "fp32", device)
+    return encode_prompts(model, prompts, device, model_name=model_name).float().cpu().numpy()
+
+
+# Function to compare approximate results with exact search
+def measure_recall(index, queries, top_k=DEFAULT_TOP_K, nprobe=DEFAULT_NPROBE, rerank=DEFAULT_RERANK):
+    """
+    Returns the share of the exact top-K found by approximate search, averaged over queries.
+    """
+    _, exact_rows = index.search_exact(queries, top_k)
+    _, approximate_rows = index.search_approximate(queries, top_k, nprobe=nprobe, rerank=rerank)
+    found = [len(set(exact.tolist()) & set(approximate.tolist())) / max(1, len(exact)) for exact, approximate in zip(exact_rows, approximate_rows)]
+    return float(np.mean(found))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and query a top-K retrieval index over cached CLIP image embeddings.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Build an index from the embedding cache.")
+    build_parser.add_argument("--target_dir", type=str, default="target_images", help="Images to index: a directory, manifest, tar/zip shard or glob of these.")
+    build_parser.add_argument("--model", type=str, required=True, help="Model the embeddings were cached with, including any CPU profile (e.g., ViT-B/32 or ViT-B/32@bf16).")
+    build_parser.add_argument("--cache_dir", type=str, default=CACHE_DIR, help="Directory containing the embedding cache.")
+    build_parser.add_argument("--resolution", type=int, default=None, help="Preprocess resolution of the cached embeddings. Found automatically when the cache has one store for the model.")
+    build_parser.add_argument("--index_dir", type=str, default=INDEX_DIR, help="Directory the index is written to.")
+    build_parser.add_argument("--recursive", action="store_true", help="Also index images in subdirectories.")
+    build_parser.add_argument("--image_filter", type=str, default="extension", choices=IMAGE_FILTERS, help="How files are recognized as images.")
+    build_parser.add_argument("--approximate", action="store_true", help="Also train an IVF-PQ index for approximate search.")
+    build_parser.add_argument("--nlist", type=int, default=None, help="Number of IVF lists (default: sqrt(images)).")
+    build_parser.add_argument("--subspaces", type=int, default=DEFAULT_PQ_SUBSPACES, help="Number of PQ sub-vectors per embedding.")
+
+    query_parser = subparsers.add_parser("query", help="Return the top-K images for prompts or for images in the index.")
+    query_parser.add_argument("--index_dir", type=str, default=INDEX_DIR, help="Directory containing the index.")
+    query_parser.add_argument("--prompt", type=str, action="append", default=[], help="Text query; repeat for several queries.")
+    query_parser.add_argument("--image", type=str, action="append", default=[], help="Name of an indexed image to find neighbours of; repeat for several queries.")
+    query_parser.add_argument("--top_k", type=int, default=DEFAULT_TOP_K, help="Number of results per query.")
+    query_parser.add_argument("--approximate", action="store_true", help="Use the IVF-PQ index instead of exact search.")
+    query_parser.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE, help="IVF lists searched per query.")
+    query_parser.add_argument("--rerank", type=int, default=DEFAULT_RERANK, help="Candidates re-scored exactly, as a multiple of --top_k.")
+    query_parser.add_argument("--recall", action="store_true", help="Also report the recall of approximate search against exact search.")
+    query_parser.add_argument("--output", type=str, default=None, help="Write the results to this JSON file.")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        info = build_index(args.target_dir, args.model, index_dir=args.index_dir, cache_dir=args.cache_dir, resolution=args.resolution, recursive=args.recursive, image_filter=args.image_filter, approximate=args.approximate, nlist=args.nlist, subspaces=args.subspaces)
+        print(f"Indexed {info['images']} images ({info['missing']} without a cached embedding) in {args.index_dir}.")
+        return 0
+
+    if not args.prompt and not args.image:
+        parser.error("Give at least one --prompt or --image to query.")
+    index = RetrievalIndex(args.index_dir)
+    queries = []
+    if args.prompt:
+        queries.append(encode_text_queries(index.info["model_name"], args.prompt))
+    if args.image:
+        queries.append(index.image_embeddings(args.image))
+    queries = np.concatenate(queries)
+
+    start_time = time.perf_counter()
+    results = index.search(queries, args.top_k, approximate=args.approximate, nprobe=args.nprobe, rerank=args.rerank)
+    search_ms = (time.perf_counter() - start_time) * 1000
+
+    for query, ranked in zip(args.prompt + args.image, results):
+        print(f"\nTop {len(ranked)} for: {query}")
+        for result in ranked:
+            print(f"{result['rank']:>5}  {result['score']:.4f}  {result['image_name']}")
+    print(f"\nSearched {len(index)} images for {len(queries)} queries in {search_ms:.1f} ms ({'approximate' if args.approximate else 'exact'}).")
+    if args.recall:
+        print(f"Approximate recall@{args.top_k}: {measure_recall(index, queries, args.top_k, nprobe=args.nprobe, rerank=args.rerank):.3f}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump([{"query": query, "results": ranked} for query, ranked in zip(args.prompt + args.image, results)], f, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,110 @@
+import io
+import os
+import shutil
+
+from PIL import Image
+
+# Ways of materializing files in `scored_images`
+SCORED_IMAGE_MODES = ["link", "reflink", "copy", "reencode", "none"]
+
+# Linux ioctl request for a copy-on-write clone of a whole file
+FICLONE = 0x40049409
+
+# Buffer size used for plain byte copies
+COPY_BUFFER_SIZE = 1 << 20
+
+
+# Function to clone a file with copy-on-write where the filesystem supports it
+def reflink_file(src_path, dst_path):
+    """
+    Creates `dst_path` as a copy-on-write clone of `src_path` (btrfs, XFS, ...).
+    Raises OSError if the platform or filesystem does not support it.
+    """
+    import fcntl  # Not available on Windows
+
+    with open(src_path, "rb") as src, open(dst_path, "xb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(dst_path)
+            raise
+
+
+# Function to copy the bytes of a file without decoding it
+def copy_file(src_path, dst_path):
+    """
+    Copies `src_path` to a new file `dst_path`, failing with FileExistsError if it already exists.
+    """
+    with open(src_path, "rb") as src, open(dst_path, "xb") as dst:
+        shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+
+
+# Function to write one scored image with the requested mode
+def write_scored_image(image_path, scored_image_path, mode, image_data=None):
+    """
+    Materializes `image_path` at `scored_image_path`. Link and reflink fall back to a plain
+    byte copy when the filesystem cannot provide them. Never overwrites an existing file.
+    Images held in memory (`image_data`, e.g. archive members) are written out as they are,
+    or re-encoded in `reencode` mode.
+    """
+    if image_data is not None:
+        if mode == "reencode":
+            with Image.open(io.BytesIO(image_data)) as image, open(scored_image_path, "xb") as f:
+                image.save(f, format="JPEG")
+        else:
+            with open(scored_image_path, "xb") as f:
+                f.write(image_data)
+        return
+
+    if mode == "link":
+        try:
+            os.link(image_path, scored_image_path)
+            return
+        except FileExistsError:
+            raise
+        except (OSError, AttributeError):
+            pass  # Cross-device or unsupported; fall back to a copy
+    elif mode == "reflink":
+        try:
+            reflink_file(image_path, scored_image_path)
+            return
+        except FileExistsError:
+            raise
+        except (OSError, ImportError):
+            pass  # Unsupported filesystem; fall back to a copy
+    elif mode == "reencode":
+        with Image.open(image_path) as image, open(scored_image_path, "xb") as f:
+            image.save(f, format="JPEG")
+        return
+
+    copy_file(image_path, scored_image_path)
+
+
+# Function to save an image under its score without overwriting earlier ones
+def save_scored_image(image_path, scored_images_dir, score, mode="link", image_data=None):
+    """
+    Saves an image into `scored_images_dir` under a name derived from its score.
+    If a file with the same name exists (scores equal at 4 decimals), a numeric suffix is
+    added, e.g. `0.3120.jpg`, `0.3120_1.jpg`. The original extension is kept except in
+    `reencode` mode, which writes a JPEG like earlier versions did.
+
+    :param mode: One of SCORED_IMAGE_MODES. "none" skips writing and returns None.
+    :param image_data: Bytes of an image that is not a file on disk; `image_path` then only
+                       provides the extension.
+    :return: The file name written inside `scored_images_dir`, or None.
+    """
+    if mode not in SCORED_IMAGE_MODES:
+        raise ValueError(f"Unknown scored image mode '{mode}'. Choose from: {SCORED_IMAGE_MODES}")
+    if mode == "none":
+        return None
+
+    extension = ".jpg" if mode == "reencode" else os.path.splitext(image_path)[1].lower() or ".jpg"
+    suffix = 0
+    while True:
+        scored_image_name = f"{score:.4f}{extension}" if suffix == 0 else f"{score:.4f}_{suffix}{extension}"
+        try:
+            write_scored_image(image_path, os.path.join(scored_images_dir, scored_image_name), mode, image_data=image_data)
+            return scored_image_name
+        except FileExistsError:
+            suffix += 1
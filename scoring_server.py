@@ -0,0 +1,359 @@
+import base64
+import http.client
+import io
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+from calculate_clip_score import ImageEntry, encode_image_entries, encode_prompts
+from cpu_profiles import CPU_PROFILE_OPTIONS, parse_cpu_profile, set_cpu_threads
+from image_pipeline import load_and_preprocess
+from metrics import LOG_LEVELS, configure_logging, logger
+from model_pool import ModelPool
+
+# Default address of the scoring server
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Default dynamic batching limits
+DEFAULT_MAX_BATCH_SIZE = 32
+DEFAULT_MAX_WAIT_MS = 5.0
+
+
+class ModelWorker:
+    """
+    Keeps one loaded CLIP model and batches image encode requests from many callers.
+
+    Callers submit preprocessed image tensors and get a Future per image. A single worker
+    thread collects queued images for up to `max_wait_ms` (or until `max_batch_size` images
+    are waiting) and encodes them together in one forward pass. All use of the model,
+    including text encoding, is serialized through `lock`. `queue_lock` keeps images from
+    being queued behind the stop sentinel, where they would never be encoded.
+    """
+
+    def __init__(self, model_name, model, preprocess, device, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        self.model_name = model_name
+        self.model = model
+        self.preprocess = preprocess
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.lock = threading.Lock()
+        self.queue_lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.images = 0
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, name=f"batcher-{model_name}", daemon=True)
+        self.thread.start()
+
+    def submit(self, entry):
+        """
+        Queues an ImageEntry for encoding and returns a Future of its normalized features.
+        """
+        future = Future()
+        with self.queue_lock:
+            if self.stopped:
+                raise RuntimeError(f"Model {self.model_name} was unloaded; retry the request.")
+            self.queue.put((entry, future))
+        return future
+
+    def encode_text(self, prompts):
+        with self.lock:
+            return encode_prompts(self.model, prompts, self.device, model_name=self.model_name)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            items = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(items) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.queue.put(None)  # Stop after this batch
+                    break
+                items.append(item)
+
+            try:
+                with self.lock:
+                    features = encode_image_entries(self.model, [entry for entry, _ in items], self.device)
+            except Exception as e:
+                features = [e] * len(items)
+            self.batches += 1
+            self.images += len(items)
+            for (entry, future), row in zip(items, features):
+                if isinstance(row, Exception):
+                    future.set_exception(row)
+                elif row is None:
+                    future.set_exception(RuntimeError(f"Could not encode {entry.image_name}."))
+                else:
+                    future.set_result(row)
+
+    def stop(self):
+        with self.queue_lock:
+            self.stopped = True
+            self.queue.put(None)
+        self.thread.join()
+
+
+class ScoringService:
+    """
+    Loads CLIP models on first use, keeps them resident and scores images against prompts.
+    Models live in a ModelPool; when it evicts a model to stay within `memory_budget_bytes`,
+    the model's worker is stopped as well.
+    """
+
+    def __init__(self, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS, memory_budget_bytes=None, cpu_profile="fp32"):
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.workers = {}
+        self.lock = threading.Lock()
+        self.model_pool = ModelPool(memory_budget_bytes, on_evict=self.stop_worker, cpu_profile=cpu_profile)
+
+    def get_worker(self, model_name):
+        """
+        Returns the worker for `model_name`, loading the model if it is not resident yet.
+        """
+        with self.lock:
+            worker = self.workers.get(model_name)
+            if worker is not None:
+                self.model_pool.get(model_name)  # Mark as recently used
+            else:
+                logger.info(f"Loading model: {model_name}")
+                model, preprocess, device = self.model_pool.get(model_name)
+                worker = ModelWorker(model_name, model, preprocess, device, self.max_batch_size, self.max_wait_ms)
+                self.workers[model_name] = worker
+            return worker
+
+    def score(self, model_name, prompts, image_paths=(), image_bytes=()):
+        """
+        Scores every image against every prompt.
+
+        :param image_paths: Paths of image files readable by the server.
+        :param image_bytes: List of (name, raw file bytes) pairs.
+        :return: Dictionary with one result per image ('image', 'scores') and per-image errors.
+        """
+        if not prompts:
+            raise ValueError("At least one prompt is required.")
+        worker = self.get_worker(model_name)
+        text_features = worker.encode_text(prompts)
+
+        # Decode on the request thread; only the forward pass is shared between requests
+        pending = []
+        errors = []
+        sources = [(path, path) for path in image_paths] + [(name, io.BytesIO(data)) for name, data in image_bytes]
+        for name, source in sources:
+            try:
+                image_tensor = load_and_preprocess(source, worker.preprocess)
+                pending.append((name, worker.submit(ImageEntry(name, None, image_tensor))))
+            except Exception as e:
+                errors.append({"image": name, "error": str(e)})
+
+        results = []
+        for name, future in pending:
+            try:
+                features = future.result()
+            except Exception as e:
+                errors.append({"image": name, "error": str(e)})
+                continue
+            scores = (features.to(text_features.dtype) @ text_features.T).tolist()
+            results.append({"image": name, "scores": scores})
+        return {"model": model_name, "prompts": list(prompts), "results": results, "errors": errors}
+
+    def stop_worker(self, model_name):
+        # Called by the model pool with `lock` already held
+        worker = self.workers.pop(model_name, None)
+        if worker is not None:
+            worker.stop()
+
+    def health(self):
+        pool_stats = self.model_pool.stats()
+        return {
+            "status": "ok",
+            "budget_bytes": pool_stats["budget_bytes"],
+            "used_bytes": pool_stats["used_bytes"],
+            "models": {name: {"device": str(worker.device), "footprint_bytes": self.model_pool.footprints[name], "batches": worker.batches, "images": worker.images} for name, worker in self.workers.items()}
+        }
+
+    def stop(self):
+        for worker in list(self.workers.values()):
+            worker.stop()
+
+
+class ScoringRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP API of the scoring server.
+
+    GET /health returns the resident models. POST /score takes a JSON body
+    {"model": "ViT-B/32", "prompts": [...], "image_paths": [...], "images": [{"name": ..., "data": <base64>}]}
+    and returns the scores of every image against every prompt.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, self.server.service.health())
+        else:
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/score":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            image_bytes = [(image["name"], base64.b64decode(image["data"])) for image in request.get("images", [])]
+            response = self.server.service.score(request["model"], request["prompts"], request.get("image_paths", []), image_bytes)
+        except KeyError as e:
+            self.send_json(400, {"error": f"Missing field {e}"})
+            return
+        except (TypeError, ValueError) as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            self.send_json(500, {"error": str(e)})
+            return
+        self.send_json(200, response)
+
+    def log_message(self, format, *args):
+        pass  # Keep per-request logging off the hot path
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ("unix", 0)  # BaseHTTPRequestHandler expects a (host, port) address
+
+
+# Function to create a scoring server bound to TCP or a Unix socket
+def create_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_socket=None):
+    """
+    Creates an HTTP server for `service`. Serve it with `serve_forever()`.
+    """
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = UnixHTTPServer(unix_socket, ScoringRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), ScoringRequestHandler)
+        server.daemon_threads = True
+    server.service = service
+    return server
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class ScoringClient:
+    """
+    Minimal client for the scoring server, over TCP or a Unix socket.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_socket=None, timeout=300):
+        self.host = host
+        self.port = port
+        self.unix_socket = unix_socket
+        self.timeout = timeout
+
+    def request(self, method, path, payload=None):
+        if self.unix_socket:
+            connection = UnixHTTPConnection(self.unix_socket, timeout=self.timeout)
+        else:
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            body = json.dumps(payload).encode("utf-8") if payload is not None else None
+            connection.request(method, path, body=body, headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            result = json.loads(response.read())
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise RuntimeError(f"Scoring server returned {response.status}: {result.get('error')}")
+        return result
+
+    def health(self):
+        return self.request("GET", "/health")
+
+    def score(self, model_name, prompts, image_paths=(), image_files=()):
+        """
+        Scores images against prompts.
+
+        :param image_paths: Paths the server can read directly.
+        :param image_files: Local paths whose bytes are sent with the request.
+        """
+        images = []
+        for path in image_files:
+            with open(path, "rb") as f:
+                images.append({"name": os.path.basename(path), "data": base64.b64encode(f.read()).decode("ascii")})
+        return self.request("POST", "/score", {"model": model_name, "prompts": list(prompts), "image_paths": list(image_paths), "images": images})
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Serve CLIP scores from models kept in memory.")
+    parser.add_argument("--host", type=str, default=DEFAULT_HOST, help="Address to listen on.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="TCP port to listen on.")
+    parser.add_argument("--unix_socket", type=str, default=None, help="Listen on this Unix socket path instead of TCP.")
+    parser.add_argument("--models", type=str, nargs="*", default=[], help="Models to load at startup (others load on first request).")
+    parser.add_argument("--max_batch_size", type=int, default=DEFAULT_MAX_BATCH_SIZE, help="Maximum number of images per shared forward pass.")
+    parser.add_argument("--max_wait_ms", type=float, default=DEFAULT_MAX_WAIT_MS, help="How long to wait for more images before running a batch.")
+    parser.add_argument("--memory_budget_mb", type=float, default=None, help="Memory budget for resident models; least recently used models are unloaded beyond it. Defaults to half of the RAM or VRAM.")
+    parser.add_argument("--cpu_profile", type=str, default="fp32", help=f"CPU execution profile: comma-separated options from {CPU_PROFILE_OPTIONS}.")
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op threads used by torch on the CPU.")
+    parser.add_argument("--log_level", type=str, default="info", choices=LOG_LEVELS, help="Messages to show.")
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
+    parse_cpu_profile(args.cpu_profile)
+    set_cpu_threads(args.threads)
+    torch.set_grad_enabled(False)
+    budget_bytes = int(args.memory_budget_mb * 2**20) if args.memory_budget_mb else None
+    service = ScoringService(max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms, memory_budget_bytes=budget_bytes, cpu_profile=args.cpu_profile)
+    for model_name in args.models:
+        service.get_worker(model_name)
+
+    server = create_server(service, host=args.host, port=args.port, unix_socket=args.unix_socket)
+    print(f"Scoring server listening on {args.unix_socket or f'http://{args.host}:{args.port}'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
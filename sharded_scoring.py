@@ -0,0 +1,255 @@
+import argparse
+import glob
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+from collections import defaultdict
+
+from calculate_clip_score import get_latest_batch_folder, get_next_batch_folder, get_shard_dir
+from embedding_cache import CACHE_DIR, DEFAULT_MAX_ENTRIES, EmbeddingCache
+from input_sources import SHARD_METHODS, Shard
+from metrics import LOG_LEVELS, configure_logging, logger
+from result_writers import COLUMNAR_FORMATS, RESULT_FIELDS, ResultWriter, load_results
+from scored_images import SCORED_IMAGE_MODES, save_scored_image
+
+# Script run by every shard worker
+SCORING_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "calculate_clip_score.py")
+
+# Name of the shard folders written by calculate_clip_score.get_shard_dir
+SHARD_DIR_PATTERN = re.compile(r"shard_(\d+)_of_(\d+)$")
+
+
+# Function to find the shard output folders of a batch
+def find_shard_dirs(batch_folder):
+    """
+    Returns {shard index: folder} for the shards of `batch_folder`.
+    Raises ValueError if there are none, if they were split with different shard counts,
+    or if a shard is missing.
+    """
+    shard_dirs = {}
+    shard_counts = set()
+    for shard_dir in glob.glob(os.path.join(batch_folder, "shards", "shard_*_of_*")):
+        match = SHARD_DIR_PATTERN.search(shard_dir)
+        if match and os.path.isdir(shard_dir):
+            shard_dirs[int(match.group(1))] = shard_dir
+            shard_counts.add(int(match.group(2)))
+    if not shard_dirs:
+        raise ValueError(f"No shard results found in {os.path.join(batch_folder, 'shards')}.")
+    if len(shard_counts) > 1:
+        raise ValueError(f"Shards of {batch_folder} were split with different shard counts: {sorted(shard_counts)}.")
+    missing = sorted(set(range(shard_counts.pop())) - set(shard_dirs))
+    if missing:
+        raise ValueError(f"Shards {missing} of {batch_folder} have no results yet.")
+    return dict(sorted(shard_dirs.items()))
+
+
+# Function to combine the metrics of several shards
+def merge_metrics(shard_metrics):
+    """
+    Sums stage times, calls and counters over shards. The merged wall time is the longest
+    shard's; each shard's own metrics are kept under "shards".
+    """
+    stages = defaultdict(lambda: {"seconds": 0.0, "calls": 0})
+    counters = defaultdict(int)
+    for metrics in shard_metrics.values():
+        for stage, values in metrics.get("stages", {}).items():
+            stages[stage]["seconds"] += values["seconds"]
+            stages[stage]["calls"] += values["calls"]
+        for name, value in metrics.get("counters", {}).items():
+            counters[name] += value
+    return {
+        "wall_seconds": max((metrics.get("wall_seconds", 0.0) for metrics in shard_metrics.values()), default=0.0),
+        "stages": dict(stages),
+        "counters": dict(counters),
+        "shards": shard_metrics
+    }
+
+
+# Function to merge the embedding stores written by shard workers into the shared cache
+def merge_shard_caches(shard_dirs, cache_dir, max_entries=DEFAULT_MAX_ENTRIES):
+    """
+    Shard workers only read the shared embedding cache and write new embeddings to
+    `<shard folder>/embedding_cache`, since the cache must not be written by several processes.
+    Copies those stores into the cache in `cache_dir`, one shard after another.
+
+    :return: The number of embeddings merged.
+    """
+    merged = 0
+    for shard_dir in shard_dirs.values():
+        shard_cache_dir = os.path.join(shard_dir, "embedding_cache")
+        for index_path in sorted(glob.glob(os.path.join(shard_cache_dir, "*", "index.json"))):
+            with open(index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            shard_cache = EmbeddingCache(shard_cache_dir, index["model_name"], index["resolution"], max_entries=max_entries, read_only=True)
+            cache = EmbeddingCache(cache_dir, index["model_name"], index["resolution"], max_entries=max_entries)
+            merged += cache.merge(shard_cache)
+            cache.save()
+    logger.info(f"Merged {merged} shard embeddings into the embedding cache: {cache_dir}")
+    return merged
+
+
+# Function to merge the results of all shards into their batch folder
+def merge_shards(batch_folder, scored_image_mode="link", columnar=None, embedding_cache_dir=None, cache_max_entries=DEFAULT_MAX_ENTRIES):
+    """
+    Combines the shard results under `<batch_folder>/shards` into one results set in
+    `<batch_folder>/results`, as if the batch had been scored by a single process.
+
+    Rows are sorted by image name, which does not depend on how the input was split, and
+    renumbered. Scored images are gathered into `<batch_folder>/scored_images` (hard links by
+    default, so no bytes are copied) and renamed if equal scores collide across shards.
+    Shard metrics are summed into `results/metrics.json` and the duplicate clusters, which
+    every shard computes over the whole source, are copied from the first shard. With an
+    `embedding_cache_dir`, the embeddings the shards computed are merged into that cache.
+    Merging again rebuilds the merged folders, e.g. after a failed shard was rerun.
+
+    :return: The merged result rows.
+    """
+    shard_dirs = find_shard_dirs(batch_folder)
+    results_dir = os.path.join(batch_folder, "results")
+    scored_images_dir = os.path.join(batch_folder, "scored_images")
+    shutil.rmtree(scored_images_dir, ignore_errors=True)
+    os.makedirs(scored_images_dir)
+    os.makedirs(os.path.join(batch_folder, "charts"), exist_ok=True)
+    os.makedirs(os.path.join(batch_folder, "images_chart"), exist_ok=True)
+
+    shard_rows = []
+    seen_names = set()
+    for shard_index, shard_dir in shard_dirs.items():
+        for row in load_results(os.path.join(shard_dir, "results")):
+            if row["image_name"] in seen_names:
+                logger.warning(f"{row['image_name']} was scored by more than one shard; keeping the first result.")
+                continue
+            seen_names.add(row["image_name"])
+            shard_rows.append((row, shard_dir))
+    shard_rows.sort(key=lambda item: item[0]["image_name"])
+
+    fieldnames = RESULT_FIELDS + ["prompt"] if any("prompt" in row for row, _ in shard_rows) else RESULT_FIELDS
+    with ResultWriter(results_dir, columnar=columnar, fieldnames=fieldnames) as writer:
+        for row, shard_dir in shard_rows:
+            scored_image_name = ""
+            if row["scored_image_path"] and scored_image_mode != "none":
+                shard_image_path = os.path.join(shard_dir, "scored_images", row["scored_image_path"])
+                scored_image_name = save_scored_image(shard_image_path, scored_images_dir, row["clip_score"], mode=scored_image_mode)
+            writer.write(dict(row, image_index=len(writer) + 1, scored_image_path=scored_image_name))
+
+    shard_metrics = {}
+    for shard_index, shard_dir in shard_dirs.items():
+        metrics_path = os.path.join(shard_dir, "results", "metrics.json")
+        if os.path.exists(metrics_path):
+            with open(metrics_path, "r", encoding="utf-8") as f:
+                shard_metrics[os.path.basename(shard_dir)] = json.load(f)
+    with open(os.path.join(results_dir, "metrics.json"), "w", encoding="utf-8") as f:
+        json.dump(merge_metrics(shard_metrics), f, indent=4)
+
+    clusters_path = os.path.join(next(iter(shard_dirs.values())), "results", "clusters.csv")
+    if os.path.exists(clusters_path):
+        shutil.copyfile(clusters_path, os.path.join(results_dir, "clusters.csv"))
+    if embedding_cache_dir:
+        merge_shard_caches(shard_dirs, embedding_cache_dir, cache_max_entries)
+
+    logger.info(f"Merged {len(writer)} results from {len(shard_dirs)} shards into: {results_dir}")
+    return load_results(results_dir)
+
+
+# Function to score a batch with one local worker process per shard
+def run_local_shards(score_args, num_shards, output_dir="Batches", batch_output=None, shard_by="hash", threads=None, resume=False):
+    """
+    Runs calculate_clip_score.py once per shard in parallel, each with its own model copy,
+    and waits for all of them. Every worker gets `score_args` plus the shard options and
+    writes its output to `logs/shard_<index>.log` in the batch folder. Hosts sharing the
+    filesystem can take part by running calculate_clip_score.py with the same --batch_output,
+    --num_shards and --shard_by and their own --shard_index.
+
+    :param threads: Torch CPU threads per worker; defaults to the CPU count divided by the shard count.
+    :return: (batch folder, list of the shard indices whose worker failed).
+    """
+    if batch_output:
+        batch_folder = os.path.join(output_dir, batch_output)
+        os.makedirs(batch_folder, exist_ok=True)
+    elif resume and get_latest_batch_folder(output_dir):
+        batch_folder = get_latest_batch_folder(output_dir)
+    else:
+        batch_folder = get_next_batch_folder(output_dir)
+    logs_dir = os.path.join(batch_folder, "logs")
+    os.makedirs(logs_dir, exist_ok=True)
+    threads = threads or max(1, (os.cpu_count() or 1) // num_shards)
+
+    processes = {}
+    for shard_index in range(num_shards):
+        command = [
+            sys.executable, SCORING_SCRIPT, *score_args,
+            "--output_dir", output_dir,
+            "--batch_output", os.path.basename(batch_folder),
+            "--num_shards", str(num_shards),
+            "--shard_index", str(shard_index),
+            "--shard_by", shard_by,
+            "--threads", str(threads),
+            "--non_interactive",
+            "--skip_visualization"
+        ]
+        if resume:
+            command.append("--resume")
+        with open(os.path.join(logs_dir, f"shard_{shard_index}.log"), "w") as log_file:
+            processes[shard_index] = subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+    logger.info(f"Scoring {num_shards} shards into {batch_folder} (logs: {logs_dir})")
+
+    failed = []
+    for shard_index, process in processes.items():
+        if process.wait() != 0:
+            logger.error(f"Shard {shard_index} failed with exit code {process.returncode}; see {os.path.join(logs_dir, f'shard_{shard_index}.log')}")
+            failed.append(shard_index)
+        else:
+            logger.info(f"Shard {shard_index} finished: {get_shard_dir(batch_folder, Shard(shard_index, num_shards, shard_by))}")
+    return batch_folder, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score images with several worker processes, one per shard of the input, and merge their results. Options not listed here are passed on to calculate_clip_score.py.")
+    parser.add_argument("--num_shards", type=int, default=None, help="Number of shards, each scored by its own local worker process.")
+    parser.add_argument("--shard_by", type=str, default="hash", choices=SHARD_METHODS, help="Assign images to shards by a hash of their name or round-robin by position.")
+    parser.add_argument("--merge", type=str, default=None, metavar="BATCH_FOLDER", help="Only merge the shard results of this batch folder, e.g. after scoring the shards on several hosts.")
+    parser.add_argument("--output_dir", type=str, default="Batches", help="Directory in which batch folders are created.")
+    parser.add_argument("--batch_output", type=str, default=None, help="Name of the batch output folder. Defaults to the next free Batch_X.")
+    parser.add_argument("--threads", type=int, default=None, help="Torch CPU threads per worker. Defaults to the CPU count divided by the number of shards.")
+    parser.add_argument("--resume", action="store_true", help="Continue the shards of --batch_output (or the latest batch), skipping images already scored.")
+    parser.add_argument("--scored_images", type=str, default="link", choices=SCORED_IMAGE_MODES, help="How workers write score-named images. The merge hard-links them from the shard folders.")
+    parser.add_argument("--columnar", type=str, default=None, choices=COLUMNAR_FORMATS, help="Also write the merged results in a columnar format.")
+    parser.add_argument("--embedding_cache", type=str, nargs="?", const=CACHE_DIR, default=None, help=f"Embedding cache the workers read (default when given without a value: {CACHE_DIR}). The embeddings they compute are merged into it with the results.")
+    parser.add_argument("--cache_max_entries", type=int, default=DEFAULT_MAX_ENTRIES, help="Maximum number of embeddings kept per model in the embedding cache.")
+    parser.add_argument("--skip_visualization", action="store_true", help="Do not render charts of the merged results.")
+    parser.add_argument("--log_level", type=str, default="info", choices=LOG_LEVELS, help="Messages to show; passed on to the workers.")
+    args, score_args = parser.parse_known_args(argv)
+    configure_logging(args.log_level)
+
+    if args.merge:
+        batch_folder = args.merge
+    else:
+        if args.num_shards is None or args.num_shards < 2:
+            parser.error("--num_shards must be at least 2 (or use --merge).")
+        score_args += ["--scored_images", args.scored_images, "--log_level", args.log_level]
+        if args.columnar:
+            score_args += ["--columnar", args.columnar]
+        if args.embedding_cache:
+            score_args += ["--embedding_cache", args.embedding_cache, "--cache_max_entries", str(args.cache_max_entries)]
+        batch_folder, failed = run_local_shards(score_args, args.num_shards, args.output_dir, args.batch_output, args.shard_by, args.threads, args.resume)
+        if failed:
+            logger.error(f"Not merging {batch_folder}: {len(failed)} of {args.num_shards} shards failed. Rerun with --batch_output {os.path.basename(batch_folder)} --resume.")
+            return 1
+
+    try:
+        scores = merge_shards(batch_folder, scored_image_mode=args.scored_images, columnar=args.columnar, embedding_cache_dir=args.embedding_cache, cache_max_entries=args.cache_max_entries)
+    except ValueError as e:
+        logger.error(e)
+        return 1
+
+    if args.skip_visualization or not scores:
+        return 0
+    # Render the charts of the merged results with the default chart settings
+    return subprocess.call([sys.executable, os.path.join(os.path.dirname(SCORING_SCRIPT), "visualization_options.py"), batch_folder])
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
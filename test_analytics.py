@@ -0,0 +1,86 @@
+import hashlib
+import os
+
+import numpy as np
+
+from analytics import BOOTSTRAP_BINS, bootstrap_mean_ci, compare_batches, is_current, load_batch_scores
+from result_writers import ResultWriter
+
+
+# Function to make a SHA256 content hash standing for one image's bytes
+def content_hash(content):
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+# Function to write the results of a batch folder from (image name, content, score) rows
+def write_batch(batch_folder, rows, hashed=True, columnar=None):
+    with ResultWriter(os.path.join(batch_folder, "results"), columnar=columnar) as writer:
+        for index, (image_name, content, score) in enumerate(rows, start=1):
+            writer.write({"image_index": index, "image_name": image_name, "clip_score": score, "scored_image_path": "", "content_hash": content_hash(content) if hashed else ""})
+    return load_batch_scores(batch_folder)
+
+
+def test_batches_join_by_content_hash_or_by_name(tmp_path):
+    baseline = write_batch(str(tmp_path / "Batch_1"), [("a.jpg", "cat", 0.20), ("b.jpg", "dog", 0.30), ("c.jpg", "car", 0.25)])
+    # a.jpg was renamed, and b.jpg now holds the car picture
+    renamed = write_batch(str(tmp_path / "Batch_2"), [("cat.jpg", "cat", 0.22), ("b.jpg", "car", 0.21), ("d.jpg", "boat", 0.40)])
+    summary, (image_names, before, after, deltas) = compare_batches(baseline, renamed)
+    assert (summary["matched"], summary["only_in_baseline"], summary["only_in_batch"]) == (2, 1, 1)
+    assert dict(zip(image_names.tolist(), zip(before.tolist(), after.tolist()))) == {"cat.jpg": (0.20, 0.22), "b.jpg": (0.25, 0.21)}
+    assert np.allclose(deltas, after - before)
+
+    # A batch scored without content hashes can only be matched by name
+    unhashed = write_batch(str(tmp_path / "Batch_3"), [("cat.jpg", "cat", 0.22), ("b.jpg", "car", 0.21), ("d.jpg", "boat", 0.40)], hashed=False)
+    assert not unhashed.hashed
+    for first, second in [(baseline, unhashed), (unhashed, baseline)]:
+        summary, (image_names, _, _, _) = compare_batches(first, second)
+        assert (summary["matched"], image_names.tolist()) == (1, ["b.jpg"])
+
+
+def test_images_under_several_names_count_once(tmp_path):
+    baseline = write_batch(str(tmp_path / "Batch_1"), [("a.jpg", "cat", 0.20), ("a_copy.jpg", "cat", 0.20), ("b.jpg", "dog", 0.30)])
+    other = write_batch(str(tmp_path / "Batch_2"), [("a.jpg", "cat", 0.26), ("b.jpg", "dog", 0.28), ("b_copy.jpg", "dog", 0.28)])
+    summary, (image_names, _, _, _) = compare_batches(baseline, other)
+    assert (summary["matched"], summary["only_in_baseline"], summary["only_in_batch"]) == (2, 0, 0)
+    assert (summary["improved"], summary["regressed"], summary["unchanged"]) == (1, 1, 0)
+    assert sorted(image_names.tolist()) == ["a.jpg", "b.jpg"]
+
+    # The same name listed twice in an unhashed batch is one image too
+    repeated = write_batch(str(tmp_path / "Batch_3"), [("a.jpg", "cat", 0.26), ("a.jpg", "cat", 0.26), ("c.jpg", "car", 0.1)], hashed=False)
+    summary, _ = compare_batches(baseline, repeated)
+    assert (summary["matched"], summary["only_in_baseline"], summary["only_in_batch"]) == (1, 2, 1)
+
+
+def test_bootstrap_interval_contains_the_mean():
+    rng = np.random.default_rng(0)
+    # Small samples are resampled directly, large ones through a histogram
+    for count in [40, 3 * BOOTSTRAP_BINS]:
+        values = rng.normal(0.25, 0.03, count)
+        low, high = bootstrap_mean_ci(values, resamples=2000, rng=np.random.default_rng(1))
+        standard_error = values.std() / np.sqrt(count)
+        assert low < values.mean() < high
+        assert 0.8 < (high - low) / (2 * 1.96 * standard_error) < 1.2, count
+    assert bootstrap_mean_ci(np.full(10, 0.3)) == (0.3, 0.3)
+    assert all(np.isnan(bootstrap_mean_ci([])))
+
+
+def test_stale_columnar_copy_is_not_read(tmp_path):
+    batch_folder = str(tmp_path / "Batch_1")
+    results_dir = os.path.join(batch_folder, "results")
+    scores_path = os.path.join(results_dir, "scores.npy")
+    batch = write_batch(batch_folder, [("a.jpg", "cat", 0.20), ("b.jpg", "dog", 0.30)], columnar="npy")
+    assert is_current(scores_path, results_dir) and batch.hashed
+    assert not is_current(os.path.join(results_dir, "results.parquet"), results_dir)
+
+    # A resumed run without --columnar streams more rows after the arrays were written
+    with ResultWriter(results_dir, resume=True) as writer:
+        writer.write({"image_index": 3, "image_name": "c.jpg", "clip_score": 0.25, "scored_image_path": "", "content_hash": content_hash("car")})
+    modified_time = os.path.getmtime(os.path.join(results_dir, "results.jsonl"))
+    os.utime(scores_path, (modified_time - 10, modified_time - 10))
+    assert not is_current(scores_path, results_dir)
+    assert load_batch_scores(batch_folder).image_names.tolist() == ["a.jpg", "b.jpg", "c.jpg"]
+
+    # Without streamed results the arrays are all there is
+    os.remove(os.path.join(results_dir, "results.jsonl"))
+    assert is_current(scores_path, results_dir)
+    assert np.allclose(load_batch_scores(batch_folder).scores, [0.20, 0.30])  # The arrays hold float32 scores
@@ -0,0 +1,29 @@
+import csv
+import json
+
+import benchmark
+from benchmark import STAGES, main
+
+
+def test_benchmark_writes_json_and_csv(tmp_path, monkeypatch, tiny_model):
+    model, preprocess = tiny_model
+    monkeypatch.setattr(benchmark, "load_model", lambda model_name, **kwargs: (model, preprocess, "cpu"))
+    output_path = str(tmp_path / "bench.json")
+    assert main(["--batch_sizes", "1", "4", "--decode_workers", "0", "--images", "6", "--resolution", "96x80", "--output", output_path]) == 0
+
+    with open(output_path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    assert {"commit", "timestamp", "platform", "cpu_count", "torch_version"} <= set(report["metadata"])
+    scoring = [result for result in report["results"] if result["stage_group"] == "scoring"]
+    charts = [result for result in report["results"] if result["stage_group"] == "charts"]
+    assert [(result["batch_size"], result["images"], result["width"], result["height"]) for result in scoring] == [(1, 6, 96, 80), (4, 6, 96, 80)]
+    assert all(isinstance(result[stage], float) for result in scoring for stage in STAGES + ["load"])  # Fast stages may round to 0
+    assert all(result["end_to_end"] > 0 and result["images_per_second"] > 0 for result in scoring)
+    assert [(result["chart_workers"], result["images"]) for result in charts] == [(0, 6)]
+
+    # The CSV has one row per result, each repeating the metadata
+    with open(tmp_path / "bench.csv", "r", newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == len(report["results"]) == 3
+    assert all(row["timestamp"] == report["metadata"]["timestamp"] for row in rows)
+    assert [row["end_to_end"] for row in rows] == [str(result.get("end_to_end", "")) for result in report["results"]]
@@ -0,0 +1,119 @@
+import builtins
+import glob
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+import torch
+
+from calculate_clip_score import calculate_clip_score_matrix_and_save, calculate_clip_scores_and_save, encode_prompts, main, parse_args
+from result_writers import load_results
+
+PROMPTS = ["a cat", "a photo of a dog", "a red car"]
+
+
+def test_score_matrix_matches_single_prompt_runs(tmp_path, tiny_model, image_dir):
+    model, preprocess = tiny_model
+    matrix_prompts = [{"prompt_file": "", "prompt": prompt} for prompt in PROMPTS]
+    score_matrix, image_names = calculate_clip_score_matrix_and_save(image_dir, matrix_prompts, str(tmp_path / "matrix"), model, preprocess, "cpu", batch_size=5)
+    assert score_matrix.shape == (12, len(PROMPTS))
+
+    for prompt_index, prompt in enumerate(PROMPTS):
+        rows, _, _ = calculate_clip_scores_and_save(image_dir, prompt, str(tmp_path / f"single_{prompt_index}"), model, preprocess, "cpu", scored_image_mode="none")
+        assert [row["image_name"] for row in rows] == image_names
+        assert np.allclose(score_matrix[:, prompt_index], [row["clip_score"] for row in rows], atol=1e-5)
+
+    # One streamed row per image, with a score column per prompt
+    results_dir = str(tmp_path / "matrix" / "results")
+    rows = load_results(results_dir, "matrix_results")
+    assert [row["image_name"] for row in rows] == image_names
+    assert np.allclose([[row[f"score_{index}"] for index in range(1, 4)] for row in rows], score_matrix)
+    with open(os.path.join(results_dir, "matrix_prompts.json"), "r", encoding="utf-8") as f:
+        assert json.load(f)["image_names"] == image_names
+
+
+def test_batched_scores_match_single_image_batches(tmp_path, tiny_model, image_dir):
+    model, preprocess = tiny_model
+    with open(os.path.join(image_dir, "broken.jpg"), "wb") as f:
+        f.write(b"not an image")  # Skipped in both runs
+
+    single, _, _ = calculate_clip_scores_and_save(image_dir, "a cat", str(tmp_path / "single"), model, preprocess, "cpu", batch_size=1, scored_image_mode="none")
+    batched, _, _ = calculate_clip_scores_and_save(image_dir, "a cat", str(tmp_path / "batched"), model, preprocess, "cpu", batch_size=5, scored_image_mode="none")
+    assert [row["image_name"] for row in batched] == [row["image_name"] for row in single]
+    assert len(single) == 12
+    assert np.allclose([row["clip_score"] for row in batched], [row["clip_score"] for row in single], atol=1e-5)
+
+
+def test_text_encoder_runs_once_per_prompt(tmp_path, monkeypatch, tiny_model, image_dir):
+    model, preprocess = tiny_model
+    encoded = []
+    encode_text = model.encode_text
+
+    def counting_encode_text(text):
+        encoded.append(text.shape[0])
+        return encode_text(text)
+
+    monkeypatch.setattr(model, "encode_text", counting_encode_text)
+
+    first = encode_prompts(model, ["a cat", "a dog", "a cat"], "cpu", model_name="tiny")
+    second = encode_prompts(model, ["a dog", "a bird"], "cpu", model_name="tiny")
+    assert encoded == [2, 1]  # Repeated and cached prompts are not encoded again
+    assert torch.equal(first[0], first[2]) and torch.equal(first[1], second[0])
+
+    # A manifest run encodes the run prompt and each per-image prompt once, whatever the batch size
+    manifest_path = str(tmp_path / "manifest.jsonl")
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        for index in range(12):
+            f.write(json.dumps({"path": os.path.join(image_dir, f"img_{index}.jpg"), "prompt": ["a cat", "a house"][index % 2]}) + "\n")
+    encoded.clear()
+    rows, _, _ = calculate_clip_scores_and_save(manifest_path, "a tree", str(tmp_path / "batch"), model, preprocess, "cpu", batch_size=3, model_name="tiny", scored_image_mode="none")
+    assert len(rows) == 12
+    assert sum(encoded) == 2  # "a tree" and "a house"; "a cat" is still cached
+
+
+class InteractiveStdin:
+    """
+    A terminal stdin that fails the test when anything reads from it.
+    """
+
+    def isatty(self):
+        return True
+
+    def readline(self, *args):
+        raise AssertionError("Headless runs must not read stdin.")
+
+    read = readline
+
+
+def test_headless_run_never_reads_stdin(tmp_path, monkeypatch, tiny_model, image_dir):
+    prompt_dir = tmp_path / "prompts"
+    prompt_dir.mkdir()
+    (prompt_dir / "a.txt").write_text("a cat", encoding="utf-8")
+    (prompt_dir / "b.txt").write_text("a dog", encoding="utf-8")  # Several files would ask which one to use
+    monkeypatch.setattr(sys, "stdin", InteractiveStdin())
+    monkeypatch.setattr(builtins, "input", InteractiveStdin().readline)
+
+    output_dir = str(tmp_path / "Batches")
+    assert main(["--headless", "--model", "ViT-B/32", "--prompt_dir", str(prompt_dir), "--target_dir", image_dir, "--output_dir", output_dir, "--batch_output", "run", "--contact_sheet", "4x4"]) == 0
+    assert len(load_results(os.path.join(output_dir, "run", "results"))) == 12
+    assert glob.glob(os.path.join(output_dir, "run", "charts", "*.png"))  # Charts use the default types and colors
+    assert glob.glob(os.path.join(output_dir, "run", "images_chart", "*.png"))
+
+
+def test_config_file_sets_defaults_that_options_override(tmp_path):
+    config_path = str(tmp_path / "config.json")
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump({"model": "RN50", "batch_size": 16, "prompt": "a cat", "figsize": "8,4", "summary_chart_type": 3, "skip_visualization": True}, f)
+
+    args = parse_args(["--config", config_path])
+    assert (args.model, args.batch_size, args.prompt, args.figsize, args.summary_chart_type, args.skip_visualization) == ("RN50", 16, ["a cat"], (8, 4), 3, True)
+    assert args.decode_workers == 0  # Keys missing from the file keep the parser defaults
+    args = parse_args(["--config", config_path, "--batch_size", "2", "--model", "ViT-B/32"])
+    assert (args.model, args.batch_size) == ("ViT-B/32", 2)
+
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump({"batch_sise": 16}, f)
+    with pytest.raises(SystemExit):
+        parse_args(["--config", config_path])
@@ -0,0 +1,15 @@
+import torch
+import torch._inductor.config
+
+from conftest import make_tiny_model
+from cpu_profiles import apply_cpu_profile
+
+
+def test_compile_profile_leaves_global_inductor_config_alone():
+    model, _ = make_tiny_model()
+    images = torch.randn(2, 3, 64, 64, generator=torch.Generator().manual_seed(0))
+    with torch.inference_mode():
+        expected = model.encode_image(images)
+        compiled = apply_cpu_profile(model, "compile", "cpu")
+        assert torch.allclose(compiled.encode_image(images), expected, atol=1e-4)
+    assert not torch._inductor.config.freezing  # Later compiles in the process are not frozen
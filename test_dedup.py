@@ -0,0 +1,97 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import dedup
+from dedup import cluster_pairs, find_duplicates
+from embedding_cache import EmbeddingCache, hash_file
+
+
+# Function to write a smooth image, whose perceptual hash survives small edits
+def write_smooth_image(image_path, seed, brightness=0):
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:96, 0:128].astype(np.float32)
+    frequency = rng.uniform(1, 4, size=3) / 96
+    pixels = np.stack([127 + 90 * np.sin(2 * np.pi * frequency[c] * (x + 2 * y * c) + seed) for c in range(3)], axis=-1) + brightness
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(image_path, quality=90)
+
+
+# Function to group cluster rows by representative
+def clusters_by_representative(clusters):
+    groups = {}
+    for row in clusters:
+        groups.setdefault(row["representative"], set()).add(row["image_name"])
+    return groups
+
+
+# Function to check that each cluster is represented by its first image in source order
+def assert_first_image_represents(clusters):
+    first_of_cluster = {}
+    for row in clusters:
+        first_of_cluster.setdefault(row["cluster"], row["image_name"])
+        assert row["representative"] == first_of_cluster[row["cluster"]]
+        assert (row["match"] == "") == (row["image_name"] == row["representative"])
+
+
+def test_cluster_roots_are_first_items_of_single_linkage_components():
+    # Pairs arrive in blocks, and a late pair joins two clusters formed earlier
+    blocks = [(np.array([3, 1]), np.array([4, 2])), (np.array([6]), np.array([7])), (np.array([2, 5]), np.array([3, 7]))]
+    assert cluster_pairs(9, iter(blocks)) == [0, 1, 1, 1, 1, 5, 5, 5, 8]
+
+
+def test_phash_never_decodes_exact_duplicates(tmp_path, monkeypatch):
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    write_smooth_image(image_dir / "sunset.jpg", 1)
+    shutil.copy(image_dir / "sunset.jpg", image_dir / "sunset_copy.jpg")
+    shutil.copy(image_dir / "sunset.jpg", image_dir / "sunset_copy_2.jpg")
+    write_smooth_image(image_dir / "forest.jpg", 2)
+    write_smooth_image(image_dir / "forest_bright.jpg", 2, brightness=6)  # Near duplicate
+    write_smooth_image(image_dir / "river.jpg", 3)
+
+    decoded = []
+    perceptual_hash = dedup.perceptual_hash
+
+    def recording_hash(image):
+        decoded.append(os.path.basename(image.filename))
+        return perceptual_hash(image)
+
+    monkeypatch.setattr(dedup, "perceptual_hash", recording_hash)
+    clusters = find_duplicates(str(image_dir), "phash")
+
+    # Only one copy of identical files is decoded, whichever the directory listing gives first
+    sunset_copies = {"sunset.jpg", "sunset_copy.jpg", "sunset_copy_2.jpg"}
+    assert len(decoded) == 4 and len(set(decoded) & sunset_copies) == 1
+    assert sorted(clusters_by_representative(clusters).values(), key=sorted) == [{"forest.jpg", "forest_bright.jpg"}, {"river.jpg"}, sunset_copies]
+    assert sorted(row["match"] for row in clusters) == ["", "", "", "exact", "exact", "near"]
+    assert {row["cluster_size"] for row in clusters if row["image_name"] in sunset_copies} == {3}
+    assert_first_image_represents(clusters)
+
+    decoded.clear()
+    assert len(clusters_by_representative(find_duplicates(str(image_dir), "exact"))) == 4
+    assert decoded == []
+
+
+def test_clip_clusters_link_chains_of_similar_embeddings(tmp_path):
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    for seed in range(5):
+        write_smooth_image(image_dir / f"img_{seed}.jpg", seed)
+    shutil.copy(image_dir / "img_2.jpg", image_dir / "img_2_copy.jpg")
+
+    # img_1 is similar to img_0 and img_2, but img_0 and img_2 are not similar to each other
+    angles = {0: 0.0, 1: 0.21, 2: 0.42, 3: 1.5}
+    cache = EmbeddingCache(str(tmp_path / "cache"), "ViT-B/32", 224)
+    for seed, angle in angles.items():
+        cache.put(hash_file(str(image_dir / f"img_{seed}.jpg")), np.array([np.cos(angle), np.sin(angle), 0, 0], dtype=np.float32))
+    assert np.cos(0.21) > dedup.DEFAULT_CLIP_SIMILARITY > np.cos(0.42)
+
+    clusters = find_duplicates(str(image_dir), "clip", embedding_cache=cache)
+    # img_4 has no cached embedding and stays on its own
+    assert sorted(clusters_by_representative(clusters).values(), key=sorted) == [{"img_0.jpg", "img_1.jpg", "img_2.jpg", "img_2_copy.jpg"}, {"img_3.jpg"}, {"img_4.jpg"}]
+    assert_first_image_represents(clusters)
+    with pytest.raises(ValueError):
+        find_duplicates(str(image_dir), "clip")
@@ -0,0 +1,77 @@
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from download_manager import PARTIAL_SUFFIX, ChecksumError, download_file
+
+PAYLOAD = os.urandom(300_000)
+PAYLOAD_SHA256 = hashlib.sha256(PAYLOAD).hexdigest()
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves PAYLOAD, honouring `Range: bytes=<start>-` requests, and records their ranges.
+    """
+
+    def do_GET(self):
+        byte_range = self.headers.get("Range")
+        self.server.ranges.append(byte_range)
+        start = int(byte_range[len("bytes="):-1]) if byte_range else 0
+        body = PAYLOAD[start:]
+        self.send_response(206 if byte_range else 200)
+        if byte_range:
+            self.send_header("Content-Range", f"bytes {start}-{len(PAYLOAD) - 1}/{len(PAYLOAD)}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeRequestHandler)
+    server.ranges = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_resumes_from_partial_file(tmp_path, server):
+    file_path = str(tmp_path / "model.pt")
+    with open(file_path + PARTIAL_SUFFIX, "wb") as f:
+        f.write(PAYLOAD[:100_000])
+
+    url = f"http://127.0.0.1:{server.server_port}/model.pt"
+    received = download_file(url, file_path, expected_sha256=PAYLOAD_SHA256, chunk_size=4096)
+    assert received == len(PAYLOAD) - 100_000
+    assert server.ranges == ["bytes=100000-"]
+    with open(file_path, "rb") as f:
+        assert f.read() == PAYLOAD
+    assert not os.path.exists(file_path + PARTIAL_SUFFIX)
+
+
+def test_checksum_mismatch_restarts_or_fails(tmp_path, server):
+    url = f"http://127.0.0.1:{server.server_port}/model.pt"
+
+    # A corrupt partial file fails the check after resuming, so the file is downloaded again
+    file_path = str(tmp_path / "resumed.pt")
+    with open(file_path + PARTIAL_SUFFIX, "wb") as f:
+        f.write(b"\0" * 100_000)
+    assert download_file(url, file_path, expected_sha256=PAYLOAD_SHA256) == len(PAYLOAD) * 2 - 100_000
+    assert server.ranges == ["bytes=100000-", None]
+    with open(file_path, "rb") as f:
+        assert f.read() == PAYLOAD
+
+    # A fresh download that does not match is not retried and leaves nothing behind
+    file_path = str(tmp_path / "mismatch.pt")
+    with pytest.raises(ChecksumError):
+        download_file(url, file_path, expected_sha256="0" * 64)
+    assert not os.path.exists(file_path)
+    assert not os.path.exists(file_path + PARTIAL_SUFFIX)
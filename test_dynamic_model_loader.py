@@ -0,0 +1,29 @@
+import clip
+import pytest
+import torch
+
+import dynamic_model_loader
+from conftest import make_tiny_model
+from dynamic_model_loader import convert_model, load_fast_model
+
+
+@pytest.mark.parametrize("fast_load_supported", [True, False])
+def test_fast_copy_matches_clip_load(tmp_path, monkeypatch, fast_load_supported):
+    model_path = str(tmp_path / "tiny.pt")
+    fast_model_path = str(tmp_path / "tiny.state.pt")
+    # OpenAI archives are TorchScript modules, which clip.load rebuilds from their state dict
+    model = make_tiny_model()[0]
+    torch.jit.save(torch.jit.trace(model, (torch.randn(1, 3, 64, 64), clip.tokenize(["a cat"]))), model_path)
+    convert_model(model_path, fast_model_path)
+    monkeypatch.setattr(dynamic_model_loader, "FAST_LOAD_SUPPORTED", fast_load_supported)
+
+    reference, reference_preprocess = clip.load(model_path, device="cpu", jit=False)
+    model, preprocess = load_fast_model(fast_model_path, "cpu")
+    assert model.visual.input_resolution == reference.visual.input_resolution
+    assert str(preprocess) == str(reference_preprocess)
+
+    images = torch.randn(2, 3, model.visual.input_resolution, model.visual.input_resolution, generator=torch.Generator().manual_seed(0))
+    text = clip.tokenize(["a cat", "a photo of a dog"])
+    with torch.inference_mode():
+        assert torch.equal(model.encode_image(images), reference.encode_image(images))
+        assert torch.equal(model.encode_text(text), reference.encode_text(text))
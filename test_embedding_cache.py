@@ -0,0 +1,29 @@
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+
+
+# Function to make a normalized embedding that identifies its image
+def embedding_of(index, dim=8):
+    embedding = np.random.default_rng(index).standard_normal(dim).astype(np.float32)
+    return embedding / np.linalg.norm(embedding)
+
+
+def test_index_on_disk_stays_valid_when_rows_are_reused(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "ViT-B/32", 224, max_entries=4)
+    for index in range(4):
+        cache.put(f"hash_{index}", embedding_of(index))
+    cache.save()
+
+    # Evictions free rows that the saved index still points to; the run then stops without saving
+    for index in range(4, 10):
+        cache.put(f"hash_{index}", embedding_of(index))
+    cache.matrix.flush()
+    del cache
+
+    reopened = EmbeddingCache(str(tmp_path), "ViT-B/32", 224, max_entries=4)
+    assert len(reopened) > 0
+    for content_hash in list(reopened.entries):
+        index = int(content_hash.split("_")[1])
+        assert np.allclose(reopened.get(content_hash), embedding_of(index), atol=1e-3)
+    assert reopened.verify() == []
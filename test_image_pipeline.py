@@ -0,0 +1,56 @@
+import glob
+import io
+import os
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from conftest import make_tiny_model
+from image_pipeline import load_and_preprocess, prefetch_images
+
+
+# Function to encode a random image in memory
+def encode_image(image_format, size=(200, 160)):
+    data = io.BytesIO()
+    Image.fromarray(np.random.default_rng(0).integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)).save(data, image_format)
+    data.seek(0)
+    return data
+
+
+def test_only_jpeg_bombs_are_decoded_within_the_budget(tmp_path, monkeypatch):
+    _, preprocess = make_tiny_model()
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 5000)  # 200x160 images are now decompression bombs
+
+    assert load_and_preprocess(encode_image("JPEG"), preprocess, max_pixels=8000).shape == (3, 64, 64)
+    image_path = tmp_path / "large.jpg"
+    image_path.write_bytes(encode_image("JPEG").getvalue())
+    assert load_and_preprocess(str(image_path), preprocess, max_pixels=8000).shape == (3, 64, 64)
+    assert Image.MAX_IMAGE_PIXELS == 5000  # Other threads keep the limit meanwhile
+    with pytest.raises(Image.DecompressionBombError):
+        load_and_preprocess(encode_image("PNG"), preprocess, max_pixels=8000)
+    with pytest.raises(Image.DecompressionBombError):
+        load_and_preprocess(encode_image("JPEG"), preprocess, max_pixels=0)  # No budget, no exception to the limit
+
+
+@pytest.mark.parametrize("use_processes", [False, True])
+def test_worker_pool_matches_serial_preprocessing(image_dir, use_processes):
+    _, preprocess = make_tiny_model()
+    broken_path = os.path.join(image_dir, "broken.jpg")
+    with open(broken_path, "wb") as f:
+        f.write(b"not an image")
+    items = [(os.path.basename(path), path) for path in sorted(glob.glob(os.path.join(image_dir, "*.jpg")))] + [("cached", None)]
+
+    serial = list(prefetch_images(items, preprocess))
+    pooled = list(prefetch_images(items, preprocess, workers=3, use_processes=use_processes, max_pending=4))
+    assert [key for key, _, _ in pooled] == [key for key, _ in items]  # Input order is kept
+    for (key, serial_tensor, serial_error), (_, pooled_tensor, pooled_error) in zip(serial, pooled):
+        if key == "broken.jpg":
+            assert serial_tensor is None and pooled_tensor is None
+            assert type(pooled_error) is type(serial_error) and isinstance(pooled_error, Image.UnidentifiedImageError)
+        elif key == "cached":
+            assert (serial_tensor, serial_error, pooled_tensor, pooled_error) == (None, None, None, None)
+        else:
+            assert serial_error is None and pooled_error is None
+            assert torch.equal(serial_tensor, pooled_tensor)
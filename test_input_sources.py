@@ -0,0 +1,77 @@
+import glob
+import json
+import os
+import tarfile
+import zipfile
+import zlib
+
+import pytest
+
+from conftest import make_images
+from input_sources import Shard, iter_source, shard_of
+
+
+# Function to read the bytes of every image in a directory, keyed by file name
+def read_images(image_dir):
+    images = {}
+    for image_path in sorted(glob.glob(os.path.join(image_dir, "*.jpg"))):
+        with open(image_path, "rb") as f:
+            images[os.path.basename(image_path)] = f.read()
+    return images
+
+
+def test_manifest_and_archive_sources(tmp_path, image_dir):
+    images = read_images(image_dir)
+
+    manifest_path = str(tmp_path / "manifest.jsonl")
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"path": "images/img_0.jpg", "prompt": "a cat"}) + "\n")
+        f.write(json.dumps({"image_path": os.path.join(image_dir, "img_1.jpg"), "name": "second"}) + "\n")
+    assert [(image.name, image.path, image.prompt) for image in iter_source(manifest_path)] == [
+        ("images/img_0.jpg", os.path.join(image_dir, "img_0.jpg"), "a cat"),
+        ("second", os.path.join(image_dir, "img_1.jpg"), None),
+    ]
+
+    tar_path = str(tmp_path / "shard.tar")
+    with tarfile.open(tar_path, "w") as archive:
+        for name in images:
+            archive.add(os.path.join(image_dir, name), arcname=f"part/{name}")
+    zip_path = str(tmp_path / "shard.zip")
+    with zipfile.ZipFile(zip_path, "w") as archive:
+        for name, data in images.items():
+            archive.writestr(name, data)
+        archive.writestr("notes.txt", b"not an image")
+
+    assert {image.name: image.data for image in iter_source(tar_path)} == {f"shard.tar/part/{name}": data for name, data in images.items()}
+    assert {image.name: image.data for image in iter_source(zip_path)} == {f"shard.zip/{name}": data for name, data in images.items()}
+    assert len(list(iter_source(str(tmp_path / "shard.*")))) == 2 * len(images)
+    with pytest.raises(ValueError):
+        list(iter_source(str(tmp_path / "manifest.jsonl"), image_filter="unknown"))
+
+
+def test_shards_split_by_crc32_of_the_name(image_dir):
+    names = sorted(image.name for image in iter_source(image_dir))
+    assert [shard_of(name, 0, 3) for name in names] == [zlib.crc32(name.encode("utf-8")) % 3 for name in names]
+
+    shards = [sorted(image.name for image in iter_source(image_dir, shard=Shard(index, 3))) for index in range(3)]
+    assert sorted(sum(shards, [])) == names
+    for index, shard_names in enumerate(shards):
+        assert all(shard_of(name, 0, 3) == index for name in shard_names)
+
+    # Round-robin shards follow the listing order instead of the names
+    assert [shard_of(name, position, 3, "index") for position, name in enumerate(names)] == [position % 3 for position in range(len(names))]
+    with pytest.raises(ValueError):
+        list(iter_source(image_dir, shard=Shard(3, 3)))
+
+
+def test_glob_of_directories_keeps_equal_names_apart(tmp_path):
+    for day in ["day_1", "day_2"]:
+        make_images(str(tmp_path / "photos" / day), 2)
+    names = sorted(image.name for image in iter_source(str(tmp_path / "photos" / "day_*")))
+    assert names == ["day_1/img_0.jpg", "day_1/img_1.jpg", "day_2/img_0.jpg", "day_2/img_1.jpg"]
+    assert sorted(image.name for image in iter_source(str(tmp_path / "photos" / "day_1*"))) == ["img_0.jpg", "img_1.jpg"]
+
+    # Sources that would give the same names are rejected
+    make_images(str(tmp_path / "other" / "day_1"), 1)
+    with pytest.raises(ValueError):
+        list(iter_source(str(tmp_path / "*" / "day_1")))
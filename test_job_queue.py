@@ -0,0 +1,33 @@
+import asyncio
+
+import pytest
+
+from job_queue import JobQueue, JobStore, make_job_spec
+
+
+def test_jobs_are_claimed_once_and_requeued_by_the_lock_holder(tmp_path, image_dir):
+    db_path = str(tmp_path / "jobs.db")
+    first, second = JobStore(db_path), JobStore(db_path)
+    job_id = first.add(make_job_spec(image_dir, "a cat", model="ViT-B/32", charts=False))
+
+    job = first.next_job()
+    assert job["job_id"] == job_id and job["state"] == "running"
+    assert second.next_job() is None
+    assert not second.claim(job_id)
+
+    # A second scheduler neither starts nor requeues the jobs of the live one
+    first.lock_scheduler()
+    queue = JobQueue(db_path)
+    with pytest.raises(RuntimeError):
+        asyncio.run(queue.run())
+    with pytest.raises(RuntimeError):
+        second.requeue_interrupted()
+    assert second.get(job_id)["state"] == "running"
+
+    # Once the scheduler is gone, its running job goes back to the queue
+    first.close()
+    second.lock_scheduler()
+    assert second.requeue_interrupted() == 1
+    assert second.get(job_id)["state"] == "queued"
+    second.close()
+    queue.close()
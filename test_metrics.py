@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+import metrics as metrics_module
+from metrics import Histogram, Metrics, configure_logging, logger, timed_iter
+
+
+class FakeClock:
+    """
+    perf_counter replacement that only advances when told to.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def perf_counter(self):
+        return self.now
+
+
+def test_timers_count_only_the_timed_code(tmp_path, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(metrics_module, "time", clock)
+    metrics = Metrics()
+
+    with metrics.timer("encode"):
+        clock.now += 2.0
+    with pytest.raises(ValueError):
+        with metrics.timer("encode"):
+            clock.now += 1.0
+            raise ValueError("Stages that fail are still timed.")
+
+    def produce():
+        for item in range(3):
+            clock.now += 0.5
+            yield item
+
+    for _ in timed_iter(produce(), metrics, "wait"):
+        clock.now += 10.0  # Time spent by the consumer is not waiting
+    metrics.count("images", 3)
+    metrics.observe("image_ms", 3.0)
+
+    assert dict(metrics.stage_seconds) == {"encode": 3.0, "wait": 1.5}
+    assert metrics.stage_calls["encode"] == 2
+    assert metrics.summary() == "Stage time: encode 3.00s, wait 1.50s"
+    with open(metrics.save(str(tmp_path)), "r", encoding="utf-8") as f:
+        saved = json.load(f)
+    assert saved["stages"]["encode"] == {"seconds": 3.0, "calls": 2}
+    assert saved["counters"] == {"images": 3}
+    assert saved["latency_ms"]["image_ms"]["count"] == 1
+    assert saved["wall_seconds"] == clock.now
+
+
+def test_histogram_buckets_and_percentiles():
+    histogram = Histogram()
+    assert histogram.to_dict() == {"count": 0}
+    for value in [0.3, 0.7, 3.0, 4.0, 100.0]:
+        histogram.observe(value)
+
+    summary = histogram.to_dict()
+    assert (summary["count"], summary["min"], summary["max"]) == (5, 0.3, 100.0)
+    assert summary["mean"] == pytest.approx(108.0 / 5)
+    assert summary["buckets"] == {"<=0.5": 1, "<=1": 1, "<=4": 2, "<=128": 1}  # Bounds are inclusive
+    assert summary["p50"] == 4  # Upper bound of the bucket holding the median
+    assert summary["p99"] == 100.0  # Capped at the largest value seen
+
+    histogram.observe(1e6)
+    assert histogram.to_dict()["buckets"][">262144"] == 1
+    assert histogram.percentile(1.0) == 1e6
+
+
+def test_log_levels_filter_messages(capsys):
+    try:
+        configure_logging("warning")
+        logger.info("progress")
+        logger.warning("skipped image")
+        assert capsys.readouterr().out == "skipped image\n"
+
+        configure_logging("debug")
+        logger.debug("scored image")
+        assert capsys.readouterr().out == "scored image\n"
+
+        configure_logging("info")
+        logger.debug("scored image")
+        logger.info("progress")
+        assert capsys.readouterr().out == "progress\n"
+    finally:
+        configure_logging()
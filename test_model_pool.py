@@ -0,0 +1,38 @@
+import torch
+
+import model_pool
+from model_pool import ModelPool
+
+# Footprints of the stub models, in bytes of float32 weights
+MODEL_BYTES = {"small": 4000, "medium": 6000, "large": 12000}
+
+
+def test_pool_evicts_least_recently_used_within_budget(monkeypatch):
+    loads = []
+
+    def load_stub(model_name, **kwargs):
+        loads.append((model_name, pool.used_bytes()))  # Bytes resident while loading
+        return torch.nn.Linear(MODEL_BYTES[model_name] // 4, 1, bias=False), None, "cpu"
+
+    monkeypatch.setattr(model_pool, "load_model", load_stub)
+    evicted = []
+    pool = ModelPool(budget_bytes=10000, device="cpu", on_evict=evicted.append)
+
+    pool.get("small")
+    pool.get("medium")
+    pool.get("small")  # Now the most recently used
+    assert list(pool.models) == ["medium", "small"] and pool.used_bytes() == 10000
+    assert [name for name, _ in loads] == ["small", "medium"]
+
+    # A model that does not fit evicts the least recently used ones after it is first loaded
+    pool.get("large")
+    assert evicted == ["medium", "small"]
+    assert list(pool.models) == ["large"]  # Larger than the budget, but just requested
+
+    # Once its footprint is known, a model gets room before it is loaded
+    pool.get("medium")
+    assert evicted == ["medium", "small", "large"]
+    assert loads[-1] == ("medium", 0)
+    pool.get("small")
+    assert loads[-1] == ("small", 6000) and pool.used_bytes() == 10000  # Fits next to medium
+    assert pool.stats()["models"].keys() == {"medium", "small"}
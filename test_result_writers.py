@@ -0,0 +1,46 @@
+import csv
+import json
+import os
+
+import numpy as np
+
+from result_writers import RESULT_FIELDS, ResultWriter, load_results
+
+
+# Function to make the result row of one image
+def result_row(index):
+    return {"image_index": index, "image_name": f"img_{index}.jpg", "clip_score": float(index), "scored_image_path": "", "content_hash": ""}
+
+
+def test_resume_drops_truncated_row_and_rebuilds_outputs(tmp_path):
+    results_dir = str(tmp_path / "results")
+    with ResultWriter(results_dir) as writer:
+        for index in range(1, 4):
+            writer.write(result_row(index))
+    with open(os.path.join(results_dir, "results.jsonl"), "a", encoding="utf-8") as f:
+        f.write('{"image_index": 4, "image_na')  # Crash in the middle of a row
+
+    with ResultWriter(results_dir, resume=True, columnar="npy") as writer:
+        assert writer.scored_names() == {"img_1.jpg", "img_2.jpg", "img_3.jpg"}
+        writer.write(result_row(len(writer) + 1))
+
+    expected = [result_row(index) for index in range(1, 5)]
+    assert load_results(results_dir) == expected
+    with open(os.path.join(results_dir, "results.json"), "r", encoding="utf-8") as f:
+        assert json.load(f) == expected
+    assert not os.path.exists(os.path.join(results_dir, "results.json.tmp"))
+    assert np.load(os.path.join(results_dir, "scores.npy")).tolist() == [1.0, 2.0, 3.0, 4.0]
+    assert np.load(os.path.join(results_dir, "image_names.npy")).tolist() == [row["image_name"] for row in expected]
+
+
+def test_resume_across_prompt_columns(tmp_path):
+    results_dir = str(tmp_path / "results")
+    with ResultWriter(results_dir, fieldnames=RESULT_FIELDS + ["prompt"]) as writer:
+        writer.write(dict(result_row(1), prompt="a cat"))
+
+    # A single-prompt run resumes the rows of a manifest run, whose prompt column it does not write
+    with ResultWriter(results_dir, resume=True) as writer:
+        writer.write(result_row(2))
+    with open(os.path.join(results_dir, "results.csv"), "r", newline="", encoding="utf-8") as f:
+        assert [row["image_name"] for row in csv.DictReader(f)] == ["img_1.jpg", "img_2.jpg"]
+    assert [row.get("prompt") for row in load_results(results_dir)] == ["a cat", None]
@@ -0,0 +1,69 @@
+import json
+import os
+
+import numpy as np
+
+from conftest import make_images
+from embedding_cache import EmbeddingCache, hash_file
+from retrieval_index import SEARCH_BLOCK_ROWS, RetrievalIndex, build_index, measure_recall
+
+
+# Function to make normalized random embeddings
+def random_embeddings(count, dim, seed=0):
+    embeddings = np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+# Function to write the files of an exact index without going through the embedding cache
+def write_index(index_dir, embeddings):
+    os.makedirs(index_dir)
+    np.save(os.path.join(index_dir, "embeddings.npy"), embeddings.astype(np.float16))
+    with open(os.path.join(index_dir, "images.json"), "w", encoding="utf-8") as f:
+        json.dump([{"name": f"img_{row}.jpg", "path": f"img_{row}.jpg"} for row in range(len(embeddings))], f)
+    with open(os.path.join(index_dir, "index.json"), "w", encoding="utf-8") as f:
+        json.dump({"model_name": "ViT-B/32", "dim": embeddings.shape[1], "images": len(embeddings), "approximate": None}, f)
+    return RetrievalIndex(index_dir)
+
+
+def test_exact_search_matches_brute_force_across_blocks(tmp_path):
+    count = 2 * SEARCH_BLOCK_ROWS + 1000
+    embeddings = random_embeddings(count, 16)
+    queries = random_embeddings(4, 16, seed=1)
+    # The best matches of the first query straddle block boundaries
+    best_rows = [SEARCH_BLOCK_ROWS - 1, SEARCH_BLOCK_ROWS, 2 * SEARCH_BLOCK_ROWS, count - 1]
+    embeddings[best_rows] = queries[0]
+    index = write_index(str(tmp_path / "index"), embeddings)
+
+    scores, rows = index.search_exact(queries, top_k=25)
+    brute_scores = queries @ np.load(str(tmp_path / "index" / "embeddings.npy")).astype(np.float32).T
+    expected_rows = np.argsort(-brute_scores, axis=1, kind="stable")[:, :25]
+    assert rows.shape == (4, 25)
+    assert set(rows[0, :4].tolist()) == set(best_rows)
+    assert np.allclose(scores, np.take_along_axis(brute_scores, expected_rows, axis=1), atol=1e-5)
+    assert np.allclose(scores, np.take_along_axis(brute_scores, rows, axis=1), atol=1e-5)
+    assert np.all(np.diff(scores, axis=1) <= 0)
+
+    # Asking for more results than images returns every image once
+    small_index = write_index(str(tmp_path / "small_index"), embeddings[:10])
+    _, rows = small_index.search_exact(queries, top_k=25)
+    assert rows.shape == (4, 10) and all(sorted(query_rows.tolist()) == list(range(10)) for query_rows in rows)
+
+
+def test_recall_is_complete_when_every_list_is_probed(tmp_path):
+    image_dir = make_images(str(tmp_path / "images"), 300, size=(16, 16))
+    cache_dir = str(tmp_path / "cache")
+    cache = EmbeddingCache(cache_dir, "ViT-B/32", 224)
+    # Clustered embeddings, like those of real photo collections
+    centers = random_embeddings(6, 32, seed=1)
+    embeddings = centers[np.arange(300) % 6] + 0.3 * random_embeddings(300, 32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    for row, name in enumerate(sorted(os.listdir(image_dir))):
+        cache.put(hash_file(os.path.join(image_dir, name)), embeddings[row])
+    cache.save()
+
+    info = build_index(image_dir, "ViT-B/32", index_dir=str(tmp_path / "index"), cache_dir=cache_dir, approximate=True, nlist=8, subspaces=8)
+    assert (info["images"], info["missing"], info["approximate"]["nlist"]) == (300, 0, 8)
+    index = RetrievalIndex(str(tmp_path / "index"))
+    queries = random_embeddings(10, 32, seed=2)
+    assert measure_recall(index, queries, top_k=10, nprobe=8) == 1.0
+    assert measure_recall(index, queries, top_k=10, nprobe=1) < 1.0  # Probing one list misses neighbours in the others
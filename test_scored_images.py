@@ -0,0 +1,51 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from scored_images import save_scored_image
+
+
+# Function to write a small PNG and return its path
+def make_png(path):
+    Image.fromarray(np.random.default_rng(0).integers(0, 255, (20, 30, 3), dtype=np.uint8)).save(path)
+    return path
+
+
+@pytest.mark.parametrize("mode", ["link", "reflink", "copy"])
+def test_modes_keep_the_file_bytes(tmp_path, mode):
+    image_path = make_png(str(tmp_path / "source.png"))
+    scored_images_dir = str(tmp_path / "scored")
+    os.makedirs(scored_images_dir)
+
+    names = [save_scored_image(image_path, scored_images_dir, 0.31204, mode=mode) for _ in range(3)]
+    assert names == ["0.3120.png", "0.3120_1.png", "0.3120_2.png"]  # Equal scores get numeric suffixes
+    for name in names:
+        with open(os.path.join(scored_images_dir, name), "rb") as scored, open(image_path, "rb") as source:
+            assert scored.read() == source.read()
+    if mode == "link":
+        assert os.stat(os.path.join(scored_images_dir, names[0])).st_ino == os.stat(image_path).st_ino
+
+
+def test_reencode_none_and_in_memory_images(tmp_path):
+    image_path = make_png(str(tmp_path / "source.png"))
+    scored_images_dir = str(tmp_path / "scored")
+    os.makedirs(scored_images_dir)
+
+    name = save_scored_image(image_path, scored_images_dir, 0.5, mode="reencode")
+    assert name == "0.5000.jpg"
+    with Image.open(os.path.join(scored_images_dir, name)) as image:
+        assert image.format == "JPEG" and image.size == (30, 20)
+    assert save_scored_image(image_path, scored_images_dir, 0.5, mode="none") is None
+
+    # Archive members are written from their bytes, named after the member's extension
+    with open(image_path, "rb") as f:
+        image_data = f.read()
+    assert save_scored_image("shard.tar/a.png", scored_images_dir, 0.5, mode="link", image_data=image_data) == "0.5000.png"
+    assert save_scored_image("shard.tar/b.png", scored_images_dir, 0.5, mode="reencode", image_data=image_data) == "0.5000_1.jpg"
+    with Image.open(os.path.join(scored_images_dir, "0.5000_1.jpg")) as image:
+        assert image.format == "JPEG"
+    assert sorted(os.listdir(scored_images_dir)) == ["0.5000.jpg", "0.5000.png", "0.5000_1.jpg"]
+    with pytest.raises(ValueError):
+        save_scored_image(image_path, scored_images_dir, 0.5, mode="symlink")
@@ -0,0 +1,70 @@
+import glob
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from calculate_clip_score import ImageEntry
+from scoring_server import ModelWorker, ScoringClient, ScoringService, create_server
+
+
+def test_client_scores_over_unix_socket(tmp_path, tiny_model, image_dir):
+    service = ScoringService(max_wait_ms=20)
+    socket_path = str(tmp_path / "scoring.sock")
+    server = create_server(service, unix_socket=socket_path)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        client = ScoringClient(unix_socket=socket_path)
+        image_paths = sorted(glob.glob(os.path.join(image_dir, "*.jpg")))
+        prompts = ["a cat", "a dog"]
+        expected = client.score("ViT-B/32", prompts, image_paths=image_paths)
+        assert [result["image"] for result in expected["results"]] == image_paths
+        assert expected["errors"] == []
+
+        # Concurrent requests with overlapping prompts share the text cache and the batching worker
+        def score_request(index):
+            request_prompts = prompts + [f"prompt {index % 3}"]
+            return client.score("ViT-B/32", request_prompts, image_files=image_paths[index % 4:][:3])
+
+        with ThreadPoolExecutor(8) as executor:
+            responses = list(executor.map(score_request, range(16)))
+        expected_scores = {os.path.basename(result["image"]): result["scores"] for result in expected["results"]}
+        for response in responses:
+            assert response["errors"] == []
+            for result in response["results"]:
+                assert np.allclose(result["scores"][:2], expected_scores[result["image"]], atol=1e-4)
+
+        health = client.health()
+        assert health["models"]["ViT-B/32"]["images"] == len(image_paths) + 16 * 3
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.stop()
+
+
+def test_images_submitted_while_stopping_are_encoded_or_rejected(tiny_model):
+    model, _ = tiny_model
+    for _ in range(20):
+        worker = ModelWorker("tiny", model, None, "cpu", max_wait_ms=1)
+        futures = []
+        rejected = []
+
+        def submit_images():
+            for index in range(50):
+                try:
+                    futures.append(worker.submit(ImageEntry(f"img_{index}", None, torch.zeros(3, 64, 64))))
+                except RuntimeError:
+                    rejected.append(index)
+
+        threads = [threading.Thread(target=submit_images) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        worker.stop()
+        for thread in threads:
+            thread.join()
+        # Every accepted image resolves, so no request waits forever
+        assert all(future.result(timeout=10).shape == (32,) for future in futures)
+        assert len(futures) + len(rejected) == 200
@@ -0,0 +1,109 @@
+import glob
+import json
+import multiprocessing
+import os
+import shutil
+
+import numpy as np
+
+import calculate_clip_score
+from conftest import make_tiny_model
+from embedding_cache import EmbeddingCache
+from result_writers import ResultWriter, load_results
+from sharded_scoring import merge_shards
+
+
+# Function to run calculate_clip_score.py with the tiny test model
+def score(argv):
+    model, preprocess = make_tiny_model()
+    calculate_clip_score.load_model = lambda model_name, **kwargs: (model, preprocess, "cpu")
+    return calculate_clip_score.main(argv)
+
+
+# Function run by each shard worker process
+def score_in_process(argv):
+    raise SystemExit(score(argv))
+
+
+def scores_of(results_dir):
+    return {row["image_name"]: float(row["clip_score"]) for row in load_results(results_dir)}
+
+
+def test_shards_share_one_embedding_cache(tmp_path, image_dir):
+    cache_dir = str(tmp_path / "cache")
+    output_dir = str(tmp_path / "Batches")
+    options = ["--headless", "--model", "ViT-B/32", "--prompt", "a cat", "--output_dir", output_dir, "--skip_visualization", "--batch_size", "4"]
+    assert score(options + ["--target_dir", image_dir, "--batch_output", "reference"]) == 0
+    reference = scores_of(os.path.join(output_dir, "reference", "results"))
+
+    # Cache half of the images first, so the shards both read the shared cache and add to it
+    warm_dir = str(tmp_path / "warm")
+    os.makedirs(warm_dir)
+    for image_path in sorted(glob.glob(os.path.join(image_dir, "*.jpg")))[:6]:
+        shutil.copy(image_path, warm_dir)
+    assert score(options + ["--target_dir", warm_dir, "--batch_output", "warm", "--embedding_cache", cache_dir]) == 0
+    index_path = glob.glob(os.path.join(cache_dir, "*", "index.json"))[0]
+    with open(index_path, "rb") as f:
+        warm_index = f.read()
+
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(target=score_in_process, args=(options + ["--target_dir", image_dir, "--batch_output", "sharded", "--embedding_cache", cache_dir, "--num_shards", "2", "--shard_index", str(shard_index)],))
+        for shard_index in range(2)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert [worker.exitcode for worker in workers] == [0, 0]
+    with open(index_path, "rb") as f:
+        assert f.read() == warm_index  # Workers never write the shared cache
+
+    merged = merge_shards(os.path.join(output_dir, "sharded"), embedding_cache_dir=cache_dir)
+    assert [row["image_name"] for row in merged] == sorted(reference)
+    merged_scores = scores_of(os.path.join(output_dir, "sharded", "results"))
+    assert np.allclose([merged_scores[name] for name in reference], list(reference.values()), atol=1e-3)
+
+    with open(index_path, "r", encoding="utf-8") as f:
+        index = json.load(f)
+    cache = EmbeddingCache(cache_dir, index["model_name"], index["resolution"])
+    assert len(cache) == len(reference)
+    assert cache.verify() == []
+
+    # Every embedding in the merged cache belongs to its image
+    assert score(options + ["--target_dir", image_dir, "--batch_output", "cached", "--embedding_cache", cache_dir]) == 0
+    cached_scores = scores_of(os.path.join(output_dir, "cached", "results"))
+    assert np.allclose([cached_scores[name] for name in reference], list(reference.values()), atol=1e-3)
+
+
+def test_merge_sorts_renumbers_and_keeps_first_duplicate(tmp_path):
+    batch_folder = str(tmp_path / "batch")
+    shard_rows = {
+        0: [("img_3.jpg", 0.5), ("img_1.jpg", 0.25), ("img_dup.jpg", 0.125)],
+        1: [("img_2.jpg", 0.5), ("img_dup.jpg", 0.75), ("img_0.jpg", 0.375)],
+    }
+    for shard_index, rows in shard_rows.items():
+        shard_dir = os.path.join(batch_folder, "shards", f"shard_{shard_index}_of_2")
+        os.makedirs(os.path.join(shard_dir, "scored_images"))
+        with ResultWriter(os.path.join(shard_dir, "results")) as writer:
+            for image_index, (image_name, score) in enumerate(rows, start=1):
+                scored_image_name = f"{score:.4f}.jpg"
+                with open(os.path.join(shard_dir, "scored_images", scored_image_name), "wb") as f:
+                    f.write(image_name.encode("utf-8"))
+                writer.write({"image_index": image_index, "image_name": image_name, "clip_score": score, "scored_image_path": scored_image_name, "content_hash": ""})
+
+    merged = merge_shards(batch_folder, scored_image_mode="copy")
+    assert [(row["image_index"], row["image_name"], row["clip_score"]) for row in merged] == [
+        (1, "img_0.jpg", 0.375),
+        (2, "img_1.jpg", 0.25),
+        (3, "img_2.jpg", 0.5),
+        (4, "img_3.jpg", 0.5),
+        (5, "img_dup.jpg", 0.125),  # Shard 0 scored it first
+    ]
+    assert load_results(os.path.join(batch_folder, "results")) == merged
+
+    # Equal scores from different shards get distinct scored image names
+    for row in merged:
+        with open(os.path.join(batch_folder, "scored_images", row["scored_image_path"]), "rb") as f:
+            assert f.read() == row["image_name"].encode("utf-8")
+    assert sorted(row["scored_image_path"] for row in merged if row["clip_score"] == 0.5) == ["0.5000.jpg", "0.5000_1.jpg"]
@@ -0,0 +1,126 @@
+import os
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+from PIL import Image
+
+from calculate_clip_score import start_async_visualization
+from result_writers import ResultWriter
+from visualization_options import SingleChartRenderer, draw_single_chart, lttb_downsample, minmax_downsample, quantile_bands, render_summary_chart, visualize
+
+SCORES = [{"image_index": index, "image_name": f"img_{index}.jpg", "clip_score": score} for index, score in [(1, 0.21), (2, 0.34), (12, 0.18), (103, 0.29)]]
+YLIM = (0.17, 0.35)
+ADVANCED_SETTINGS = {"figsize": (6, 4), "xlabel": "Images", "ylabel": "CLIP Scores"}
+
+
+# Function to read a saved chart as pixels
+def read_pixels(path):
+    with Image.open(path) as image:
+        return np.asarray(image.convert("RGBA"))
+
+
+# Function to render a single-image chart on a new pyplot figure, as charts were drawn before figures were reused
+def render_on_new_figure(score, chart_type, color, chart_path):
+    plt.figure(figsize=(6, 4))
+    draw_single_chart(plt.gca(), score, chart_type, color)
+    plt.ylim(*YLIM)
+    plt.title(f"CLIP Score for Target_{score['image_index']}", fontsize=14)
+    plt.xlabel("Image", fontsize=12)
+    plt.ylabel("CLIP Score", fontsize=12)
+    plt.tight_layout()
+    plt.savefig(chart_path)
+    plt.close()
+
+
+@pytest.mark.parametrize("chart_type", range(1, 11))
+def test_reused_figure_matches_new_figure_per_chart(tmp_path, chart_type):
+    renderer = SingleChartRenderer(chart_type, "#1f77b4", YLIM, (6, 4))
+    for score in SCORES:
+        reused_path = str(tmp_path / f"reused_{score['image_index']}.png")
+        expected_path = str(tmp_path / f"expected_{score['image_index']}.png")
+        renderer.render(score, reused_path)
+        render_on_new_figure(score, chart_type, "#1f77b4", expected_path)
+        assert np.array_equal(read_pixels(reused_path), read_pixels(expected_path)), f"Target_{score['image_index']}"
+
+
+# Function to read every chart saved in a batch folder
+def read_charts(batch_folder):
+    charts = {}
+    for folder in ["charts", "images_chart"]:
+        for file_name in sorted(os.listdir(os.path.join(batch_folder, folder))):
+            if file_name.endswith(".png"):
+                charts[f"{folder}/{file_name}"] = read_pixels(os.path.join(batch_folder, folder, file_name))
+    return charts
+
+
+def test_pool_and_background_charts_match_serial(tmp_path):
+    scores = [{"image_index": index, "image_name": f"img_{index}.jpg", "clip_score": 0.2 + 0.01 * (index % 7), "scored_image_path": "", "content_hash": ""} for index in range(1, 11)]
+    batches = {mode: str(tmp_path / mode) for mode in ["serial", "pool", "background"]}
+    visualize(scores, 1, "#1f77b4", ADVANCED_SETTINGS, os.path.join(batches["serial"], "charts"), os.path.join(batches["serial"], "images_chart"), single_chart_type=2, single_chart_color="#ff7f0e")
+    visualize(scores, 1, "#1f77b4", ADVANCED_SETTINGS, os.path.join(batches["pool"], "charts"), os.path.join(batches["pool"], "images_chart"), single_chart_type=2, single_chart_color="#ff7f0e", chart_workers=2)
+
+    # The background process renders from the persisted results
+    with ResultWriter(os.path.join(batches["background"], "results")) as writer:
+        for score in scores:
+            writer.write(score)
+    process = start_async_visualization(batches["background"], 1, "#1f77b4", 2, "#ff7f0e", ADVANCED_SETTINGS, chart_workers=2)
+    assert process.wait(timeout=120) == 0
+
+    expected = read_charts(batches["serial"])
+    assert len(expected) == len(scores) + 1
+    for mode in ["pool", "background"]:
+        charts = read_charts(batches[mode])
+        assert list(charts) == list(expected), mode
+        for name, pixels in expected.items():
+            assert np.array_equal(charts[name], pixels), f"{mode}: {name}"
+
+
+def test_downsampling_keeps_endpoints_and_extremes():
+    rng = np.random.default_rng(0)
+    x = np.arange(1, 10001)
+    y = rng.random(10000)
+    y[[3071, 6502]] = [5.0, -5.0]  # A peak and a dip inside buckets
+
+    line_x, line_y = lttb_downsample(x, y, 200)
+    assert len(line_x) == 200 and np.all(np.diff(line_x) > 0)
+    assert (line_x[0], line_x[-1]) == (1, 10000)
+    assert {3072, 6503} <= set(line_x.tolist())
+
+    dot_x, dot_y = minmax_downsample(x, y, 200)
+    assert len(dot_x) <= 202 and np.all(np.diff(dot_x) > 0)
+    assert (dot_x[0], dot_x[-1]) == (1, 10000)
+    assert np.array_equal(dot_y, y[dot_x - 1])
+    for start in range(0, 10000, 100):  # 100 buckets of 100 images
+        assert {y[start:start + 100].min(), y[start:start + 100].max()} <= set(dot_y.tolist())
+
+    # Short series are drawn as they are
+    assert np.array_equal(lttb_downsample(x[:50], y[:50], 200)[1], y[:50])
+    assert np.array_equal(minmax_downsample(x[:50], y[:50], 200)[1], y[:50])
+
+
+def test_quantile_bands_at_small_and_constant_batches():
+    scores = np.array([0.3, 0.1, 0.2, 0.6, 0.4, 0.5, 0.9])
+    x, bucket_size, bands = quantile_bands(scores, 3)
+    assert x.tolist() == [1, 4, 7] and bucket_size == 3
+    for bucket, start in enumerate([0, 3, 6]):
+        # The last bucket holds a single image, and its padding does not enter the quantiles
+        expected = np.quantile(scores[start:start + 3], [0, 0.25, 0.5, 0.75, 1])
+        assert np.allclose([band[bucket] for band in bands], expected)
+
+    # Fewer images than buckets gives one bucket per image
+    x, bucket_size, bands = quantile_bands(scores[:3], 400)
+    assert x.tolist() == [1, 2, 3] and bucket_size == 1
+    assert all(np.allclose(band, scores[:3]) for band in bands)
+
+    x, bucket_size, bands = quantile_bands(np.full(1000, 0.25), 400)
+    assert bucket_size == 3 and len(x) == 334
+    assert all(np.allclose(band, 0.25) for band in bands)
+
+
+@pytest.mark.parametrize("chart_type", range(1, 11))
+@pytest.mark.parametrize("clip_scores", [[0.25] * 300, [0.3, 0.1, 0.2]], ids=["constant", "small"])
+def test_aggregated_summary_charts_render(tmp_path, chart_type, clip_scores):
+    image_names = [f"Target_{index}" for index in range(1, len(clip_scores) + 1)]
+    render_summary_chart(image_names, clip_scores, chart_type, "#1f77b4", ADVANCED_SETTINGS, str(tmp_path), large_threshold=0)
+    assert read_pixels(os.path.join(tmp_path, "clip_scores_summary.png")).shape == (400, 600, 4)
@@ -1,11 +1,210 @@
+import math
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import matplotlib
+
+matplotlib.use("Agg")  # Charts are only saved to files; never open a window
 
 import matplotlib.pyplot as plt
 import numpy as np
-import seaborn as sns
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.ticker import FixedFormatter, FixedLocator
+
+from metrics import logger
+
+# Single-image chart types whose artists can be updated in place between images
+REUSABLE_SINGLE_CHART_TYPES = {1, 2, 3}
+
+# Above this many images the summary chart aggregates or downsamples instead of drawing one element per image
+LARGE_SUMMARY_THRESHOLD = 200
+
+# Maximum number of points drawn by downsampled summary charts
+SUMMARY_MAX_POINTS = 2000
+
+# Number of bins used by aggregated summary charts
+SUMMARY_HISTOGRAM_BINS = 50
+SUMMARY_QUANTILE_BUCKETS = 400
+SUMMARY_PIE_BINS = 8
+
+
+# Function to draw one single-image chart on an axes
+def draw_single_chart(ax, score, chart_type, color):
+    """
+    Draws the single-image chart for `score` on `ax`, matching the original pyplot calls.
+    Returns the artist holding the score for chart types that can be updated in place.
+    """
+    label = f"Target_{score['image_index']}"
+    if chart_type == 1:  # Line Chart
+        return ax.plot([label], [score['clip_score']], marker='o', color=color)[0]
+    elif chart_type == 2:  # Histogram
+        return ax.bar([label], [score['clip_score']], color=color, width=0.4)[0]
+    elif chart_type == 3:  # Dot Chart
+        return ax.scatter([label], [score['clip_score']], color=color, s=100)
+    elif chart_type == 4:  # Scatter Chart
+        ax.scatter([score['image_index']], [score['clip_score']], color=color, s=100)
+    elif chart_type == 5:  # Box Plot
+        ax.boxplot([score['clip_score']], patch_artist=True, boxprops=dict(facecolor=color))
+    elif chart_type == 6:  # Violin Plot
+        import seaborn as sns  # Slow to import, so only loaded for the charts that use it
+        sns.violinplot(data=[score['clip_score']], color=color, ax=ax)
+    elif chart_type == 7:  # Area Chart
+        ax.fill_between([label], [score['clip_score']], color=color, alpha=0.5)
+        ax.plot([label], [score['clip_score']], color=color)
+    return None
+
 
+class SingleChartRenderer:
+    """
+    Renders single-image charts into one reused figure instead of creating a figure per image.
+
+    For line, histogram and dot charts the plotted artist, the x tick label and the title are
+    updated in place between images; other chart types clear and redraw the same axes. The
+    layout is recomputed for every image so files are identical to charts drawn on a new figure.
+    """
+
+    def __init__(self, chart_type, color, ylim, figsize):
+        self.chart_type = chart_type
+        self.color = color
+        self.ylim = ylim
+        self.figure = Figure(figsize=figsize)
+        FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot(111)
+        self.artist = None
+        self.tick_labels = None
+
+    def draw(self, score):
+        """
+        Draws the chart for `score`, updating the existing artists when possible.
+        """
+        label = f"Target_{score['image_index']}"
+        if self.artist is not None:
+            if self.chart_type == 1:
+                self.artist.set_ydata([score['clip_score']])
+            elif self.chart_type == 2:
+                self.artist.set_height(score['clip_score'])
+            elif self.chart_type == 3:
+                self.artist.set_offsets([[0, score['clip_score']]])
+            self.tick_labels.seq = [label]
+            self.title.set_text(f"CLIP Score for {label}")
+            return
+
+        self.ax.cla()
+        artist = draw_single_chart(self.ax, score, self.chart_type, self.color)
+        self.ax.set_ylim(*self.ylim)  # Ensure consistent y-axis range across all single-image charts
+        self.title = self.ax.set_title(f"CLIP Score for {label}", fontsize=14)
+        self.ax.set_xlabel("Image", fontsize=12)
+        self.ax.set_ylabel("CLIP Score", fontsize=12)
 
-def visualize(scores, summary_chart_type, summary_color, advanced_settings, charts_dir, images_chart_dir, single_chart_type=1, single_chart_color="#1f77b4"):
+        if self.chart_type in REUSABLE_SINGLE_CHART_TYPES:
+            # Replace the category axis with a fixed tick whose label can be swapped per image
+            self.tick_labels = FixedFormatter([label])
+            self.ax.xaxis.set_major_locator(FixedLocator([0]))
+            self.ax.xaxis.set_major_formatter(self.tick_labels)
+            self.artist = artist
+
+    def render(self, score, chart_path):
+        """
+        Draws the chart for `score` and saves it to `chart_path`.
+        """
+        self.draw(score)
+        # Start the layout from the default subplot position, as a new figure would
+        self.figure.subplots_adjust(**{key: matplotlib.rcParams[f"figure.subplot.{key}"] for key in ["left", "right", "bottom", "top"]})
+        self.figure.tight_layout()
+        self.figure.savefig(chart_path)
+
+
+# Renderer owned by each chart worker process
+WORKER_RENDERER = None
+
+
+# Function to set up a chart worker process
+def init_chart_worker(chart_type, color, ylim, figsize):
+    """
+    Creates the figure that this worker process reuses for all of its single-image charts.
+    """
+    global WORKER_RENDERER
+    WORKER_RENDERER = SingleChartRenderer(chart_type, color, ylim, figsize)
+
+
+# Function to render a chunk of single-image charts in a worker process
+def render_single_chart_chunk(scores, images_chart_dir):
+    """
+    Renders the single-image charts of `scores` with the worker's renderer.
+
+    :return: Number of charts saved.
+    """
+    for score in scores:
+        WORKER_RENDERER.render(score, os.path.join(images_chart_dir, f"Target_{score['image_index']}_chart.png"))
+    return len(scores)
+
+
+# Function to start rendering single-image charts on a process pool
+def submit_single_charts(scores, chart_type, color, ylim, figsize, images_chart_dir, workers):
+    """
+    Splits the single-image charts into chunks and submits them to `workers` processes,
+    each holding its own figure. Returns the executor and the submitted futures.
+    """
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_chart_worker,
+        initargs=(chart_type, color, ylim, figsize)
+    )
+    chunk_size = max(1, min(64, math.ceil(len(scores) / (workers * 4))))
+    futures = [executor.submit(render_single_chart_chunk, scores[start:start + chunk_size], images_chart_dir) for start in range(0, len(scores), chunk_size)]
+    return executor, futures
+
+
+# Function to wait for parallel chart rendering while reporting progress
+def wait_for_single_charts(futures, total):
+    """
+    Waits for all submitted chunks, printing how many charts are done as each chunk finishes.
+    """
+    rendered = 0
+    for future in as_completed(futures):
+        rendered += future.result()
+        logger.info(f"Single-image charts rendered: {rendered}/{total}")
+
+
+# Function to pack many single-image charts into contact sheets
+def render_contact_sheets(scores, chart_type, color, ylim, images_chart_dir, grid=(4, 4)):
+    """
+    Saves single-image charts as a grid of `rows x cols` charts per PNG
+    (`contact_sheet_1.png`, `contact_sheet_2.png`, ...), reusing one figure for all sheets.
+
+    :return: List of the saved contact sheet paths.
+    """
+    rows, cols = grid
+    per_sheet = rows * cols
+    figure = Figure(figsize=(cols * 3, rows * 2.5))
+    FigureCanvasAgg(figure)
+    axes = figure.subplots(rows, cols, squeeze=False).ravel()
+
+    sheet_paths = []
+    for start in range(0, len(scores), per_sheet):
+        page = scores[start:start + per_sheet]
+        for ax, score in zip(axes, page):
+            ax.cla()
+            ax.set_visible(True)
+            draw_single_chart(ax, score, chart_type, color)
+            ax.set_ylim(*ylim)
+            ax.set_title(f"Target_{score['image_index']}: {score['clip_score']:.4f}", fontsize=9)
+            ax.tick_params(labelsize=7)
+        for ax in axes[len(page):]:
+            ax.set_visible(False)
+
+        sheet_path = os.path.join(images_chart_dir, f"contact_sheet_{start // per_sheet + 1}.png")
+        figure.tight_layout()
+        figure.savefig(sheet_path)
+        sheet_paths.append(sheet_path)
+        logger.info(f"Contact sheet saved to {sheet_path}")
+    return sheet_paths
+
+
+def visualize(scores, summary_chart_type, summary_color, advanced_settings, charts_dir, images_chart_dir, single_chart_type=1, single_chart_color="#1f77b4", contact_sheet=None, chart_workers=0):
     """
     Visualizes CLIP scores for multiple and single images.
 
@@ -17,6 +216,8 @@ def visualize(scores, summary_chart_type, summary_color, advanced_settings, char
     :param images_chart_dir: Directory to save single-image charts.
     :param single_chart_type: The type of chart for single-image charts.
     :param single_chart_color: The color for single-image charts (hex value).
+    :param contact_sheet: Optional (rows, cols) to pack single-image charts into contact sheets instead of one PNG per image.
+    :param chart_workers: Number of worker processes rendering single-image charts (0 renders them in this process).
     """
     if not os.path.exists(charts_dir):
         os.makedirs(charts_dir)
@@ -32,6 +233,203 @@ def visualize(scores, summary_chart_type, summary_color, advanced_settings, char
     global_ymin = min(clip_scores) - 0.01  # Add some padding
     global_ymax = max(clip_scores) + 0.01
 
+    # Start the single-image chart workers first so they run while the summary chart is drawn
+    executor = None
+    if chart_workers > 0 and not contact_sheet:
+        executor, futures = submit_single_charts(scores, single_chart_type, single_chart_color, (global_ymin, global_ymax), advanced_settings['figsize'], images_chart_dir, chart_workers)
+    try:
+        render_summary_chart(image_names, clip_scores, summary_chart_type, summary_color, advanced_settings, charts_dir)
+
+        # Single-image charts
+        if contact_sheet:
+            render_contact_sheets(scores, single_chart_type, single_chart_color, (global_ymin, global_ymax), images_chart_dir, contact_sheet)
+        elif executor is not None:
+            wait_for_single_charts(futures, len(scores))
+        else:
+            renderer = SingleChartRenderer(single_chart_type, single_chart_color, (global_ymin, global_ymax), advanced_settings['figsize'])
+            for score in scores:
+                single_chart_path = os.path.join(images_chart_dir, f"Target_{score['image_index']}_chart.png")
+                renderer.render(score, single_chart_path)
+                logger.debug(f"Single-image chart saved to {single_chart_path}")
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+# Function to group consecutive values into equally sized buckets
+def bucket_values(values, num_buckets):
+    """
+    Reshapes `values` into a (buckets, bucket_size) array of consecutive values, padded with NaN.
+    Returns the array and the index of the first value of each bucket.
+    """
+    bucket_size = math.ceil(len(values) / num_buckets)
+    num_buckets = math.ceil(len(values) / bucket_size)
+    padded = np.full(num_buckets * bucket_size, np.nan)
+    padded[:len(values)] = values
+    return padded.reshape(num_buckets, bucket_size), np.arange(num_buckets) * bucket_size
+
+
+# Function to downsample a series keeping each bucket's minimum and maximum
+def minmax_downsample(x, y, max_points):
+    """
+    Keeps the minimum and maximum of each of `max_points / 2` consecutive buckets, so peaks survive.
+    The first and last points are always kept, so the drawn range matches the data.
+    """
+    if len(y) <= max_points:
+        return x, y
+    buckets, starts = bucket_values(y, max(1, max_points // 2))
+    indices = np.unique(np.concatenate([[0, len(y) - 1], starts + np.nanargmin(buckets, axis=1), starts + np.nanargmax(buckets, axis=1)]))
+    return x[indices], y[indices]
+
+
+# Function to compute quantile bands over consecutive scores
+def quantile_bands(scores, num_buckets):
+    """
+    Splits `scores` into at most `num_buckets` buckets of consecutive images and returns the
+    1-based position of each bucket's first image, the bucket size, and the minimum, 25%,
+    median, 75% and maximum of each bucket (a shorter last bucket uses only its own scores).
+    """
+    buckets, starts = bucket_values(scores, num_buckets)
+    low, q1, median, q3, high = np.nanquantile(buckets, [0, 0.25, 0.5, 0.75, 1], axis=1)
+    return starts + 1, buckets.shape[1], (low, q1, median, q3, high)
+
+
+# Function to downsample a line with Largest-Triangle-Three-Buckets
+def lttb_downsample(x, y, max_points):
+    """
+    Selects `max_points` points that preserve the visual shape of the line (Steinarsson's LTTB).
+    The first and last points are always kept.
+    """
+    n = len(y)
+    if max_points >= n or max_points < 3:
+        return x, y
+
+    edges = np.linspace(1, n - 1, max_points - 1).astype(int)
+    selected = np.empty(max_points, dtype=int)
+    selected[0] = 0
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        a = selected[i]
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        selected[i + 1] = start + int(np.argmax(areas))
+    selected[-1] = n - 1
+    return x[selected], y[selected]
+
+
+# Function to draw and save an aggregated batch-wide chart for large batches
+def render_large_summary_chart(clip_scores, summary_chart_type, summary_color, advanced_settings, batch_chart_path):
+    """
+    Draws a batch-wide chart whose cost does not grow with one artist or label per image.
+    Line charts are LTTB downsampled, dot and scatter charts min-max downsampled, area charts
+    become quantile bands over consecutive images, histograms and pie charts bin the scores,
+    box and violin plots use statistics computed with NumPy, and the heatmap is folded into a grid.
+    """
+    scores = np.asarray(clip_scores, dtype=np.float64)
+    n = len(scores)
+    positions = np.arange(1, n + 1)
+    xlabel = advanced_settings['xlabel']
+    ylabel = advanced_settings['ylabel']
+
+    figure = Figure(figsize=advanced_settings['figsize'])
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot(111, projection='3d' if summary_chart_type == 10 else None)
+
+    if summary_chart_type == 1:  # Line Chart
+        x, y = lttb_downsample(positions, scores, SUMMARY_MAX_POINTS)
+        ax.plot(x, y, color=summary_color, linewidth=1)
+        ax.set_title(f'Line Chart of CLIP Scores ({n} images, {len(x)} points shown)', fontsize=14)
+    elif summary_chart_type == 2:  # Histogram
+        counts, edges = np.histogram(scores, bins=SUMMARY_HISTOGRAM_BINS)
+        ax.stairs(counts, edges, fill=True, color=summary_color)
+        ax.set_title(f'Histogram of CLIP Scores ({n} images)', fontsize=14)
+        xlabel, ylabel = ylabel, 'Number of Images'
+    elif summary_chart_type in (3, 4):  # Dot Chart, Scatter Chart
+        x, y = minmax_downsample(positions, scores, SUMMARY_MAX_POINTS)
+        ax.scatter(x, y, color=summary_color, s=6 if summary_chart_type == 3 else 12)
+        chart_name = 'Dot Chart' if summary_chart_type == 3 else 'Scatter Chart'
+        ax.set_title(f'{chart_name} of CLIP Scores ({n} images, per-bucket min/max shown)', fontsize=14)
+    elif summary_chart_type == 5:  # Box Plot
+        q1, median, q3 = np.percentile(scores, [25, 50, 75])
+        iqr = q3 - q1
+        whislo = scores[scores >= q1 - 1.5 * iqr].min()
+        whishi = scores[scores <= q3 + 1.5 * iqr].max()
+        fliers = np.sort(scores[(scores < whislo) | (scores > whishi)])
+        if len(fliers) > SUMMARY_MAX_POINTS:
+            fliers = fliers[np.linspace(0, len(fliers) - 1, SUMMARY_MAX_POINTS).astype(int)]
+        stats = {"med": median, "q1": q1, "q3": q3, "whislo": whislo, "whishi": whishi, "fliers": fliers, "label": "CLIP Scores"}
+        ax.bxp([stats], patch_artist=True, boxprops=dict(facecolor=summary_color))
+        ax.set_title(f'Box Plot of CLIP Scores ({n} images)', fontsize=14)
+        xlabel = ''
+    elif summary_chart_type == 6:  # Violin Plot
+        density, edges = np.histogram(scores, bins=SUMMARY_HISTOGRAM_BINS * 4, density=True)
+        kernel = np.exp(-0.5 * np.linspace(-2, 2, 9) ** 2)
+        density = np.convolve(density, kernel / kernel.sum(), mode='same')
+        density = 0.4 * density / density.max()
+        centers = (edges[:-1] + edges[1:]) / 2
+        ax.fill_betweenx(centers, -density, density, color=summary_color, alpha=0.8)
+        q1, median, q3 = np.percentile(scores, [25, 50, 75])
+        ax.vlines(0, q1, q3, color='black', linewidth=4)
+        ax.scatter([0], [median], color='white', s=20, zorder=3)
+        ax.set_xticks([0], ['CLIP Scores'], fontsize=12)
+        ax.set_title(f'Violin Plot of CLIP Scores ({n} images)', fontsize=14)
+        xlabel = ''
+    elif summary_chart_type == 7:  # Area Chart
+        x, bucket_size, (low, q1, median, q3, high) = quantile_bands(scores, SUMMARY_QUANTILE_BUCKETS)
+        ax.fill_between(x, low, high, color=summary_color, alpha=0.2, label='min-max')
+        ax.fill_between(x, q1, q3, color=summary_color, alpha=0.5, label='25-75%')
+        ax.plot(x, median, color=summary_color, label='median')
+        ax.legend(loc='best')
+        ax.set_title(f'Area Chart of CLIP Scores ({n} images, quantiles per {bucket_size} images)', fontsize=14)
+    elif summary_chart_type == 8:  # Pie Chart
+        counts, edges = np.histogram(scores, bins=SUMMARY_PIE_BINS)
+        keep = counts > 0
+        labels = [f'{lo:.3f} to {hi:.3f}' for lo, hi in zip(edges[:-1], edges[1:])]
+        alphas = np.linspace(0.3, 1.0, SUMMARY_PIE_BINS)
+        colors = [matplotlib.colors.to_rgba(summary_color, alpha) for alpha in alphas]
+        # Leave very small slices unlabeled so their labels do not pile up
+        shares = counts[keep] / n
+        labels = [label if share >= 0.02 else '' for label, share in zip(np.array(labels)[keep], shares)]
+        ax.pie(counts[keep], labels=labels, colors=np.array(colors)[keep], autopct=lambda pct: f'{pct:.1f}%' if pct >= 2 else '', startangle=140)
+        ax.set_title(f'Pie Chart of CLIP Score Ranges ({n} images)', fontsize=14)
+        xlabel = ylabel = ''
+    elif summary_chart_type == 9:  # Heatmap
+        cols = math.ceil(math.sqrt(n * 2))
+        rows = math.ceil(n / cols)
+        grid = np.full(rows * cols, np.nan)
+        grid[:n] = scores
+        image = ax.imshow(grid.reshape(rows, cols), aspect='auto', cmap='coolwarm', interpolation='nearest')
+        figure.colorbar(image, ax=ax)
+        ax.set_title(f'Heatmap of CLIP Scores ({n} images, {cols} per row)', fontsize=14)
+        xlabel, ylabel = f'{xlabel} (column)', f'{xlabel} (row)'
+    elif summary_chart_type == 10:  # 3D Scatter Plot
+        x, y = minmax_downsample(positions, scores, SUMMARY_MAX_POINTS)
+        z_data = np.random.rand(len(x))  # Example Z-axis data
+        ax.scatter(x, y, z_data, color=summary_color, s=6)
+        ax.set_zlabel('Random Z', fontsize=12)
+        ax.set_title(f'3D Scatter Plot of CLIP Scores ({n} images)', fontsize=14)
+
+    ax.set_xlabel(xlabel, fontsize=12)
+    ax.set_ylabel(ylabel, fontsize=12)
+    figure.tight_layout()
+    figure.savefig(batch_chart_path)
+
+
+# Function to draw and save the batch-wide chart
+def render_summary_chart(image_names, clip_scores, summary_chart_type, summary_color, advanced_settings, charts_dir, large_threshold=LARGE_SUMMARY_THRESHOLD):
+    """
+    Draws the batch-wide chart of all scores and saves it as `clip_scores_summary.png`.
+    With more than `large_threshold` images an aggregated chart is drawn instead
+    (see render_large_summary_chart).
+    """
+    if len(clip_scores) > large_threshold:
+        batch_chart_path = os.path.join(charts_dir, "clip_scores_summary.png")
+        render_large_summary_chart(clip_scores, summary_chart_type, summary_color, advanced_settings, batch_chart_path)
+        logger.info(f"Batch-wide chart ({len(clip_scores)} images, aggregated) saved to {batch_chart_path}")
+        return
+
     # Batch-wide chart
     plt.figure(figsize=advanced_settings['figsize'])
     if summary_chart_type == 1:  # Line Chart
@@ -52,6 +450,7 @@ def visualize(scores, summary_chart_type, summary_color, advanced_settings, char
         plt.xticks([1], ['CLIP Scores'], fontsize=12)
         plt.title('Box Plot of CLIP Scores', fontsize=14)
     elif summary_chart_type == 6:  # Violin Plot
+        import seaborn as sns
         sns.violinplot(data=clip_scores, color=summary_color)
         plt.xticks([0], ['CLIP Scores'], fontsize=12)
         plt.title('Violin Plot of CLIP Scores', fontsize=14)
@@ -64,6 +463,7 @@ def visualize(scores, summary_chart_type, summary_color, advanced_settings, char
         plt.pie(clip_scores, labels=image_names, colors=[summary_color] * len(image_names), autopct='%1.1f%%', startangle=140)
         plt.title('Pie Chart of CLIP Scores', fontsize=14)
     elif summary_chart_type == 9:  # Heatmap
+        import seaborn as sns
         data = np.array(clip_scores).reshape(1, -1)
         sns.heatmap(data, annot=True, fmt='.2f', cmap='coolwarm', cbar=True)
         plt.yticks([0.5], ['CLIP Scores'], rotation=0)
@@ -88,34 +488,45 @@ def visualize(scores, summary_chart_type, summary_color, advanced_settings, char
     batch_chart_path = os.path.join(charts_dir, "clip_scores_summary.png")
     plt.tight_layout()
     plt.savefig(batch_chart_path)
-    print(f"Batch-wide chart saved to {batch_chart_path}")
+    logger.info(f"Batch-wide chart saved to {batch_chart_path}")
     plt.close()
 
-    # Single-image charts
-    for score in scores:
-        plt.figure(figsize=advanced_settings['figsize'])
-        if single_chart_type == 1:  # Line Chart
-            plt.plot([f"Target_{score['image_index']}"], [score['clip_score']], marker='o', color=single_chart_color)
-        elif single_chart_type == 2:  # Histogram
-            plt.bar([f"Target_{score['image_index']}"], [score['clip_score']], color=single_chart_color, width=0.4)
-        elif single_chart_type == 3:  # Dot Chart
-            plt.scatter([f"Target_{score['image_index']}"], [score['clip_score']], color=single_chart_color, s=100)
-        elif single_chart_type == 4:  # Scatter Chart
-            plt.scatter([score['image_index']], [score['clip_score']], color=single_chart_color, s=100)
-        elif single_chart_type == 5:  # Box Plot
-            plt.boxplot([score['clip_score']], patch_artist=True, boxprops=dict(facecolor=single_chart_color))
-        elif single_chart_type == 6:  # Violin Plot
-            sns.violinplot(data=[score['clip_score']], color=single_chart_color)
-        elif single_chart_type == 7:  # Area Chart
-            plt.fill_between([f"Target_{score['image_index']}"], [score['clip_score']], color=single_chart_color, alpha=0.5)
-            plt.plot([f"Target_{score['image_index']}"], [score['clip_score']], color=single_chart_color)
-
-        plt.ylim(global_ymin, global_ymax)  # Ensure consistent y-axis range across all single-image charts
-        plt.title(f"CLIP Score for Target_{score['image_index']}", fontsize=14)
-        plt.xlabel("Image", fontsize=12)
-        plt.ylabel("CLIP Score", fontsize=12)
-        single_chart_path = os.path.join(images_chart_dir, f"Target_{score['image_index']}_chart.png")
-        plt.tight_layout()
-        plt.savefig(single_chart_path)
-        print(f"Single-image chart saved to {single_chart_path}")
-        plt.close()
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    from chart_selection import DEFAULT_COLOR, parse_figsize, parse_grid, validate_chart_type, validate_color
+    from result_writers import load_results
+
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Render charts for the results of a scored batch folder.")
+    parser.add_argument("batch_folder", type=str, help="Batch folder containing a results/ subfolder (e.g., Batches/Batch_3).")
+    parser.add_argument("--summary_chart_type", type=validate_chart_type, default=1, help="Summary chart type (1-10).")
+    parser.add_argument("--summary_chart_color", type=validate_color, default=DEFAULT_COLOR, help="Summary chart color as a hex code.")
+    parser.add_argument("--single_chart_type", type=validate_chart_type, default=1, help="Single-image chart type (1-10).")
+    parser.add_argument("--single_chart_color", type=validate_color, default=DEFAULT_COLOR, help="Single-image chart color as a hex code.")
+    parser.add_argument("--figsize", type=parse_figsize, default=(12, 6), help="Figure size as width,height.")
+    parser.add_argument("--xlabel", type=str, default="Images", help="x-axis label of the summary chart.")
+    parser.add_argument("--ylabel", type=str, default="CLIP Scores", help="y-axis label of the summary chart.")
+    parser.add_argument("--contact_sheet", type=parse_grid, default=None, help="Pack single-image charts into contact sheets of rowsxcols charts.")
+    parser.add_argument("--chart_workers", type=int, default=0, help="Number of worker processes rendering single-image charts.")
+    args = parser.parse_args()
+
+    scores = load_results(os.path.join(args.batch_folder, "results"))
+    if not scores:
+        logger.error(f"No results found in {args.batch_folder}.")
+        sys.exit(1)
+
+    visualize(
+        scores,
+        args.summary_chart_type,
+        args.summary_chart_color,
+        {"figsize": args.figsize, "xlabel": args.xlabel, "ylabel": args.ylabel},
+        os.path.join(args.batch_folder, "charts"),
+        os.path.join(args.batch_folder, "images_chart"),
+        single_chart_type=args.single_chart_type,
+        single_chart_color=args.single_chart_color,
+        contact_sheet=args.contact_sheet,
+        chart_workers=args.chart_workers
+    )